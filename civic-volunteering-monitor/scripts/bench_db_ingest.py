@@ -0,0 +1,79 @@
+"""Bulk-ingest benchmark: per-row commits in rollback-journal mode vs. WAL + DbWriter batching.
+
+    python scripts/bench_db_ingest.py --docs 2000 --threads 8
+"""
+from __future__ import annotations
+
+import argparse
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from monitor.store.db import connect, get_or_create_document, get_or_create_source, init_db, upsert_document_version
+from monitor.store.writer import DbWriter
+
+
+def ingest_one(conn, jurisdiction_id: str, i: int) -> None:
+    source_id = get_or_create_source(conn, jurisdiction_id, f"https://{jurisdiction_id}.kommune.no/dok/{i}.pdf", f"Dok {i}")
+    document_id = get_or_create_document(conn, source_id, "PDF")
+    upsert_document_version(conn, document_id, f"{jurisdiction_id}-{i:064d}", http_status=200, content_type="application/pdf")
+
+
+def legacy(path: Path, docs: int, threads: int) -> float:
+    conn = connect(f"sqlite:///{path}")
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.execute("PRAGMA synchronous=FULL")
+    init_db(conn)
+    lock = threading.Lock()
+
+    def work(t: int) -> None:
+        for i in range(t, docs, threads):
+            with lock:
+                ingest_one(conn, f"k{t}", i)
+
+    return _timed(work, threads)
+
+
+def batched(path: Path, docs: int, threads: int) -> float:
+    conn = connect(f"sqlite:///{path}")
+    init_db(conn)
+    writer = DbWriter(conn)
+
+    def work(t: int) -> None:
+        for i in range(t, docs, threads):
+            writer.submit(ingest_one, f"k{t}", i)
+
+    elapsed = _timed(work, threads, after=writer.close)
+    print(f"  {writer.calls} kall i {writer.batches} transaksjoner")
+    return elapsed
+
+
+def _timed(work, threads: int, after=None) -> float:
+    started = time.perf_counter()
+    pool = [threading.Thread(target=work, args=(t,)) for t in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    if after:
+        after()
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old = legacy(Path(tmp) / "legacy.db", args.docs, args.threads)
+        print(f"per-rad commit (journal=DELETE) {old:8.2f} s  {args.docs / old:8.0f} dok/s")
+        new = batched(Path(tmp) / "batched.db", args.docs, args.threads)
+        print(f"WAL + DbWriter                  {new:8.2f} s  {args.docs / new:8.0f} dok/s")
+        print(f"speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
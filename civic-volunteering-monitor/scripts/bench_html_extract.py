@@ -0,0 +1,74 @@
+"""Microbenchmark: legacy html.parser/regex passes vs. the single lxml parse in parse_page.
+
+    python scripts/bench_html_extract.py --corpus data/pages   # *.html saved from real crawls
+    python scripts/bench_html_extract.py                       # synthetic CMS-like pages
+"""
+from __future__ import annotations
+
+import argparse
+import re
+import time
+from pathlib import Path
+
+from monitor.crawl.html_extract import extract_links, html_looks_js_driven, parse_page
+from monitor.parse.content_clean import clean_text
+
+
+def legacy_main_text(html: str) -> str:
+    no_script = re.sub(r"<script[\s\S]*?</script>", " ", html, flags=re.IGNORECASE)
+    no_style = re.sub(r"<style[\s\S]*?</style>", " ", no_script, flags=re.IGNORECASE)
+    return clean_text(re.sub(r"<[^>]+>", " ", no_style))
+
+
+def legacy(url: str, html: str) -> None:
+    extract_links(url, html)
+    html_looks_js_driven(html)
+    legacy_main_text(html)
+
+
+def synthetic_corpus(n: int = 50) -> list[str]:
+    nav = "".join(f'<li><a href="/meny/{i}">Meny {i}</a></li>' for i in range(150))
+    body = "".join(
+        f'<article><h2>Sak {i}</h2><p>Kommunestyret behandlet frivillighetsplan og tilskudd. '
+        f'<a href="/saker/{i}">Les mer</a> <a href="/dokumenter/{i}.pdf">Vedlegg</a></p></article>'
+        for i in range(300)
+    )
+    scripts = "".join(f"<script>window.x{i} = {{a: {i}}};</script>" for i in range(20))
+    page = f"<html><head>{scripts}<style>.a{{}}</style></head><body><nav><ul>{nav}</ul></nav><main>{body}</main><footer>Kontakt</footer></body></html>"
+    return [page] * n
+
+
+def bench(label: str, fn, pages: list[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for html in pages:
+            fn("https://example.kommune.no/", html)
+        best = min(best, time.perf_counter() - started)
+    total_mb = sum(len(p) for p in pages) / 1e6
+    print(f"{label:<28} {best * 1000:8.1f} ms  {total_mb / best:7.1f} MB/s")
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="Mappe med lagrede .html-sider")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.corpus:
+        pages = [p.read_text(encoding="utf-8", errors="replace") for p in sorted(Path(args.corpus).glob("**/*.html"))]
+    else:
+        pages = synthetic_corpus()
+    if not pages:
+        raise SystemExit("Ingen sider i korpuset")
+    print(f"{len(pages)} sider, {sum(len(p) for p in pages) / 1e6:.1f} MB")
+
+    only_links = bench("extract_links", extract_links, pages, args.repeat)
+    old = bench("legacy (links+js+text)", legacy, pages, args.repeat)
+    new = bench("parse_page", parse_page, pages, args.repeat)
+    print(f"parse_page vs extract_links: {only_links / new:.1f}x, vs legacy total: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import importlib
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+from monitor.classify.classify_doc import build_prompt, classify_cache_key
+from monitor.classify.llm_client import chat_request, get_llm_client, llm_model
+from monitor.stages import CACHE_LLM, count_cache
+from monitor.store.db import (
+    BATCH_OPEN_STATUSES,
+    create_llm_batch,
+    llm_batch_items,
+    load_llm_cache,
+    open_llm_batches,
+    save_llm_cache,
+    unclassified_versions,
+    update_llm_batch,
+)
+from monitor.store.writer import DbWriter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchStatus:
+    status: str
+    # JSONL result lines (output and error files together) once the batch has finished.
+    output: str | None = None
+    error: str | None = None
+
+
+class OpenAIBatchTransport:
+    # A transport is anything with submit(path) -> batch id and poll(batch id) -> BatchStatus; choose another one
+    # with LLM_BATCH_TRANSPORT=package.module:Class.
+    def __init__(self, settings):
+        self.client = get_llm_client(settings)[0]
+        self.endpoint = batch_endpoint(settings)
+
+    def submit(self, path: Path) -> str:
+        with open(path, "rb") as fh:
+            uploaded = self.client.files.create(file=fh, purpose="batch")
+        return self.client.batches.create(input_file_id=uploaded.id, endpoint=self.endpoint, completion_window="24h").id
+
+    def poll(self, batch_id: str) -> BatchStatus:
+        batch = self.client.batches.retrieve(batch_id)
+        output = None
+        if batch.status not in BATCH_OPEN_STATUSES:
+            files = [fid for fid in (batch.output_file_id, batch.error_file_id) if fid]
+            output = "\n".join(self.client.files.content(fid).text for fid in files)
+        errors = batch.errors.data if batch.errors and batch.errors.data else []
+        return BatchStatus(batch.status, output, "; ".join(e.message or "" for e in errors) or None)
+
+
+BATCH_TRANSPORTS = {"openai": OpenAIBatchTransport}
+
+
+def batch_endpoint(settings) -> str:
+    return "/chat/completions" if settings.openai_provider == "azure" else "/v1/chat/completions"
+
+
+def get_batch_transport(settings):
+    name = settings.llm_batch_transport
+    if name in BATCH_TRANSPORTS:
+        return BATCH_TRANSPORTS[name](settings)
+    module, _, attr = name.partition(":")
+    return getattr(importlib.import_module(module), attr)(settings)
+
+
+def write_batch_file(conn, settings, path: Path) -> tuple[list[tuple[int, str, str]], int]:
+    # One request per distinct cache key: versions with the same text share a custom_id and are filled together.
+    # Versions whose answer is already cached are filled here and never sent.
+    items: list[tuple[int, str, str]] = []
+    custom_ids: dict[str, str] = {}
+    cached = 0
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh:
+        for v in unclassified_versions(conn):
+            key = classify_cache_key(settings, v["extracted_text"])
+            hit = load_llm_cache(conn, key)
+            if hit is not None:
+                conn.execute("UPDATE document_versions SET llm_json=? WHERE id=?", (hit["response_json"], v["id"]))
+                count_cache(conn, v["run_id"], CACHE_LLM, True, hit["tokens"] or 0)
+                cached += 1
+                continue
+            if key not in custom_ids:
+                custom_ids[key] = f"version-{v['id']}"
+                meta = {"url": v["url"], "title": v["title"], "jurisdiction": v["jurisdiction"], "doc_type": v["doc_type"]}
+                line = {
+                    "custom_id": custom_ids[key],
+                    "method": "POST",
+                    "url": batch_endpoint(settings),
+                    "body": chat_request(settings, build_prompt(settings, v["extracted_text"], meta)),
+                }
+                fh.write(json.dumps(line, ensure_ascii=False) + "\n")
+            items.append((v["id"], custom_ids[key], key))
+    conn.commit()
+    return items, cached
+
+
+def submit_batch(settings, writer: DbWriter, transport, out_dir: str, run_id: int | None = None) -> tuple[str | None, int, int]:
+    # Store work runs on the writer (one transaction each); the upload itself happens outside any transaction.
+    path = Path(out_dir) / f"llm_batch_{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}.jsonl"
+    items, cached = writer.call(write_batch_file, settings, path)
+    if not items:
+        path.unlink(missing_ok=True)
+        return None, 0, cached
+    requests = len({custom_id for _, custom_id, _ in items})
+    batch_id = transport.submit(path)
+    writer.call(create_llm_batch, batch_id, run_id, str(path), items)
+    logger.info("batch %s sendt: %d forespørsler for %d versjoner (%d fra cache)", batch_id, requests, len(items), cached)
+    return batch_id, requests, cached
+
+
+def ingest_batch_output(conn, settings, batch_id: str, output: str) -> tuple[int, int]:
+    by_custom_id: dict[str, list] = {}
+    for item in llm_batch_items(conn, batch_id):
+        by_custom_id.setdefault(item["custom_id"], []).append(item)
+    updates, succeeded, failed = [], 0, 0
+    for raw in output.splitlines():
+        if not raw.strip():
+            continue
+        try:
+            line = json.loads(raw)
+        except json.JSONDecodeError as exc:
+            # A truncated line names no custom_id; its versions stay unclassified and go in a later batch.
+            logger.warning("batch %s: ugyldig resultatlinje: %s", batch_id, exc)
+            failed += 1
+            continue
+        items = by_custom_id.get(line.get("custom_id"), [])
+        response = line.get("response") or {}
+        try:
+            if response.get("status_code") != 200:
+                raise ValueError((line.get("error") or {}).get("message") or f"status {response.get('status_code')}")
+            body = response["body"]
+            llm_json = json.loads(body["choices"][0]["message"]["content"] or "{}")
+        except (KeyError, IndexError, ValueError) as exc:
+            logger.warning("batch %s: %s feilet: %s", batch_id, line.get("custom_id"), exc)
+            failed += len(items)
+            continue
+        if not items:
+            continue
+        save_llm_cache(conn, items[0]["cache_key"], llm_model(settings), llm_json, (body.get("usage") or {}).get("total_tokens", 0))
+        text = json.dumps(llm_json, ensure_ascii=False)
+        for item in items:
+            updates.append((text, item["version_id"]))
+            count_cache(conn, item["run_id"], CACHE_LLM, False)
+        succeeded += len(items)
+    conn.executemany("UPDATE document_versions SET llm_json=? WHERE id=? AND llm_json IS NULL", updates)
+    conn.commit()
+    return succeeded, failed
+
+
+def poll_batches(settings, writer: DbWriter, transport) -> list[tuple[str, str, int, int]]:
+    results = []
+    for batch in writer.call(open_llm_batches):
+        status = transport.poll(batch["id"])
+        succeeded = failed = 0
+        if status.status not in BATCH_OPEN_STATUSES and status.output:
+            succeeded, failed = writer.call(ingest_batch_output, settings, batch["id"], status.output)
+        writer.call(update_llm_batch, batch["id"], status.status, succeeded, failed, status.error)
+        results.append((batch["id"], status.status, succeeded, failed))
+    return results
@@ -1,19 +1,16 @@
 from __future__ import annotations
 
-from monitor.classify.llm_client import classify_json
+import hashlib
+import json
+
+from monitor.classify.llm_client import complete_json, llm_model
 from monitor.classify.prompts import SYSTEM_PROMPT
 from monitor.store.dedupe import truncate_for_llm
 
+# Bump when the JSON schema below changes; cached responses for the old schema are then ignored.
+SCHEMA_VERSION = 1
 
-def classify_document(settings, text: str, metadata: dict) -> dict:
-    truncated = truncate_for_llm(text, settings.llm_max_chars)
-    prompt = f"""{SYSTEM_PROMPT}
-Metadata: {metadata}
-Tekst:
-{truncated}
-
-JSON-skjema:
-- category
+SCHEMA = """- category
 - confidence (0-1)
 - summary (maks 1200 tegn)
 - key_points (3-7)
@@ -24,4 +21,24 @@ JSON-skjema:
 - named_entities (liste)
 - suggested_followups (liste)
 """
-    return classify_json(settings, prompt)
+
+
+def build_prompt(settings, text: str, metadata: dict) -> str:
+    truncated = truncate_for_llm(text, settings.llm_max_chars)
+    return f"""{SYSTEM_PROMPT}
+Metadata: {metadata}
+Tekst:
+{truncated}
+
+JSON-skjema:
+{SCHEMA}"""
+
+
+def classify_cache_key(settings, text: str) -> str:
+    # Metadata is left out on purpose: the same text hosted by many kommuner should hit the same entry.
+    payload = [llm_model(settings), SYSTEM_PROMPT, SCHEMA_VERSION, truncate_for_llm(text, settings.llm_max_chars)]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode()).hexdigest()
+
+
+def classify_document(settings, text: str, metadata: dict) -> tuple[dict, int]:
+    return complete_json(settings, build_prompt(settings, text, metadata))
@@ -1,30 +1,166 @@
 from __future__ import annotations
 
 import json
+import logging
+import threading
+import time
 
-from openai import AzureOpenAI, OpenAI
+from openai import APIConnectionError, APIStatusError, AzureOpenAI, OpenAI, RateLimitError
 
+logger = logging.getLogger(__name__)
 
-def classify_json(settings, prompt: str) -> dict:
+MAX_BACKOFF_SECONDS = 60.0
+# Rough token estimate for budgeting before the request; the real usage corrects it afterwards.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str, max_output: int = 1000) -> int:
+    return len(text) // CHARS_PER_TOKEN + max_output
+
+
+class LLMThrottle:
+    # Two token buckets, requests/min and tokens/min, as the provider counts them. Like the crawl limiter it hands
+    # out waiting times instead of sleeping under the lock, and a 429 pauses everyone until Retry-After.
+    def __init__(self, rpm: float, tpm: float, clock=time.monotonic):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._clock = clock
+        self._lock = threading.Lock()
+        now = clock()
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = now
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._requests = min(float(self.rpm), self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(float(self.tpm), self._tokens + elapsed * self.tpm / 60)
+        self._updated = now
+
+    def reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._requests -= 1
+            self._tokens -= min(tokens, self.tpm)
+            delay = max(
+                -self._requests * 60 / self.rpm if self._requests < 0 else 0.0,
+                -self._tokens * 60 / self.tpm if self._tokens < 0 else 0.0,
+            )
+            return max(delay, self._blocked_until - now)
+
+    def settle(self, estimated: int, actual: int) -> None:
+        # reserve() never takes more than a minute's budget, so that is all there is to give back.
+        with self._lock:
+            self._tokens += min(estimated, self.tpm) - actual
+
+    def block(self, seconds: float) -> None:
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+    def wait(self, tokens: int) -> None:
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+
+_clients: dict[tuple, tuple] = {}
+_clients_lock = threading.Lock()
+
+
+def _client_key(settings) -> tuple:
     if settings.openai_provider == "azure":
-        client = AzureOpenAI(
-            api_key=settings.azure_openai_api_key,
-            azure_endpoint=settings.azure_openai_endpoint,
-            api_version=settings.azure_openai_api_version,
-        )
-        model = settings.azure_openai_deployment
-    else:
-        client = OpenAI(api_key=settings.openai_api_key)
-        model = settings.openai_model
-
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=0,
-        response_format={"type": "json_object"},
-        messages=[
+        return ("azure", settings.azure_openai_api_key, settings.azure_openai_endpoint, settings.azure_openai_api_version)
+    return ("openai", settings.openai_api_key, settings.openai_base_url)
+
+
+def get_llm_client(settings):
+    # One client (and so one HTTP connection pool) per configuration, shared by all classification threads.
+    # Retries are ours: the SDK's own would bypass the throttle.
+    key = _client_key(settings)
+    with _clients_lock:
+        if key not in _clients:
+            if settings.openai_provider == "azure":
+                client = AzureOpenAI(
+                    api_key=settings.azure_openai_api_key,
+                    azure_endpoint=settings.azure_openai_endpoint,
+                    api_version=settings.azure_openai_api_version,
+                    max_retries=0,
+                )
+            else:
+                client = OpenAI(api_key=settings.openai_api_key, base_url=settings.openai_base_url or None, max_retries=0)
+            _clients[key] = (client, LLMThrottle(settings.llm_rpm, settings.llm_tpm))
+        return _clients[key]
+
+
+def close_llm_clients() -> None:
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client, _ in clients:
+        client.close()
+
+
+def _retryable(exc: Exception) -> bool:
+    # APITimeoutError is an APIConnectionError; 4xx other than 429 would fail the same way again.
+    return isinstance(exc, (APIConnectionError, RateLimitError)) or (isinstance(exc, APIStatusError) and exc.status_code >= 500)
+
+
+def _retry_after(exc: RateLimitError, attempt: int) -> float:
+    value = exc.response.headers.get("retry-after") if exc.response is not None else None
+    try:
+        return min(float(value), MAX_BACKOFF_SECONDS)
+    except (TypeError, ValueError):
+        return min(2.0**attempt, MAX_BACKOFF_SECONDS)
+
+
+def llm_model(settings) -> str:
+    return settings.azure_openai_deployment if settings.openai_provider == "azure" else settings.openai_model
+
+
+def chat_request(settings, prompt: str) -> dict:
+    # Shared by live calls and the batch file, so both send exactly the same request.
+    return {
+        "model": llm_model(settings),
+        "temperature": 0,
+        "response_format": {"type": "json_object"},
+        "messages": [
             {"role": "system", "content": "Returner kun JSON."},
             {"role": "user", "content": prompt},
         ],
-    )
-    content = resp.choices[0].message.content or "{}"
-    return json.loads(content)
+    }
+
+
+def classify_json(settings, prompt: str) -> dict:
+    return complete_json(settings, prompt)[0]
+
+
+def complete_json(settings, prompt: str) -> tuple[dict, int]:
+    # Returns the parsed JSON and the tokens the call cost.
+    client, throttle = get_llm_client(settings)
+    estimated = estimate_tokens(prompt)
+    for attempt in range(settings.llm_max_retries + 1):
+        throttle.wait(estimated)
+        try:
+            resp = client.chat.completions.create(**chat_request(settings, prompt))
+        except (APIConnectionError, APIStatusError) as exc:
+            throttle.settle(estimated, 0)
+            if not _retryable(exc) or attempt == settings.llm_max_retries:
+                raise
+            if isinstance(exc, RateLimitError):
+                pause = _retry_after(exc, attempt)
+                logger.info("LLM 429, venter %.1f s (forsøk %d)", pause, attempt + 1)
+                throttle.block(pause)
+            else:
+                # Timeouts, dropped connections and 5xx only back off this call, not every thread.
+                pause = min(2.0**attempt, MAX_BACKOFF_SECONDS)
+                logger.info("LLM-feil (%s), prøver igjen om %.1f s (forsøk %d)", exc, pause, attempt + 1)
+                time.sleep(pause)
+            continue
+        tokens = resp.usage.total_tokens if resp.usage is not None else 0
+        if tokens:
+            throttle.settle(estimated, tokens)
+        content = resp.choices[0].message.content or "{}"
+        return json.loads(content), tokens
+    raise RuntimeError("unreachable")
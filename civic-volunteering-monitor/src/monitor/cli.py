@@ -3,57 +3,131 @@ from __future__ import annotations
 import argparse
 import json
 import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
 from pathlib import Path
 
 
-from monitor.classify.classify_doc import classify_document
+from monitor.classify.batch import get_batch_transport, poll_batches, submit_batch
+from monitor.classify.llm_client import close_llm_clients
 from monitor.config import load_settings
-from monitor.crawl.dispatcher import crawl_jurisdiction
-from monitor.crawl.fetch import DomainRateLimiter, fetch_with_retries
+from monitor.crawl.fetch import FETCH_STATS, configure_fetch
+from monitor.crawl.playwright_fetch import RENDER_STATS, close_browser_pool, configure_browser_pool
 from monitor.ingest.excel_loader import load_jurisdictions
 from monitor.logging_setup import setup_logging
-from monitor.parse.content_clean import extract_main_text_from_html
-from monitor.parse.doc_text import extract_docx_text
-from monitor.parse.pdf_text import extract_pdf_text
+from monitor.parse.extract_pool import configure_extract_pool
+from monitor.pipeline import JOB_JURISDICTION, enqueue_jurisdiction_jobs, run_jurisdictions, run_worker
+from monitor.stages import CACHE_LLM, CACHE_STATS, STAGE_CLASSIFY, STAGE_EXTRACT, llm_configured, run_stage, start_stage
 from monitor.report.coverage_report import write_coverage_report
+from monitor.report.fetch_stats_report import write_fetch_stats_report, write_render_stats_report
 from monitor.report.findings_report import write_findings_report
-from monitor.store.blob_store import store_blob
 from monitor.store.db import (
+    completed_jurisdictions,
     connect,
     create_run,
+    enqueue_work,
     finish_run,
-    get_or_create_document,
-    get_or_create_source,
+    fts_query,
     init_db,
     insert_status,
-    upsert_document_version,
+    job_counts,
+    open_llm_batches,
+    run_cache_stats,
+    run_exists,
+    run_findings,
+    run_status_rows,
+    search_texts,
     upsert_jurisdiction,
+    work_counts,
 )
-from monitor.store.dedupe import sha256_bytes
-from monitor.store.models import COVERAGE_STATUS_FAIL, COVERAGE_STATUS_OK, COVERAGE_STATUS_WARN
+from monitor.store.models import COVERAGE_STATUS_FAIL
+from monitor.store.page_cache import close_page_cache, configure_page_cache
+from monitor.store.writer import DbWriter
 
 logger = logging.getLogger(__name__)
 
 
-def _doc_ext_and_type(url: str, content_type: str) -> tuple[str, str]:
-    u = url.lower()
-    if u.endswith(".pdf") or "pdf" in content_type:
-        return "pdf", "PDF"
-    if u.endswith(".docx") or "wordprocessingml" in content_type:
-        return "docx", "DOCX"
-    return "html", "HTML"
-
-
 def cmd_ingest(args):
     settings = load_settings()
     conn = connect(settings.db_url)
     init_db(conn)
     valid, invalid = load_jurisdictions(args.excel)
-    for row in valid:
-        upsert_jurisdiction(conn, row)
+    with DbWriter(conn) as writer:
+        for row in valid:
+            writer.submit(upsert_jurisdiction, row)
     print(f"Ingest OK: {len(valid)} gyldige, {len(invalid)} ugyldige")
 
 
+def _findings_row(r) -> dict:
+    llm = json.loads(r["llm_json"]) if r["llm_json"] else {}
+    return {
+        "jurisdiction": r["jurisdiction"],
+        "type": r["type"],
+        "title": r["title"],
+        "url": r["url"],
+        "doc_type": r["doc_type"],
+        "published_date": "",
+        "first_seen": "",
+        "last_seen": "",
+        "category": llm.get("category", ""),
+        "confidence": llm.get("confidence", ""),
+        "summary": llm.get("summary", ""),
+        "mentions_platform_ks_fn": llm.get("mentions_platform_ks_fn", False),
+    }
+
+
+def _configure_runtime(settings):
+    configure_fetch(
+        settings.max_response_mb * 1024 * 1024,
+        document_limits={"pdf": settings.max_pdf_mb * 1024 * 1024, "word": settings.max_docx_mb * 1024 * 1024},
+        spool_dir=str(Path(settings.blob_dir) / ".spool"),
+        rate_per_second=settings.rate_limit_per_second,
+        burst=settings.rate_limit_burst,
+    )
+    FETCH_STATS.reset()
+    RENDER_STATS.reset()
+    configure_browser_pool(settings.playwright_pool_size)
+    configure_extract_pool(settings.extract_workers, settings.extract_timeout, settings.extract_max_pages, settings.extract_max_memory_mb)
+    return configure_page_cache(settings.page_cache_path, settings.page_cache_max_age_days, settings.page_cache_max_mb)
+
+
+def _crawl_with_stages(settings, conn, crawl):
+    page_cache = _configure_runtime(settings)
+    # From here on the connection belongs to the writer thread until every stage is done.
+    writer = DbWriter(conn)
+    crawl_done = threading.Event()
+    stage_threads = []
+    extract_thread, extract_done = start_stage(settings, writer, STAGE_EXTRACT, _extract_workers(settings), crawl_done)
+    stage_threads.append(extract_thread)
+    if llm_configured(settings):
+        stage_threads.append(start_stage(settings, writer, STAGE_CLASSIFY, settings.llm_concurrency, extract_done)[0])
+    try:
+        return crawl(writer)
+    finally:
+        crawl_done.set()
+        close_browser_pool()
+        if page_cache:
+            logger.info("sidecache: %d treff, %d bommer", page_cache.hits, page_cache.misses)
+        close_page_cache()
+        for t in stage_threads:
+            t.join()
+        close_llm_clients()
+        writer.close()
+        logger.info("database: %d skrivekall i %d transaksjoner", writer.calls, writer.batches)
+
+
+def _log_cache_stats(conn, run_id: int) -> None:
+    for r in run_cache_stats(conn, run_id):
+        total = r["hits"] + r["misses"]
+        logger.info(
+            "cache %s: %d treff av %d (%.0f%%), spart %d",
+            r["cache"], r["hits"], total, 100 * r["hits"] / total if total else 0, r["saved"],
+        )
+
+
 def cmd_run(args):
     settings = load_settings()
     output_dir = args.output
@@ -61,14 +135,22 @@ def cmd_run(args):
 
     conn = connect(settings.db_url)
     init_db(conn)
-    run_id = create_run(conn)
+    if args.resume:
+        if not run_exists(conn, args.resume):
+            raise SystemExit(f"Fant ikke run_id={args.resume}")
+        run_id = args.resume
+    else:
+        run_id = create_run(conn)
     setup_logging(run_id, output_dir)
 
     valid, invalid = load_jurisdictions(args.excel)
-    coverage_rows = []
-    findings_rows = []
+    done = completed_jurisdictions(conn, run_id)
+    if done:
+        logger.info("run %d: %d jurisdiksjoner er allerede ferdige og hoppes over", run_id, len(done))
 
     for inv in invalid:
+        if inv["jurisdiction_id"] in done:
+            continue
         row = {
             "run_id": run_id,
             "jurisdiction_id": inv["jurisdiction_id"],
@@ -80,131 +162,87 @@ def cmd_run(args):
             "pages_fetched": 0,
             "docs_found": 0,
             "docs_downloaded": 0,
+            "docs_not_modified": 0,
+            "fetches_saved": 0,
             "error_message": inv["error"],
             "notes": "invalid_input",
         }
-        coverage_rows.append(row)
         insert_status(conn, row)
 
-    for j in valid:
-        upsert_jurisdiction(conn, j)
-        docs_downloaded = 0
-        try:
-            result = crawl_jurisdiction(j.website, settings.request_timeout, settings.user_agent, settings.playwright_enabled)
-            limiter = DomainRateLimiter(max_per_second=2.0)
-
-            for item in result.docs_found:
-                url = item["url"]
-                title = item.get("title", "")
-                try:
-                    r = fetch_with_retries(url, settings.user_agent, settings.request_timeout, limiter=limiter)
-                    if r.status_code != 200:
-                        continue
-                    ext, dtype = _doc_ext_and_type(url, r.headers.get("Content-Type", ""))
-                    content = r.content if ext != "html" else r.text.encode("utf-8")
-                    content_hash = sha256_bytes(content)
-                    source_id = get_or_create_source(conn, j.jurisdiction_id, url, title)
-                    document_id = get_or_create_document(conn, source_id, dtype)
-
-                    text = ""
-                    needs_ocr = False
-                    if ext == "pdf":
-                        text, needs_ocr = extract_pdf_text(content)
-                    elif ext == "docx":
-                        text = extract_docx_text(content)
-                    else:
-                        text = extract_main_text_from_html(r.text)
-
-                    blob_path = store_blob(settings.blob_dir, j.jurisdiction_id, content_hash, ext, content)
-                    version_id, changed = upsert_document_version(
-                        conn,
-                        document_id,
-                        content_hash,
-                        http_status=r.status_code,
-                        content_type=r.headers.get("Content-Type"),
-                        etag=r.headers.get("ETag"),
-                        last_modified=r.headers.get("Last-Modified"),
-                        blob_path=blob_path,
-                        extracted_text=text,
-                        needs_ocr=needs_ocr,
-                    )
-                    docs_downloaded += 1
-
-                    if changed and text.strip() and (settings.openai_api_key or settings.azure_openai_api_key):
-                        meta = {"url": url, "title": title, "jurisdiction": j.name, "doc_type": dtype}
-                        try:
-                            llm_json = classify_document(settings, text, meta)
-                            conn.execute("UPDATE document_versions SET llm_json=? WHERE id=?", (json.dumps(llm_json, ensure_ascii=False), version_id))
-                            conn.commit()
-                        except Exception as llm_exc:
-                            logger.warning("LLM feilet for %s: %s", url, llm_exc)
-                            llm_json = {}
-                        findings_rows.append(
-                            {
-                                "jurisdiction": j.name,
-                                "type": j.type,
-                                "title": title,
-                                "url": url,
-                                "doc_type": dtype,
-                                "published_date": "",
-                                "first_seen": "",
-                                "last_seen": "",
-                                "category": llm_json.get("category", ""),
-                                "confidence": llm_json.get("confidence", ""),
-                                "summary": llm_json.get("summary", ""),
-                                "mentions_platform_ks_fn": llm_json.get("mentions_platform_ks_fn", False),
-                            }
-                        )
-                except Exception as exc:
-                    logger.warning("dokumentfeil %s: %s", url, exc)
-
-            status = COVERAGE_STATUS_OK if result.http_errors == 0 and result.timeouts == 0 else COVERAGE_STATUS_WARN
-            row = {
-                "run_id": run_id,
-                "jurisdiction_id": j.jurisdiction_id,
-                "name": j.name,
-                "website": j.website,
-                "status": status,
-                "http_errors_count": result.http_errors,
-                "timeouts_count": result.timeouts,
-                "pages_fetched": result.pages_fetched,
-                "docs_found": len(result.docs_found),
-                "docs_downloaded": docs_downloaded,
-                "error_message": "",
-                "notes": ";".join(sorted(set(result.notes))),
-            }
-            coverage_rows.append(row)
-            insert_status(conn, row)
-        except Exception as exc:
-            row = {
-                "run_id": run_id,
-                "jurisdiction_id": j.jurisdiction_id,
-                "name": j.name,
-                "website": j.website,
-                "status": COVERAGE_STATUS_FAIL,
-                "http_errors_count": 0,
-                "timeouts_count": 0,
-                "pages_fetched": 0,
-                "docs_found": 0,
-                "docs_downloaded": 0,
-                "error_message": str(exc),
-                "notes": "crawl_failed",
-            }
-            coverage_rows.append(row)
-            insert_status(conn, row)
-
+    pending = [j for j in valid if j.jurisdiction_id not in done]
+    if args.enqueue_only:
+        # `monitor worker --run-id` processes on one or more machines drain the run instead.
+        with DbWriter(conn) as writer:
+            enqueue_jurisdiction_jobs(writer, run_id, pending)
+        print(f"run_id={run_id}\njobber={len(pending)}")
+        return
+
+    max_concurrency = args.max_concurrency or settings.max_concurrency
+    _crawl_with_stages(
+        settings,
+        conn,
+        lambda writer: run_jurisdictions(settings, conn, run_id, pending, max_concurrency, resume=bool(args.resume), writer=writer),
+    )
     finish_run(conn, run_id)
+    _log_cache_stats(conn, run_id)
+
+    # Reports are built from the store in Excel order, so resumed runs include work from the earlier attempt.
+    order = {jid: idx for idx, jid in enumerate([i["jurisdiction_id"] for i in invalid] + [j.jurisdiction_id for j in valid])}
+    coverage_rows = sorted(run_status_rows(conn, run_id), key=lambda r: order.get(r["jurisdiction_id"], len(order)))
+    findings_rows = [
+        _findings_row(r)
+        for r in sorted(run_findings(conn, run_id), key=lambda r: order.get(r["jurisdiction_id"], len(order)))
+    ]
     cov = write_coverage_report(coverage_rows, output_dir, run_id)
     fin = write_findings_report(findings_rows, output_dir, run_id)
-    print(f"run_id={run_id}\ncoverage={cov}\nfindings={fin}")
+    host_rows = FETCH_STATS.rows()
+    fst = write_fetch_stats_report(host_rows, output_dir, run_id)
+    logger.info(
+        "fetch: %d verter, %d forespørsler, %d håndtrykk, %d bytes over nett (%d dekodet)",
+        len(host_rows),
+        sum(r["requests"] for r in host_rows),
+        sum(r["handshakes"] for r in host_rows),
+        sum(r["bytes_wire"] for r in host_rows),
+        sum(r["bytes_decoded"] for r in host_rows),
+    )
+    render_rows = RENDER_STATS.rows()
+    if render_rows:
+        write_render_stats_report(render_rows, output_dir, run_id)
+        logger.info(
+            "rendering: %d sider, snitt %d ms",
+            len(render_rows),
+            sum(r["render_ms"] for r in render_rows) // len(render_rows),
+        )
+    print(f"run_id={run_id}\ncoverage={cov}\nfindings={fin}\nfetch_stats={fst}")
+
+
+def cmd_worker(args):
+    settings = load_settings()
+    conn = connect(settings.db_url)
+    init_db(conn)
+    if not run_exists(conn, args.run_id):
+        raise SystemExit(f"Fant ikke run_id={args.run_id}")
+    setup_logging(args.run_id, args.output)
+    owner = args.worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    max_concurrency = args.max_concurrency or settings.max_concurrency
+    processed = _crawl_with_stages(
+        settings,
+        conn,
+        lambda writer: run_worker(settings, writer, args.run_id, owner, max_concurrency, settings.job_lease_seconds),
+    )
+    counts = job_counts(conn, args.run_id, JOB_JURISDICTION)
+    # Whichever worker finds the queue empty closes the run; `monitor report` builds the reports afterwards.
+    if not counts.get("pending") and not counts.get("leased"):
+        finish_run(conn, args.run_id)
+    _log_cache_stats(conn, args.run_id)
+    print(f"worker={owner}\njurisdiksjoner={processed}\njobber={counts}")
 
 
 def cmd_report(args):
     settings = load_settings()
     conn = connect(settings.db_url)
-    rows = [dict(r) for r in conn.execute("SELECT * FROM crawl_run_jurisdiction_status WHERE run_id=?", (args.run_id,)).fetchall()]
+    rows = [dict(r) for r in conn.execute("SELECT * FROM crawl_run_jurisdiction_status WHERE run_id=? ORDER BY name, jurisdiction_id", (args.run_id,)).fetchall()]
     c = write_coverage_report(rows, args.output, args.run_id)
-    f_rows = []
     query = """
     SELECT s.jurisdiction_id, j.name as jurisdiction, j.type, s.url, s.title, d.doc_type, dv.llm_json
     FROM document_versions dv
@@ -212,43 +250,98 @@ def cmd_report(args):
     JOIN sources s ON d.source_id=s.id
     LEFT JOIN jurisdictions j ON j.jurisdiction_id=s.jurisdiction_id
     """
-    for r in conn.execute(query).fetchall():
-        llm = json.loads(r["llm_json"]) if r["llm_json"] else {}
-        f_rows.append(
-            {
-                "jurisdiction": r["jurisdiction"],
-                "type": r["type"],
-                "title": r["title"],
-                "url": r["url"],
-                "doc_type": r["doc_type"],
-                "published_date": "",
-                "first_seen": "",
-                "last_seen": "",
-                "category": llm.get("category", ""),
-                "confidence": llm.get("confidence", ""),
-                "summary": llm.get("summary", ""),
-                "mentions_platform_ks_fn": llm.get("mentions_platform_ks_fn", False),
-            }
-        )
+    f_rows = [_findings_row(r) for r in conn.execute(query).fetchall()]
     f = write_findings_report(f_rows, args.output, args.run_id)
     print(f"coverage={c}\nfindings={f}")
 
 
+def _extract_workers(settings) -> int:
+    return settings.extract_workers or os.cpu_count() or 1
+
+
+def cmd_extract(args):
+    settings = load_settings()
+    conn = connect(settings.db_url)
+    init_db(conn)
+    configure_extract_pool(settings.extract_workers, settings.extract_timeout, settings.extract_max_pages, settings.extract_max_memory_mb)
+    query = "SELECT id FROM document_versions WHERE blob_path IS NOT NULL"
+    if not args.all:
+        query += " AND COALESCE(extract_status, '') NOT IN ('ok', 'truncated')"
+    with DbWriter(conn) as writer:
+        for r in conn.execute(query).fetchall():
+            writer.submit(enqueue_work, STAGE_EXTRACT, r["id"])
+        # --all parses every blob again with the current extraction code, overwriting the memoized text.
+        options = {"reuse": False} if args.all else None
+        done = run_stage(settings, writer, STAGE_EXTRACT, args.workers or _extract_workers(settings), options=options)
+    counts = work_counts(conn, STAGE_EXTRACT)
+    print(f"ekstrahert={done}\nfeilet={counts.get('failed', 0)}\ntil_klassifisering={work_counts(conn, STAGE_CLASSIFY).get('pending', 0)}")
+
+
+def _classify_batch(settings, conn, args):
+    transport = get_batch_transport(settings)
+    with DbWriter(conn) as writer:
+        if args.batch:
+            batch_id, requests, cached = submit_batch(settings, writer, transport, str(Path(args.output) / "batches"), args.run_id)
+            print(f"batch={batch_id or '-'}\nforespørsler={requests}\nfra_cache={cached}")
+        while args.poll:
+            results = poll_batches(settings, writer, transport)
+            for batch_id, status, succeeded, failed in results:
+                print(f"batch={batch_id} status={status} klassifisert={succeeded} feilet={failed}")
+            if not args.wait or not writer.call(open_llm_batches):
+                break
+            time.sleep(args.interval)
+    close_llm_clients()
+
+
 def cmd_classify(args):
     settings = load_settings()
     conn = connect(settings.db_url)
+    init_db(conn)
+    if not llm_configured(settings):
+        print("klassifisert=0")
+        return
+    if args.batch or args.poll:
+        _classify_batch(settings, conn, args)
+        return
+    # Cached versions may belong to older runs, so this invocation's counts come from the process, not cache_stats.
+    CACHE_STATS.reset()
     rows = conn.execute(
-        "SELECT id, extracted_text FROM document_versions WHERE llm_json IS NULL AND COALESCE(extracted_text, '') != ''"
+        """SELECT dv.id FROM document_versions dv
+        LEFT JOIN extracted_texts et ON et.content_hash=dv.content_hash
+        WHERE dv.llm_json IS NULL AND COALESCE(et.text, dv.extracted_text, '') != ''"""
     ).fetchall()
-    done = 0
-    for r in rows:
-        if not (settings.openai_api_key or settings.azure_openai_api_key):
-            break
-        llm = classify_document(settings, r["extracted_text"], {"run_id": args.run_id})
-        conn.execute("UPDATE document_versions SET llm_json=? WHERE id=?", (json.dumps(llm, ensure_ascii=False), r["id"]))
-        conn.commit()
-        done += 1
+    with DbWriter(conn) as writer:
+        for r in rows:
+            writer.submit(enqueue_work, STAGE_CLASSIFY, r["id"])
+        done = run_stage(settings, writer, STAGE_CLASSIFY, args.workers or settings.llm_concurrency)
+    close_llm_clients()
     print(f"klassifisert={done}")
+    hits, misses, saved = CACHE_STATS.get(CACHE_LLM)
+    print(f"llm_cache_treff={hits}\nllm_cache_bom={misses}\nspart_tokens={saved}")
+
+
+def cmd_search(args):
+    settings = load_settings()
+    conn = connect(settings.db_url)
+    init_db(conn)
+    query = args.query if args.raw else fts_query(args.query)
+    started = time.perf_counter()
+    try:
+        rows = search_texts(
+            conn,
+            query,
+            jurisdiction=args.jurisdiction,
+            jurisdiction_type=args.type,
+            doc_type=args.doc_type,
+            run_id=args.run_id,
+            limit=args.limit,
+        )
+    except sqlite3.OperationalError as exc:
+        # Only --raw passes user syntax to FTS5; plain queries are always quoted.
+        raise SystemExit(f"Ugyldig søkeuttrykk {query!r}: {exc}")
+    for r in rows:
+        print(f"{r['jurisdiction'] or r['jurisdiction_id']} [{r['doc_type']}] {r['title'] or r['url']}\n  {r['url']}\n  {r['snippet']}")
+    print(f"treff={len(rows)} ({(time.perf_counter() - started) * 1000:.0f} ms)")
 
 
 def build_parser():
@@ -262,16 +355,46 @@ def build_parser():
     p_run = sub.add_parser("run")
     p_run.add_argument("--excel", required=True)
     p_run.add_argument("--output", default="data/output")
-    p_run.add_argument("--max-concurrency", type=int, default=4)
+    p_run.add_argument("--max-concurrency", type=int, default=None)
+    p_run.add_argument("--resume", type=int, default=None, metavar="RUN_ID")
+    p_run.add_argument("--enqueue-only", action="store_true", help="Legg jurisdiksjonene i jobbtabellen for `monitor worker`")
     p_run.set_defaults(func=cmd_run)
 
+    p_wrk = sub.add_parser("worker")
+    p_wrk.add_argument("--run-id", type=int, required=True)
+    p_wrk.add_argument("--output", default="data/output")
+    p_wrk.add_argument("--max-concurrency", type=int, default=None)
+    p_wrk.add_argument("--worker-id", default=None, help="Standard: vertsnavn:pid")
+    p_wrk.set_defaults(func=cmd_worker)
+
     p_rep = sub.add_parser("report")
     p_rep.add_argument("--run-id", type=int, required=True)
     p_rep.add_argument("--output", default="data/output")
     p_rep.set_defaults(func=cmd_report)
 
+    p_ext = sub.add_parser("extract")
+    p_ext.add_argument("--all", action="store_true", help="Hent ut tekst på nytt for alle blobs, ikke bare manglende/feilede")
+    p_ext.add_argument("--workers", type=int, default=None)
+    p_ext.set_defaults(func=cmd_extract)
+
+    p_sea = sub.add_parser("search")
+    p_sea.add_argument("query")
+    p_sea.add_argument("--jurisdiction", help="jurisdiction_id eller navn")
+    p_sea.add_argument("--type", help="kommune/fylke")
+    p_sea.add_argument("--doc-type", help="PDF/DOCX/HTML")
+    p_sea.add_argument("--run-id", type=int, default=None)
+    p_sea.add_argument("--limit", type=int, default=20)
+    p_sea.add_argument("--raw", action="store_true", help="Send spørringen uendret som FTS5-syntaks")
+    p_sea.set_defaults(func=cmd_search)
+
     p_cls = sub.add_parser("classify")
     p_cls.add_argument("--run-id", type=int, required=True)
+    p_cls.add_argument("--workers", type=int, default=None, help="Samtidige LLM-kall (standard LLM_CONCURRENCY)")
+    p_cls.add_argument("--batch", action="store_true", help="Send alle uklassifiserte versjoner som én batch-jobb")
+    p_cls.add_argument("--poll", action="store_true", help="Sjekk åpne batch-jobber og les inn ferdige resultater")
+    p_cls.add_argument("--wait", action="store_true", help="Med --poll: vent til alle batch-jobber er ferdige")
+    p_cls.add_argument("--interval", type=float, default=60.0)
+    p_cls.add_argument("--output", default="data/output")
     p_cls.set_defaults(func=cmd_classify)
     return p
 
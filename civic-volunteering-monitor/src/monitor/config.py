@@ -13,15 +13,39 @@ class Settings:
     max_concurrency: int = 4
     user_agent: str = "KommunalFrivillighetMonitor/0.1"
     request_timeout: int = 20
+    max_response_mb: int = 50
+    max_pdf_mb: int = 200
+    max_docx_mb: int = 50
+    rate_limit_per_second: float = 2.0
+    rate_limit_burst: int = 2
+    crawl_max_pages: int = 200
+    crawl_max_seconds: int = 600
+    crawl_max_depth: int = 4
+    page_cache_path: str = "data/cache/pages.sqlite"
+    page_cache_max_age_days: int = 30
+    page_cache_max_mb: int = 200
+    job_lease_seconds: int = 300
+    extract_workers: int = 0
+    extract_timeout: int = 120
+    extract_max_pages: int = 500
+    extract_max_memory_mb: int = 1024
     playwright_enabled: bool = False
+    playwright_pool_size: int = 2
     openai_provider: str = "openai"
     openai_api_key: str = ""
     openai_model: str = "gpt-4o-mini"
+    openai_base_url: str = ""
     azure_openai_api_key: str = ""
     azure_openai_endpoint: str = ""
     azure_openai_api_version: str = "2024-05-01-preview"
     azure_openai_deployment: str = ""
     llm_max_chars: int = 24000
+    llm_concurrency: int = 8
+    llm_rpm: int = 500
+    llm_tpm: int = 200000
+    llm_max_retries: int = 5
+    llm_batch_transport: str = "openai"
+    near_duplicate_max_distance: int = 3
 
 
 def _as_bool(value: str | None, default: bool = False) -> bool:
@@ -39,13 +63,37 @@ def load_settings() -> Settings:
         max_concurrency=int(os.getenv("MAX_CONCURRENCY", str(Settings.max_concurrency))),
         user_agent=os.getenv("USER_AGENT", Settings.user_agent),
         request_timeout=int(os.getenv("REQUEST_TIMEOUT", str(Settings.request_timeout))),
+        max_response_mb=int(os.getenv("MAX_RESPONSE_MB", str(Settings.max_response_mb))),
+        max_pdf_mb=int(os.getenv("MAX_PDF_MB", str(Settings.max_pdf_mb))),
+        max_docx_mb=int(os.getenv("MAX_DOCX_MB", str(Settings.max_docx_mb))),
+        rate_limit_per_second=float(os.getenv("RATE_LIMIT_PER_SECOND", str(Settings.rate_limit_per_second))),
+        rate_limit_burst=int(os.getenv("RATE_LIMIT_BURST", str(Settings.rate_limit_burst))),
+        crawl_max_pages=int(os.getenv("CRAWL_MAX_PAGES", str(Settings.crawl_max_pages))),
+        crawl_max_seconds=int(os.getenv("CRAWL_MAX_SECONDS", str(Settings.crawl_max_seconds))),
+        crawl_max_depth=int(os.getenv("CRAWL_MAX_DEPTH", str(Settings.crawl_max_depth))),
+        page_cache_path=os.getenv("PAGE_CACHE_PATH", Settings.page_cache_path),
+        page_cache_max_age_days=int(os.getenv("PAGE_CACHE_MAX_AGE_DAYS", str(Settings.page_cache_max_age_days))),
+        page_cache_max_mb=int(os.getenv("PAGE_CACHE_MAX_MB", str(Settings.page_cache_max_mb))),
+        job_lease_seconds=int(os.getenv("JOB_LEASE_SECONDS", str(Settings.job_lease_seconds))),
+        extract_workers=int(os.getenv("EXTRACT_WORKERS", str(Settings.extract_workers))),
+        extract_timeout=int(os.getenv("EXTRACT_TIMEOUT", str(Settings.extract_timeout))),
+        extract_max_pages=int(os.getenv("EXTRACT_MAX_PAGES", str(Settings.extract_max_pages))),
+        extract_max_memory_mb=int(os.getenv("EXTRACT_MAX_MEMORY_MB", str(Settings.extract_max_memory_mb))),
         playwright_enabled=_as_bool(os.getenv("PLAYWRIGHT_ENABLED"), False),
+        playwright_pool_size=int(os.getenv("PLAYWRIGHT_POOL_SIZE", str(Settings.playwright_pool_size))),
         openai_provider=os.getenv("OPENAI_PROVIDER", Settings.openai_provider),
         openai_api_key=os.getenv("OPENAI_API_KEY", ""),
         openai_model=os.getenv("OPENAI_MODEL", Settings.openai_model),
+        openai_base_url=os.getenv("OPENAI_BASE_URL", ""),
         azure_openai_api_key=os.getenv("AZURE_OPENAI_API_KEY", ""),
         azure_openai_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT", ""),
         azure_openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION", Settings.azure_openai_api_version),
         azure_openai_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT", ""),
         llm_max_chars=int(os.getenv("LLM_MAX_CHARS", str(Settings.llm_max_chars))),
+        llm_concurrency=int(os.getenv("LLM_CONCURRENCY", str(Settings.llm_concurrency))),
+        llm_rpm=int(os.getenv("LLM_RPM", str(Settings.llm_rpm))),
+        llm_tpm=int(os.getenv("LLM_TPM", str(Settings.llm_tpm))),
+        llm_max_retries=int(os.getenv("LLM_MAX_RETRIES", str(Settings.llm_max_retries))),
+        llm_batch_transport=os.getenv("LLM_BATCH_TRANSPORT", Settings.llm_batch_transport),
+        near_duplicate_max_distance=int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", str(Settings.near_duplicate_max_distance))),
     )
@@ -1,19 +1,37 @@
 from __future__ import annotations
 
 import logging
-from collections import deque
-from dataclasses import dataclass
-from urllib.parse import urlparse
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable
+from urllib.parse import urldefrag, urlparse
 
-from monitor.crawl.fetch import DomainRateLimiter, fetch_with_retries
-from monitor.crawl.heuristics import HEURISTIC_PATHS, is_document_url, is_high_relevance
-from monitor.crawl.html_extract import extract_links, html_looks_js_driven
+from monitor.crawl.fetch import SHARED_LIMITER, DomainRateLimiter, conditional_headers, document_kind, fetch_with_retries
+from monitor.crawl.frontier import CrawlFrontier
+from monitor.crawl.heuristics import HEURISTIC_PATHS, is_document_url, is_high_relevance, relevance_score
+from monitor.crawl.html_extract import parse_page
 from monitor.crawl.playwright_fetch import fetch_rendered_html
-from monitor.crawl.sitemap import discover_sitemaps, parse_sitemap_urls
+from monitor.crawl.sitemap import SitemapEntry, collect_sitemap_entries, discover_sitemaps
+from monitor.ingest.url_normalize import canonical_url, same_site
+from monitor.store.dedupe import sha256_bytes
+from monitor.store.page_cache import CachedPage, PageCache
+from monitor.utils.dates import parse_iso_datetime
 
 logger = logging.getLogger(__name__)
 
 
+CHECKPOINT_EVERY = 10
+SEED_BONUS = 1.0
+DEPTH_PENALTY = 0.5
+
+
+@dataclass
+class CrawlBudget:
+    max_pages: int = 200
+    max_seconds: float = 600.0
+    max_depth: int = 4
+
+
 @dataclass
 class CrawlResult:
     pages_fetched: int
@@ -21,73 +39,229 @@ class CrawlResult:
     http_errors: int
     timeouts: int
     notes: list[str]
+    sitemap_entries: list[SitemapEntry] = field(default_factory=list)
+    fetched_urls: list[str] = field(default_factory=list)
+    sitemap_unchanged: int = 0
+    fetch_attempts: int = 0
+    pages_from_cache: int = 0
 
+    def to_state(self) -> dict:
+        state = asdict(self)
+        # Spooled responses cannot outlive the process; a resumed run fetches those documents again.
+        state["docs_found"] = [{k: v for k, v in d.items() if k != "response"} for d in self.docs_found]
+        return state
 
-def crawl_jurisdiction(base_url: str, timeout: int, user_agent: str, playwright_enabled: bool = False) -> CrawlResult:
-    limiter = DomainRateLimiter(max_per_second=2.0)
-
-    seen: set[str] = set()
-    q = deque()
-    docs_found: list[dict] = []
-    http_errors = 0
-    timeouts = 0
-    pages_fetched = 0
-    notes: list[str] = []
-    domain = urlparse(base_url).netloc
-
-    for sitemap_url in discover_sitemaps(base_url, user_agent, timeout, limiter=limiter):
-        try:
-            sres = fetch_with_retries(sitemap_url, user_agent, timeout, limiter=limiter)
-            if sres.status_code == 200:
-                for u in parse_sitemap_urls(sres.content):
-                    if urlparse(u).netloc == domain and is_high_relevance(u):
-                        q.append((u, 0))
-        except Exception:
-            continue
+    @classmethod
+    def from_state(cls, state: dict) -> "CrawlResult":
+        state = dict(state)
+        state["sitemap_entries"] = [SitemapEntry(**e) for e in state.get("sitemap_entries", [])]
+        return cls(**state)
 
-    for p in HEURISTIC_PATHS:
-        q.append((f"{base_url}{p}", 0))
 
-    while q:
-        url, depth = q.popleft()
-        if url in seen or depth > 2:
+def discard_responses(docs: list[dict]) -> None:
+    # Spooled bodies not handed to the download stage would otherwise be left under BLOB_DIR/.spool.
+    for doc in docs:
+        res = doc.pop("response", None)
+        if res is not None:
+            res.discard()
+
+
+def _unchanged_since_fetch(entry: SitemapEntry, last_fetched: dict[str, str]) -> bool:
+    lastmod = parse_iso_datetime(entry.lastmod)
+    fetched_at = parse_iso_datetime(last_fetched.get(entry.url))
+    return lastmod is not None and fetched_at is not None and lastmod <= fetched_at
+
+
+def _seed_frontier(
+    base_url: str,
+    user_agent: str,
+    timeout: int,
+    limiter: DomainRateLimiter,
+    result: CrawlResult,
+    last_fetched: dict[str, str],
+    max_depth: int,
+) -> tuple[CrawlFrontier, list[tuple[str, float]]]:
+    # Also returns the sitemap pages unchanged since the last fetch; the caller reuses their cached links.
+    host = urlparse(base_url).netloc
+    frontier = CrawlFrontier(max_depth=max_depth, key=lambda url: canonical_url(url, host))
+    unchanged: list[tuple[str, float]] = []
+    doc_urls: set[str] = set()
+    sitemap_urls = discover_sitemaps(base_url, user_agent, timeout, limiter=limiter)
+    for entry in collect_sitemap_entries(sitemap_urls, user_agent, timeout, limiter=limiter):
+        if not same_site(entry.url, base_url):
             continue
-        seen.add(url)
-        try:
-            res = fetch_with_retries(url, user_agent, timeout, limiter=limiter)
-        except TimeoutError:
-            timeouts += 1
+        fetch_url = entry.url
+        entry = SitemapEntry(canonical_url(entry.url, host), entry.lastmod)
+        score = relevance_score(entry.url)
+        if score <= 0:
             continue
-        except Exception:
-            http_errors += 1
+        result.sitemap_entries.append(entry)
+        if _unchanged_since_fetch(entry, last_fetched):
+            result.sitemap_unchanged += 1
+            if not is_document_url(entry.url):
+                unchanged.append((fetch_url, score))
             continue
-
-        if res.status_code != 200:
-            http_errors += 1
+        if is_document_url(entry.url):
+            # Documents go straight to the download stage; crawling them as pages would fetch them twice.
+            if entry.url not in doc_urls:
+                doc_urls.add(entry.url)
+                result.docs_found.append(
+                    {"url": entry.url, "fetch_url": fetch_url, "title": "", "high_relevance": is_high_relevance(entry.url)}
+                )
             continue
+        frontier.push(fetch_url, 0, score)
 
-        ctype = res.headers.get("Content-Type", "").lower()
-        if any(x in ctype for x in ["application/pdf", "application/msword", "application/vnd.openxmlformats"]):
-            docs_found.append({"url": url, "title": "", "high_relevance": is_high_relevance(url)})
-            continue
+    for p in HEURISTIC_PATHS:
+        url = f"{base_url}{p}"
+        frontier.push(url, 0, SEED_BONUS + relevance_score(url))
+    return frontier, unchanged
+
+
+def _extract_links(url: str, html: str, playwright_enabled: bool) -> tuple[list[tuple[str, str]], list[str]]:
+    page = parse_page(url, html)
+    if page.links or not (playwright_enabled and page.js_driven):
+        return page.links, []
+    try:
+        return parse_page(url, fetch_rendered_html(url)).links, ["requires_js_rendering"]
+    except Exception:
+        return [], ["js_rendering_failed"]
 
-        pages_fetched += 1
-        html = res.text
-        links = extract_links(url, html)
-        if not links and playwright_enabled and html_looks_js_driven(html):
+
+def _reuse_cached(page_cache: PageCache, cached: CachedPage, result: CrawlResult) -> list[tuple[str, str]]:
+    page_cache.record(cached.url, True)
+    result.pages_from_cache += 1
+    result.notes.extend(cached.notes)
+    return cached.links
+
+
+def crawl_jurisdiction(
+    base_url: str,
+    timeout: int,
+    user_agent: str,
+    playwright_enabled: bool = False,
+    last_fetched: dict[str, str] | None = None,
+    resume_state: dict | None = None,
+    checkpoint: Callable[[dict], None] | None = None,
+    budget: CrawlBudget | None = None,
+    page_cache: PageCache | None = None,
+) -> CrawlResult:
+    limiter = SHARED_LIMITER
+    budget = budget or CrawlBudget()
+    host = urlparse(base_url).netloc
+    started = time.monotonic()
+
+    unchanged: list[tuple[str, float]] = []
+    if resume_state:
+        result = CrawlResult.from_state(resume_state["result"])
+        frontier = CrawlFrontier.from_snapshot(resume_state["frontier"], key=lambda url: canonical_url(url, host))
+    else:
+        result = CrawlResult(0, [], 0, 0, [])
+        frontier, unchanged = _seed_frontier(base_url, user_agent, timeout, limiter, result, last_fetched or {}, budget.max_depth)
+    docs_by_url = {d["url"]: d for d in result.docs_found}
+
+    def add_doc(item: dict) -> None:
+        # A PDF linked from many pages is downloaded and hashed once.
+        known = docs_by_url.get(item["url"])
+        if known is None:
+            docs_by_url[item["url"]] = item
+            result.docs_found.append(item)
+            return
+        res = item.get("response")
+        if res is not None:
+            if "response" in known:
+                res.discard()
+            else:
+                known["response"] = res
+
+    def follow_links(links: list[tuple[str, str]], depth: int) -> None:
+        for link, title in links:
+            if not same_site(link, base_url):
+                continue
+            link = urldefrag(link)[0]
+            canonical = canonical_url(link, host)
+            if is_document_url(canonical):
+                relevant = is_high_relevance(canonical + " " + title)
+                add_doc({"url": canonical, "fetch_url": link, "title": title, "high_relevance": relevant})
+            else:
+                score = relevance_score(canonical, title)
+                if score > 0:
+                    frontier.push(link, depth + 1, score - DEPTH_PENALTY * (depth + 1))
+
+    # Sitemap pages unchanged since the last fetch are not fetched, but the documents they link to must still be
+    # revalidated: follow their cached links, or fetch them (conditionally) when the page cache has nothing.
+    for fetch_url, score in unchanged:
+        cached = page_cache.get(canonical_url(fetch_url, host)) if page_cache else None
+        if cached is None:
+            frontier.push(fetch_url, 0, score)
+        else:
+            frontier.mark_seen(fetch_url)
+            follow_links(_reuse_cached(page_cache, cached, result), 0)
+
+    def save_checkpoint() -> None:
+        if checkpoint:
+            checkpoint({"result": result.to_state(), "frontier": frontier.snapshot()})
+
+    processed = 0
+    try:
+        while True:
+            if processed % CHECKPOINT_EVERY == 0:
+                save_checkpoint()
+            if result.fetch_attempts >= budget.max_pages or time.monotonic() - started >= budget.max_seconds:
+                if len(frontier):
+                    result.notes.append("crawl_budget_exhausted")
+                    logger.info("%s: budsjett brukt opp, %d URL-er igjen i køen", base_url, len(frontier))
+                break
+            item = frontier.pop()
+            if item is None:
+                break
+            # Pages are fetched as linked and their links resolved against the final URL: canonical_url drops the
+            # trailing slash, which would move relative links up a directory. The canonical form is only the key.
+            fetch_url, depth = item
+            url = canonical_url(fetch_url, host)
+            processed += 1
+            result.fetch_attempts += 1
+            cached = page_cache.get(url) if page_cache else None
+            headers = conditional_headers(cached.etag, cached.last_modified) if cached else None
             try:
-                html = fetch_rendered_html(url)
-                links = extract_links(url, html)
-                notes.append("requires_js_rendering")
+                res = fetch_with_retries(fetch_url, user_agent, timeout, limiter=limiter, headers=headers or None)
+            except TimeoutError:
+                result.timeouts += 1
+                continue
             except Exception:
-                notes.append("js_rendering_failed")
+                result.http_errors += 1
+                continue
 
-        for link, title in links:
-            if urlparse(link).netloc != domain:
+            if res.status_code == 304 and cached:
+                links = _reuse_cached(page_cache, cached, result)
+            elif res.status_code != 200:
+                result.http_errors += 1
                 continue
-            if is_document_url(link):
-                docs_found.append({"url": link, "title": title, "high_relevance": is_high_relevance(link + " " + title)})
-            elif depth < 2 and is_high_relevance(link + " " + title):
-                q.append((link, depth + 1))
+            elif document_kind(res.headers.get("Content-Type", "")):
+                # Keep the body so the download stage does not fetch the same document again.
+                doc = {"url": url, "fetch_url": fetch_url, "title": "", "high_relevance": is_high_relevance(url)}
+                add_doc({**doc, "response": res})
+                continue
+            else:
+                body_hash = sha256_bytes(res.content)
+                if cached and cached.body_hash == body_hash:
+                    links = _reuse_cached(page_cache, cached, result)
+                else:
+                    if page_cache:
+                        page_cache.record(url, False)
+                    links, notes = _extract_links(res.url or fetch_url, res.text, playwright_enabled)
+                    result.notes.extend(notes)
+                    if page_cache:
+                        page_cache.put(url, res.headers.get("ETag"), res.headers.get("Last-Modified"), body_hash, links, notes)
+
+            result.pages_fetched += 1
+            result.fetched_urls.append(url)
+            follow_links(links, depth)
+    except BaseException:
+        discard_responses(result.docs_found)
+        raise
 
-    return CrawlResult(pages_fetched, docs_found, http_errors, timeouts, notes)
+    if result.pages_from_cache:
+        logger.info("%s: %d sider uendret, lenker hentet fra sidecachen", base_url, result.pages_from_cache)
+    if result.sitemap_unchanged:
+        logger.info("%s: %d sitemap-sider uendret siden forrige henting", base_url, result.sitemap_unchanged)
+    return result
@@ -1,14 +1,40 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import logging
+import os
+import tempfile
+import threading
 import time
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from http.cookiejar import DefaultCookiePolicy
 from urllib.parse import urlparse
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError, URLError
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from urllib3.util.request import ACCEPT_ENCODING
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 64 * 1024
+MAX_RESPONSE_BYTES = 50 * 1024 * 1024
+POOL_MAXSIZE = 4
+POOL_HOSTS = 16
+SPOOL_DIR: str | None = None
+
+DOCUMENT_CONTENT_TYPES = {
+    "application/pdf": "pdf",
+    "application/msword": "word",
+    "application/vnd.openxmlformats": "word",
+}
+DOCUMENT_LIMITS = {"pdf": 200 * 1024 * 1024, "word": 50 * 1024 * 1024}
+
 
 @dataclass
 class SimpleResponse:
@@ -16,52 +42,330 @@ class SimpleResponse:
     text: str
     content: bytes
     headers: dict
+    path: str | None = None
+    content_hash: str | None = None
+    size: int = 0
+    # Final URL after redirects; relative links on the page resolve against it.
+    url: str = ""
+
+    def discard(self) -> None:
+        if self.path:
+            Path(self.path).unlink(missing_ok=True)
+
+
+class ResponseTooLargeError(RuntimeError):
+    pass
+
+
+@dataclass
+class HostStats:
+    host: str
+    requests: int = 0
+    handshakes: int = 0
+    bytes_wire: int = 0
+    bytes_decoded: int = 0
+
+
+class FetchStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts: dict[str, HostStats] = {}
+
+    def _host(self, host: str) -> HostStats:
+        if host not in self._hosts:
+            self._hosts[host] = HostStats(host)
+        return self._hosts[host]
+
+    def record_handshake(self, host: str) -> None:
+        with self._lock:
+            self._host(host).handshakes += 1
+
+    def record_response(self, host: str, bytes_wire: int, bytes_decoded: int) -> None:
+        with self._lock:
+            stats = self._host(host)
+            stats.requests += 1
+            stats.bytes_wire += bytes_wire
+            stats.bytes_decoded += bytes_decoded
+
+    def rows(self) -> list[dict]:
+        with self._lock:
+            return [asdict(self._hosts[h]) for h in sorted(self._hosts)]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hosts.clear()
+
+
+FETCH_STATS = FetchStats()
+
+
+@dataclass
+class _Bucket:
+    rate: float
+    tokens: float
+    updated: float
+    blocked_until: float = 0.0
 
 
 class DomainRateLimiter:
-    def __init__(self, max_per_second: float = 2.0):
+    def __init__(
+        self,
+        max_per_second: float = 2.0,
+        burst: int = 1,
+        min_per_second: float = 0.1,
+        max_retry_after: float = 120.0,
+        clock=time.monotonic,
+    ):
         self.max_per_second = max_per_second
-        self._last_call: dict[str, float] = {}
+        self.burst = burst
+        self.min_per_second = min_per_second
+        self.max_retry_after = max_retry_after
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets: dict[str, _Bucket] = {}
+
+    def _bucket(self, domain: str, now: float) -> _Bucket:
+        bucket = self._buckets.get(domain)
+        if bucket is None:
+            bucket = self._buckets[domain] = _Bucket(rate=self.max_per_second, tokens=float(self.burst), updated=now)
+        return bucket
+
+    def reserve(self, domain: str) -> float:
+        # Takes a token and returns how long the caller must wait for it; the lock is never held while sleeping.
+        with self._lock:
+            now = self._clock()
+            bucket = self._bucket(domain, now)
+            bucket.tokens = min(float(self.burst), bucket.tokens + (now - bucket.updated) * bucket.rate)
+            bucket.updated = now
+            bucket.tokens -= 1.0
+            delay = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0.0
+            return max(delay, bucket.blocked_until - now)
 
     def wait(self, domain: str) -> None:
-        now = time.time()
-        min_interval = 1.0 / self.max_per_second
-        last = self._last_call.get(domain, 0.0)
-        sleep_for = min_interval - (now - last)
-        if sleep_for > 0:
-            time.sleep(sleep_for)
-        self._last_call[domain] = time.time()
-
-
-def _do_get(url: str, user_agent: str, timeout: int) -> SimpleResponse:
-    req = Request(url, headers={"User-Agent": user_agent})
-    with urlopen(req, timeout=timeout) as res:
-        content = res.read()
-        headers = {k: v for k, v in res.headers.items()}
+        delay = self.reserve(domain)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, domain: str) -> None:
+        delay = self.reserve(domain)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def on_response(self, domain: str, status_code: int, retry_after: str | None = None, backoff: float = 0.0) -> None:
+        with self._lock:
+            now = self._clock()
+            bucket = self._bucket(domain, now)
+            if status_code in {429, 503}:
+                bucket.rate = max(self.min_per_second, bucket.rate / 2)
+                pause = max(_parse_retry_after(retry_after) or 0.0, backoff)
+                bucket.blocked_until = max(bucket.blocked_until, now + min(pause, self.max_retry_after))
+            elif status_code < 500:
+                bucket.rate = min(self.max_per_second, bucket.rate + self.max_per_second / 10)
+
+    def rate(self, domain: str) -> float:
+        with self._lock:
+            return self._bucket(domain, self._clock()).rate
+
+
+def _parse_retry_after(value: str | None) -> float | None:
+    # Delta-seconds or an HTTP-date; None when missing or unreadable, so a bad header never fails the fetch.
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+        if when.tzinfo is None:
+            # "-0000" means UTC with no known local zone, and parses as a naive datetime.
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+SHARED_LIMITER = DomainRateLimiter(max_per_second=2.0, burst=2)
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        FETCH_STATS.record_handshake(self.host)
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        FETCH_STATS.record_handshake(self.host)
+        return super()._new_conn()
+
+
+class _PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+_local = threading.local()
+
+
+def configure_fetch(
+    max_response_bytes: int,
+    document_limits: dict | None = None,
+    spool_dir: str | None = None,
+    rate_per_second: float | None = None,
+    burst: int | None = None,
+) -> None:
+    global MAX_RESPONSE_BYTES, SPOOL_DIR
+    MAX_RESPONSE_BYTES = max_response_bytes
+    if rate_per_second:
+        SHARED_LIMITER.max_per_second = rate_per_second
+    if burst:
+        SHARED_LIMITER.burst = burst
+    DOCUMENT_LIMITS.update(document_limits or {})
+    if spool_dir:
+        Path(spool_dir).mkdir(parents=True, exist_ok=True)
+    SPOOL_DIR = spool_dir
+
+
+def document_kind(content_type: str) -> str | None:
+    ctype = (content_type or "").lower()
+    for prefix, kind in DOCUMENT_CONTENT_TYPES.items():
+        if prefix in ctype:
+            return kind
+    return None
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = _PooledAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def _session() -> requests.Session:
+    # One pooled session per worker thread: jurisdictions are crawled by a single worker,
+    # so keep-alive connections to a host are reused without sharing a cookie jar across threads.
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = _build_session()
+    return session
+
+
+def _check_declared_size(res: requests.Response, url: str, max_bytes: int) -> None:
+    declared = res.headers.get("Content-Length")
+    if declared and declared.isdigit() and "Content-Encoding" not in res.headers and int(declared) > max_bytes:
+        raise ResponseTooLargeError(f"Respons over {max_bytes} bytes: {url}")
+
+
+def _read_body(res: requests.Response, url: str, max_bytes: int) -> bytes:
+    _check_declared_size(res, url, max_bytes)
+    chunks = []
+    size = 0
+    for chunk in res.raw.stream(CHUNK_SIZE, decode_content=True):
+        size += len(chunk)
+        if size > max_bytes:
+            raise ResponseTooLargeError(f"Respons over {max_bytes} bytes: {url}")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _spool_body(res: requests.Response, url: str, max_bytes: int) -> tuple[str, str, int]:
+    _check_declared_size(res, url, max_bytes)
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="dl-", suffix=".part", dir=SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            for chunk in res.raw.stream(CHUNK_SIZE, decode_content=True):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ResponseTooLargeError(f"Respons over {max_bytes} bytes: {url}")
+                digest.update(chunk)
+                fh.write(chunk)
+    except BaseException:
+        Path(path).unlink(missing_ok=True)
+        raise
+    return path, digest.hexdigest(), size
+
+
+def _do_get(url: str, user_agent: str, timeout: int, headers: dict | None = None) -> SimpleResponse:
+    host = urlparse(url).hostname or ""
+    req_headers = {"User-Agent": user_agent, **(headers or {})}
+    with _session().get(url, headers=req_headers, timeout=timeout, stream=True) as res:
+        headers = res.headers
         ctype = headers.get("Content-Type", "")
+        kind = document_kind(ctype) if res.status_code == 200 else None
+        if kind:
+            # Documents are streamed to disk and hashed on the way, so large PDFs never sit in memory.
+            path, content_hash, size = _spool_body(res, url, DOCUMENT_LIMITS.get(kind, MAX_RESPONSE_BYTES))
+            FETCH_STATS.record_response(host, res.raw.tell(), size)
+            return SimpleResponse(
+                status_code=res.status_code,
+                text="",
+                content=b"",
+                headers=headers,
+                path=path,
+                content_hash=content_hash,
+                size=size,
+                url=res.url,
+            )
+        content = _read_body(res, url, MAX_RESPONSE_BYTES)
+        FETCH_STATS.record_response(host, res.raw.tell(), len(content))
         charset = "utf-8"
         if "charset=" in ctype:
             charset = ctype.split("charset=")[-1].split(";")[0].strip()
-        text = content.decode(charset, errors="replace")
-        return SimpleResponse(status_code=getattr(res, "status", 200), text=text, content=content, headers=headers)
+        try:
+            text = content.decode(charset, errors="replace")
+        except LookupError:
+            text = content.decode("utf-8", errors="replace")
+        return SimpleResponse(
+            status_code=res.status_code, text=text, content=content, headers=headers, size=len(content), url=res.url
+        )
+
 
+def conditional_headers(etag: str | None, last_modified: str | None) -> dict:
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
 
-def fetch_with_retries(url: str, user_agent: str, timeout: int, limiter: DomainRateLimiter | None = None, retries: int = 3):
+
+def fetch_with_retries(
+    url: str,
+    user_agent: str,
+    timeout: int,
+    limiter: DomainRateLimiter | None = None,
+    retries: int = 3,
+    headers: dict | None = None,
+):
     domain = urlparse(url).netloc
-    limiter = limiter or DomainRateLimiter(max_per_second=2.0)
+    limiter = limiter or SHARED_LIMITER
 
     for attempt in range(1, retries + 1):
         try:
             limiter.wait(domain)
-            return _do_get(url, user_agent, timeout)
-        except HTTPError as exc:
-            if exc.code in {429, 500, 502, 503, 504} and attempt < retries:
-                time.sleep(1.5 * attempt)
-                continue
-            return SimpleResponse(status_code=exc.code, text="", content=b"", headers={})
-        except URLError as exc:
+            res = _do_get(url, user_agent, timeout, headers)
+        except (requests.RequestException, Urllib3HTTPError) as exc:
+            # Bodies are read through res.raw, so resets and read timeouts mid-stream arrive as bare urllib3 errors.
             if attempt == retries:
                 raise TimeoutError(str(exc))
             logger.warning("retrying %s due to %s", url, exc)
             time.sleep(1.5 * attempt)
+            continue
+        limiter.on_response(domain, res.status_code, res.headers.get("Retry-After"), backoff=1.5 * attempt)
+        if res.status_code < 400:
+            return res
+        if res.status_code in {429, 500, 502, 503, 504} and attempt < retries:
+            if res.status_code not in {429, 503}:
+                time.sleep(1.5 * attempt)
+            continue
+        return SimpleResponse(status_code=res.status_code, text="", content=b"", headers=res.headers)
     raise RuntimeError("Unexpected retry flow")
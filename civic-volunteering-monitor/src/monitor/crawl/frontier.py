@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+from typing import Callable
+
+
+class CrawlFrontier:
+    # Best-first: highest score pops first, ties in insertion order (so equal scores behave like the old FIFO).
+    # URLs are queued as they will be fetched; `key` (e.g. canonical_url) decides which ones count as the same page.
+    def __init__(self, max_depth: int = 2, key: Callable[[str], str] | None = None):
+        self.max_depth = max_depth
+        self._key = key or (lambda url: url)
+        self._heap: list[tuple[float, int, str, int]] = []
+        self._counter = itertools.count()
+        self._seen: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, url: str, depth: int = 0, score: float = 0.0) -> None:
+        if depth <= self.max_depth and self._key(url) not in self._seen:
+            heapq.heappush(self._heap, (-score, next(self._counter), url, depth))
+
+    def mark_seen(self, url: str) -> None:
+        self._seen.add(self._key(url))
+
+    def pop(self) -> tuple[str, int] | None:
+        while self._heap:
+            _, _, url, depth = heapq.heappop(self._heap)
+            key = self._key(url)
+            if key not in self._seen:
+                self._seen.add(key)
+                return url, depth
+        return None
+
+    def snapshot(self) -> dict:
+        queue = [[url, depth, -neg_score] for neg_score, _, url, depth in sorted(self._heap)]
+        return {"queue": queue, "seen": sorted(self._seen), "max_depth": self.max_depth}
+
+    @classmethod
+    def from_snapshot(cls, state: dict, key: Callable[[str], str] | None = None) -> "CrawlFrontier":
+        frontier = cls(max_depth=state.get("max_depth", 2), key=key)
+        for url, depth, score in state.get("queue", []):
+            frontier.push(url, depth, score)
+        frontier._seen.update(state.get("seen", []))
+        return frontier
@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+import re
+from urllib.parse import unquote, urlsplit
+
 HEURISTIC_PATHS = [
     "/politikk",
     "/politikk-og-organisasjon",
@@ -35,6 +38,47 @@ def is_document_url(url: str) -> bool:
     return lowered.endswith(".pdf") or lowered.endswith(".docx") or lowered.endswith(".doc")
 
 
+KEYWORD_WEIGHTS = {
+    "frivilligsentral": 5.0, "frivillighet": 5.0, "frivillig": 4.0, "sivilsamfunn": 4.0,
+    "foreningsregister": 3.0, "foreningsportal": 3.0, "samspill": 2.0, "partnerskap": 2.0,
+    "handlingsplan": 2.0, "tilskudd": 2.0, "støtteordning": 2.0, "kartlegging": 1.5,
+    "medvirkning": 1.5, "strategi": 1.5, "samarbeid": 1.0, "plan": 1.0, "politikk": 1.0,
+    "oversikt": 0.5, "dialog": 0.5, "plattformer": 0.5, "ks": 1.0,
+}
+LOW_VALUE_WEIGHTS = {
+    "arkiv": -1.0, "kalender": -1.0, "arrangement": -0.5, "login": -3.0, "logg-inn": -3.0,
+    "sok": -2.0, "print": -2.0, "rss": -2.0, "english": -1.0,
+}
+# Short keys only count as whole tokens so "ks" no longer matches "kontaktskjema" or "bookshelf".
+WHOLE_TOKEN_KEYWORDS = {"ks", "sok", "rss", "print", "login"}
+PATH_WEIGHT = 1.5
+QUERY_WEIGHT = 0.5
+
+
+def _keyword_pattern(keys) -> re.Pattern:
+    parts = []
+    for key in sorted(keys, key=len, reverse=True):
+        escaped = re.escape(key)
+        parts.append(rf"(?<![a-z0-9æøå]){escaped}(?![a-z0-9æøå])" if key in WHOLE_TOKEN_KEYWORDS else escaped)
+    return re.compile("|".join(parts))
+
+
+_WEIGHTS = {**KEYWORD_WEIGHTS, **LOW_VALUE_WEIGHTS}
+_KEYWORD_RE = _keyword_pattern(_WEIGHTS)
+_RELEVANT_RE = _keyword_pattern(HIGH_RELEVANCE_KEYWORDS)
+
+
+def keyword_score(text: str) -> float:
+    # One regex pass; each keyword counts once per string so long nav labels cannot inflate the score.
+    found = set(_KEYWORD_RE.findall((text or "").lower()))
+    return sum(_WEIGHTS[k] for k in found)
+
+
+def relevance_score(url: str, anchor_text: str = "") -> float:
+    parts = urlsplit(url)
+    path = unquote(parts.path).lower()
+    return PATH_WEIGHT * keyword_score(path) + QUERY_WEIGHT * keyword_score(parts.query) + keyword_score(anchor_text)
+
+
 def is_high_relevance(text: str) -> bool:
-    value = (text or "").lower()
-    return any(k in value for k in HIGH_RELEVANCE_KEYWORDS)
+    return _RELEVANT_RE.search((text or "").lower()) is not None
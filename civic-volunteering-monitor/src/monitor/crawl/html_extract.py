@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 import re
+from dataclasses import dataclass
 from html.parser import HTMLParser
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
+
+from monitor.parse.content_clean import clean_text, main_text_from_tree, parse_html, strip_non_content, visible_text
 
 
 class LinkParser(HTMLParser):
@@ -45,3 +48,47 @@ def html_looks_js_driven(html: str) -> bool:
     text_len = len(" ".join(text.split()))
     scripts = html.lower().count("<script")
     return text_len < 200 and scripts > 5
+
+
+@dataclass
+class ParsedPage:
+    links: list[tuple[str, str]]
+    main_text: str
+    js_driven: bool
+
+
+def _make_resolver(base_url: str):
+    # Root-relative and absolute http(s) hrefs without dot segments are by far the most common on CMS pages;
+    # resolving those by concatenation avoids urljoin's full split/unsplit, which otherwise dominates parse time.
+    parts = urlsplit(base_url)
+    origin = f"{parts.scheme}://{parts.netloc}"
+
+    def resolve(href: str) -> str:
+        if "/." not in href and "\\" not in href:
+            if href.startswith("/") and not href.startswith("//"):
+                return origin + href
+            if href.startswith(("http://", "https://")):
+                return href
+        return urljoin(base_url, href)
+
+    return resolve
+
+
+def parse_page(base_url: str, html: str) -> ParsedPage:
+    # One lxml parse per page: links (with anchor text) are read first, then scripts and
+    # boilerplate are dropped from the same tree to get the main text and the JS signal.
+    tree = parse_html(html)
+    if tree is None:
+        return ParsedPage([], "", False)
+
+    resolve = _make_resolver(base_url)
+    links = []
+    for a in tree.iter("a"):
+        href = (a.get("href") or "").strip()
+        if not href or href.startswith("#"):
+            continue
+        links.append((resolve(href), clean_text(a.text_content())))
+
+    scripts = strip_non_content(tree)
+    js_driven = len(visible_text(tree)) < 200 and scripts > 5
+    return ParsedPage(links, main_text_from_tree(tree), js_driven)
@@ -1,18 +1,160 @@
 from __future__ import annotations
 
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+logger = logging.getLogger(__name__)
+
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+NETWORK_IDLE_TIMEOUT_MS = 3000
+POOL_SIZE = 2
+
+
+@dataclass
+class RenderTiming:
+    url: str
+    render_ms: int
+    ok: bool
+
+
+class RenderStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings: list[RenderTiming] = []
+
+    def record(self, url: str, render_ms: int, ok: bool) -> None:
+        with self._lock:
+            self._timings.append(RenderTiming(url, render_ms, ok))
+
+    def rows(self) -> list[dict]:
+        with self._lock:
+            return [asdict(t) for t in self._timings]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._timings.clear()
+
+
+RENDER_STATS = RenderStats()
+
+
+async def _block_heavy_resources(route) -> None:
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+class BrowserPool:
+    # One Chromium process with a bounded set of reusable contexts; the async API runs on a private loop thread
+    # so crawl workers on any thread can share it.
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = max(1, size)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="browser-pool", daemon=True)
+        self._thread.start()
+        self._playwright = None
+        self._browser = None
+        self._contexts: asyncio.Queue | None = None
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _start(self) -> None:
+        try:
+            from playwright.async_api import async_playwright
+        except Exception as exc:
+            raise RuntimeError("Playwright ikke installert") from exc
+
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=True)
+        self._contexts = asyncio.Queue()
+        for _ in range(self.size):
+            context = await self._browser.new_context()
+            await context.route("**/*", _block_heavy_resources)
+            self._contexts.put_nowait(context)
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if not self._started:
+                self._submit(self._start())
+                self._started = True
+
+    async def _render(self, url: str, timeout_ms: int) -> str:
+        from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+        context = await self._contexts.get()
+        page = await context.new_page()
+        try:
+            await page.goto(url, timeout=timeout_ms, wait_until="domcontentloaded")
+            try:
+                await page.wait_for_load_state("networkidle", timeout=NETWORK_IDLE_TIMEOUT_MS)
+            except PlaywrightTimeoutError:
+                pass
+            return await page.content()
+        finally:
+            await page.close()
+            await context.clear_cookies()
+            self._contexts.put_nowait(context)
+
+    def render(self, url: str, timeout_ms: int = 15000) -> str:
+        self._ensure_started()
+        started = time.monotonic()
+        ok = False
+        try:
+            html = self._submit(self._render(url, timeout_ms))
+            ok = True
+            return html
+        finally:
+            render_ms = int((time.monotonic() - started) * 1000)
+            RENDER_STATS.record(url, render_ms, ok)
+            logger.info("rendret %s på %d ms (ok=%s)", url, render_ms, ok)
+
+    async def _close(self) -> None:
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+
+    def close(self) -> None:
+        try:
+            if self._started:
+                self._submit(self._close())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=10)
+            self._loop.close()
+
+
+_pool: BrowserPool | None = None
+_pool_lock = threading.Lock()
+
+
+def configure_browser_pool(size: int) -> None:
+    global POOL_SIZE
+    POOL_SIZE = size
+
+
+def get_browser_pool() -> BrowserPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(POOL_SIZE)
+        return _pool
+
+
+def close_browser_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
 
 def fetch_rendered_html(url: str, timeout_ms: int = 15000) -> str:
-    try:
-        from playwright.sync_api import sync_playwright
-    except Exception as exc:
-        raise RuntimeError("Playwright ikke installert") from exc
-
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
-        page.goto(url, timeout=timeout_ms)
-        page.wait_for_timeout(1200)
-        html = page.content()
-        browser.close()
-    return html
-    
\ No newline at end of file
+    return get_browser_pool().render(url, timeout_ms)
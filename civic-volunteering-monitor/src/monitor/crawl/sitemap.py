@@ -1,11 +1,29 @@
 from __future__ import annotations
 
+import gzip
+import logging
 import re
+from collections import deque
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Iterator
 from xml.etree import ElementTree as ET
 
 from monitor.crawl.fetch import fetch_with_retries, DomainRateLimiter
 
+logger = logging.getLogger(__name__)
+
 SITEMAP_TAG_RE = re.compile(r"^Sitemap:\s*(\S+)", re.IGNORECASE)
+GZIP_MAGIC = b"\x1f\x8b"
+MAX_SITEMAPS = 50
+MAX_SITEMAP_DEPTH = 3
+MAX_URLS_PER_SITEMAP = 50_000
+
+
+@dataclass
+class SitemapEntry:
+    url: str
+    lastmod: str | None = None
 
 
 def discover_sitemaps(base_url: str, user_agent: str, timeout: int, limiter: DomainRateLimiter | None = None) -> list[str]:
@@ -25,15 +43,60 @@ def discover_sitemaps(base_url: str, user_agent: str, timeout: int, limiter: Dom
     return sitemaps
 
 
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def iter_sitemap(xml_content: bytes) -> Iterator[tuple[str, SitemapEntry]]:
+    # iterparse + clear() keeps memory flat for 50k-entry sitemaps; yields ("url" | "sitemap", entry).
+    stream = gzip.GzipFile(fileobj=BytesIO(xml_content)) if xml_content[:2] == GZIP_MAGIC else BytesIO(xml_content)
+    loc = lastmod = None
+    count = 0
+    context = ET.iterparse(stream, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event != "end":
+            continue
+        name = _local_name(elem.tag)
+        if name == "loc":
+            loc = (elem.text or "").strip() or None
+        elif name == "lastmod":
+            lastmod = (elem.text or "").strip() or None
+        elif name in {"url", "sitemap"}:
+            if loc:
+                yield name, SitemapEntry(loc, lastmod)
+                count += 1
+                if count >= MAX_URLS_PER_SITEMAP:
+                    return
+            loc = lastmod = None
+            root.clear()
+
+
 def parse_sitemap_urls(xml_content: bytes) -> list[str]:
-    root = ET.fromstring(xml_content)
-    ns = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
-    urls: list[str] = []
-    for node in root.findall(f".//{ns}loc"):
-        if node.text:
-            urls.append(node.text.strip())
-    if not urls:
-        for node in root.findall(".//loc"):
-            if node.text:
-                urls.append(node.text.strip())
-    return urls
+    return [entry.url for _, entry in iter_sitemap(xml_content)]
+
+
+def collect_sitemap_entries(
+    sitemap_urls: list[str], user_agent: str, timeout: int, limiter: DomainRateLimiter | None = None
+) -> list[SitemapEntry]:
+    entries: list[SitemapEntry] = []
+    visited: set[str] = set()
+    pending = deque((u, 0) for u in sitemap_urls)
+    while pending and len(visited) < MAX_SITEMAPS:
+        sitemap_url, depth = pending.popleft()
+        if sitemap_url in visited:
+            continue
+        visited.add(sitemap_url)
+        try:
+            res = fetch_with_retries(sitemap_url, user_agent, timeout, limiter=limiter)
+            if res.status_code != 200:
+                continue
+            for kind, entry in iter_sitemap(res.content):
+                if kind == "sitemap":
+                    if depth < MAX_SITEMAP_DEPTH:
+                        pending.append((entry.url, depth + 1))
+                else:
+                    entries.append(entry)
+        except Exception as exc:
+            logger.info("sitemap %s kunne ikke leses: %s", sitemap_url, exc)
+    return entries
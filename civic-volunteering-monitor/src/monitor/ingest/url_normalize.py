@@ -1,4 +1,6 @@
-from urllib.parse import urlparse
+from __future__ import annotations
+
+from urllib.parse import parse_qsl, urlencode, urlparse, urlsplit, urlunsplit
 
 
 def normalize_website_url(raw: str) -> str:
@@ -11,3 +13,42 @@ def normalize_website_url(raw: str) -> str:
     if not parsed.netloc:
         raise ValueError(f"Ugyldig URL: {raw}")
     return f"https://{parsed.netloc}".rstrip("/")
+
+
+TRACKING_PARAMS = {"fbclid", "gclid", "msclkid", "mc_cid", "mc_eid", "_ga", "_gl", "sid", "sessionid", "jsessionid", "phpsessid", "aspsessionid"}
+DEFAULT_PORTS = {":80", ":443"}
+
+
+def site_host(netloc: str) -> str:
+    host = (netloc or "").lower().rsplit("@", 1)[-1]
+    for port in DEFAULT_PORTS:
+        if host.endswith(port):
+            host = host[: -len(port)]
+    return host[4:] if host.startswith("www.") else host
+
+
+def same_site(url: str, base_url: str) -> bool:
+    return site_host(urlsplit(url).netloc) == site_host(urlsplit(base_url).netloc)
+
+
+def _is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name.startswith("utm_") or name in TRACKING_PARAMS
+
+
+def canonical_url(url: str, host: str | None = None) -> str:
+    # Key for dedupe and sources.url: https, no fragment/tracking/session params, sorted query, no trailing slash.
+    # With host set, www/non-www variants of that site are rewritten to it so the crawl keeps one spelling.
+    parts = urlsplit((url or "").strip())
+    netloc = parts.netloc.lower()
+    for port in DEFAULT_PORTS:
+        if netloc.endswith(port):
+            netloc = netloc[: -len(port)]
+    if host and site_host(netloc) == site_host(host):
+        netloc = host.lower()
+    scheme = "https" if parts.scheme.lower() in {"http", "https", ""} else parts.scheme.lower()
+    path = parts.path.split(";", 1)[0] or "/"
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not _is_tracking_param(k)))
+    return urlunsplit((scheme, netloc, path, query, ""))
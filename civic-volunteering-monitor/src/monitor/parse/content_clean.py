@@ -1,14 +1,65 @@
 from __future__ import annotations
 
-import re
+import lxml.html
+from lxml.etree import ParserError
+
+NON_CONTENT_TAGS = ("script", "style", "noscript", "template")
+BOILERPLATE_TAGS = ("nav", "aside")
+# Page header/footer are boilerplate, but inside <main>/<article> they hold the title and byline.
+PAGE_SECTION_TAGS = ("header", "footer")
+CONTENT_TAGS = ("main", "article")
+BOILERPLATE_ROLES = ("navigation", "banner", "contentinfo", "search")
 
 
 def clean_text(text: str) -> str:
     return " ".join((text or "").split())
 
 
+def parse_html(html: str):
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # lxml refuses str input that carries an XML encoding declaration.
+        return lxml.html.document_fromstring(html.encode("utf-8"))
+    except ParserError:
+        return None
+
+
+def strip_non_content(tree) -> int:
+    scripts = 0
+    for el in list(tree.iter(*NON_CONTENT_TAGS)):
+        scripts += el.tag == "script"
+        el.drop_tree()
+    return scripts
+
+
+def visible_text(tree) -> str:
+    # Text nodes are joined with spaces, as the old tag-stripping regex did, so block elements don't run together.
+    body = tree.find("body")
+    return clean_text(" ".join((body if body is not None else tree).itertext()))
+
+
+def _in_content(el) -> bool:
+    return any(a.tag in CONTENT_TAGS for a in el.iterancestors())
+
+
+def main_text_from_tree(tree) -> str:
+    # <form> is kept: ASP.NET WebForms pages wrap the whole body in one. If nothing survives, use all visible text.
+    full = visible_text(tree)
+    for el in list(tree.iter(*BOILERPLATE_TAGS)):
+        el.drop_tree()
+    for el in list(tree.iter(*PAGE_SECTION_TAGS)):
+        if not _in_content(el):
+            el.drop_tree()
+    for el in tree.xpath("//*[@role]"):
+        if el.get("role") in BOILERPLATE_ROLES and el.getparent() is not None:
+            el.drop_tree()
+    return visible_text(tree) or full
+
+
 def extract_main_text_from_html(html: str) -> str:
-    no_script = re.sub(r"<script[\s\S]*?</script>", " ", html, flags=re.IGNORECASE)
-    no_style = re.sub(r"<style[\s\S]*?</style>", " ", no_script, flags=re.IGNORECASE)
-    text = re.sub(r"<[^>]+>", " ", no_style)
-    return clean_text(text)
+    tree = parse_html(html)
+    if tree is None:
+        return ""
+    strip_non_content(tree)
+    return main_text_from_tree(tree)
@@ -1,12 +1,14 @@
 from __future__ import annotations
 
+from pathlib import Path
 
-def extract_docx_text(content: bytes) -> str:
+
+def extract_docx_text(source: bytes | str | Path) -> str:
     try:
         from docx import Document
     except Exception:
         return ""
     from io import BytesIO
 
-    doc = Document(BytesIO(content))
+    doc = Document(BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else str(source))
     return "\n".join(p.text for p in doc.paragraphs).strip()
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+EXTRACT_OK = "ok"
+EXTRACT_TRUNCATED = "truncated"
+EXTRACT_TIMEOUT = "timeout"
+EXTRACT_FAILED = "failed"
+EXTRACT_CRASHED = "crashed"
+
+
+@dataclass
+class ExtractResult:
+    text: str
+    needs_ocr: bool
+    status: str
+    elapsed_ms: int
+    pages: int = 0
+    error: str = ""
+
+
+def _limit_memory(max_memory_bytes: int) -> None:
+    try:
+        import resource
+    except ImportError:
+        return
+    if max_memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory_bytes, max_memory_bytes))
+
+
+def _extract_in_child(conn, kind: str, source, max_pages: int, max_memory_bytes: int) -> None:
+    try:
+        _limit_memory(max_memory_bytes)
+        if kind == "pdf":
+            from monitor.parse.pdf_text import extract_pdf_pages
+
+            text, needs_ocr, pages = extract_pdf_pages(source, max_pages)
+            status = EXTRACT_TRUNCATED if pages > max_pages else EXTRACT_OK
+            conn.send((status, text, needs_ocr, pages, ""))
+        else:
+            from monitor.parse.doc_text import extract_docx_text
+
+            conn.send((EXTRACT_OK, extract_docx_text(source), False, 0, ""))
+    except BaseException as exc:
+        conn.send((EXTRACT_FAILED, "", False, 0, f"{type(exc).__name__}: {exc}"))
+    finally:
+        conn.close()
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    # forkserver avoids forking a process whose crawl threads may hold locks.
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class ExtractPool:
+    # One short-lived process per document, at most `workers` at a time, so a hung or runaway parse can be
+    # killed on its own without taking the pool (or the run) down with it.
+    def __init__(self, workers: int | None = None, timeout: float = 120, max_pages: int = 500, max_memory_mb: int = 1024):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.timeout = timeout
+        self.max_pages = max_pages
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._ctx = _mp_context()
+
+    def extract(self, kind: str, source: bytes | str | Path) -> ExtractResult:
+        if isinstance(source, Path):
+            source = str(source)
+        with self._slots:
+            started = time.monotonic()
+            result = self._run(kind, source)
+            result.elapsed_ms = int((time.monotonic() - started) * 1000)
+        return result
+
+    def _run(self, kind: str, source) -> ExtractResult:
+        recv, send = self._ctx.Pipe(duplex=False)
+        proc = self._ctx.Process(
+            target=_extract_in_child, args=(send, kind, source, self.max_pages, self.max_memory_bytes), daemon=True
+        )
+        proc.start()
+        send.close()
+        try:
+            if recv.poll(self.timeout):
+                status, text, needs_ocr, pages, error = recv.recv()
+                return ExtractResult(text, needs_ocr, status, 0, pages, error)
+            if proc.is_alive():
+                return ExtractResult("", False, EXTRACT_TIMEOUT, 0, error=f"over {self.timeout}s")
+            return ExtractResult("", False, EXTRACT_CRASHED, 0, error=f"exitcode {proc.exitcode}")
+        except EOFError:
+            proc.join(1)
+            return ExtractResult("", False, EXTRACT_CRASHED, 0, error=f"exitcode {proc.exitcode}")
+        finally:
+            recv.close()
+            if proc.is_alive():
+                proc.kill()
+            proc.join()
+
+
+_pool: ExtractPool | None = None
+_pool_lock = threading.Lock()
+_config: dict = {}
+
+
+def configure_extract_pool(workers: int | None, timeout: float, max_pages: int, max_memory_mb: int) -> None:
+    global _pool
+    with _pool_lock:
+        _config.update(workers=workers, timeout=timeout, max_pages=max_pages, max_memory_mb=max_memory_mb)
+        _pool = None
+
+
+def get_extract_pool() -> ExtractPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExtractPool(**_config)
+        return _pool
+
+
+def extract_document(kind: str, source: bytes | str | Path, label: str = "") -> ExtractResult:
+    result = get_extract_pool().extract(kind, source)
+    if result.status == EXTRACT_OK:
+        logger.info("ekstraherte %s på %d ms (%d sider)", label or kind, result.elapsed_ms, result.pages)
+    else:
+        logger.warning("ekstraksjon %s: %s etter %d ms %s", label or kind, result.status, result.elapsed_ms, result.error)
+    return result
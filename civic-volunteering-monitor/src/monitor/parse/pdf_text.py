@@ -1,14 +1,24 @@
 from __future__ import annotations
 
 from io import BytesIO
+from pathlib import Path
+
 from pypdf import PdfReader
 
 
-def extract_pdf_text(content: bytes) -> tuple[str, bool]:
-    reader = PdfReader(BytesIO(content))
+def extract_pdf_pages(source: bytes | str | Path, max_pages: int | None = None) -> tuple[str, bool, int]:
+    reader = PdfReader(BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source)
+    total = len(reader.pages)
     pages = []
-    for p in reader.pages:
+    for idx, p in enumerate(reader.pages):
+        if max_pages is not None and idx >= max_pages:
+            break
         pages.append(p.extract_text() or "")
     text = "\n".join(pages).strip()
     needs_ocr = len(text) < 200
+    return text, needs_ocr, total
+
+
+def extract_pdf_text(source: bytes | str | Path, max_pages: int | None = None) -> tuple[str, bool]:
+    text, needs_ocr, _ = extract_pdf_pages(source, max_pages)
     return text, needs_ocr
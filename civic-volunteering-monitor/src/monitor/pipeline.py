@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+from monitor.crawl.dispatcher import CHECKPOINT_EVERY, CrawlBudget, CrawlResult, crawl_jurisdiction, discard_responses
+from monitor.crawl.fetch import SHARED_LIMITER, conditional_headers, fetch_with_retries
+from monitor.ingest.excel_loader import JurisdictionRow
+from monitor.ingest.url_normalize import canonical_url
+from monitor.store.blob_store import store_blob
+from monitor.store.db import (
+    claim_job,
+    completed_jurisdictions,
+    delete_checkpoint,
+    enqueue_jobs,
+    enqueue_work,
+    fail_job,
+    finish_job,
+    get_or_create_document,
+    get_or_create_source,
+    insert_status,
+    job_counts,
+    known_validators,
+    load_checkpoint,
+    load_sitemap_fetches,
+    register_blob,
+    renew_leases,
+    save_checkpoint,
+    save_sitemap_state,
+    touch_document_version,
+    upsert_document_version,
+    upsert_jurisdiction,
+    utcnow_iso,
+)
+from monitor.store.dedupe import sha256_bytes
+from monitor.store.page_cache import get_page_cache
+from monitor.store.writer import DbWriter
+from monitor.store.models import COVERAGE_STATUS_FAIL, COVERAGE_STATUS_OK, COVERAGE_STATUS_WARN
+from monitor.stages import STAGE_EXTRACT
+
+logger = logging.getLogger(__name__)
+
+JOB_JURISDICTION = "jurisdiction"
+JOB_MAX_ATTEMPTS = 3
+JOB_POLL_INTERVAL = 1.0
+
+
+@dataclass
+class JurisdictionOutcome:
+    coverage_row: dict
+
+
+def doc_ext_and_type(url: str, content_type: str) -> tuple[str, str]:
+    u = url.lower()
+    if u.endswith(".pdf") or "pdf" in content_type:
+        return "pdf", "PDF"
+    if u.endswith(".docx") or "wordprocessingml" in content_type:
+        return "docx", "DOCX"
+    return "html", "HTML"
+
+
+def _status_row(run_id: int, j: JurisdictionRow, status: str, **counts) -> dict:
+    return {
+        "run_id": run_id,
+        "jurisdiction_id": j.jurisdiction_id,
+        "name": j.name,
+        "website": j.website,
+        "status": status,
+        "http_errors_count": counts.get("http_errors_count", 0),
+        "timeouts_count": counts.get("timeouts_count", 0),
+        "pages_fetched": counts.get("pages_fetched", 0),
+        "docs_found": counts.get("docs_found", 0),
+        "docs_downloaded": counts.get("docs_downloaded", 0),
+        "docs_not_modified": counts.get("docs_not_modified", 0),
+        "fetches_saved": counts.get("fetches_saved", 0),
+        "error_message": counts.get("error_message", ""),
+        "notes": counts.get("notes", ""),
+    }
+
+
+def _download_document(settings, writer: DbWriter, run_id: int, j: JurisdictionRow, item: dict, limiter, counters: dict) -> None:
+    url = canonical_url(item["url"])
+    title = item.get("title", "")
+    r = item.pop("response", None)
+    known = None
+    if r is not None:
+        counters["fetches_saved"] += 1
+    else:
+        known = writer.call(known_validators, j.jurisdiction_id, url)
+        headers = conditional_headers(known["etag"], known["last_modified"]) if known else None
+        fetch_url = item.get("fetch_url") or url
+        r = fetch_with_retries(fetch_url, settings.user_agent, settings.request_timeout, limiter=limiter, headers=headers)
+    if r.status_code == 304 and known:
+        writer.submit(touch_document_version, known["id"])
+        counters["docs_not_modified"] += 1
+        return
+    if r.status_code != 200:
+        r.discard()
+        return
+    ext, dtype = doc_ext_and_type(url, r.headers.get("Content-Type", ""))
+    # Spooled documents are hashed while streaming and moved into the blob store without being read back.
+    source = r.path or r.content
+    content_hash = r.content_hash or sha256_bytes(r.content)
+
+    size = r.size or len(r.content)
+    try:
+        blob_path, written = store_blob(settings.blob_dir, content_hash, ext, source)
+    finally:
+        r.discard()
+    if not written:
+        counters["blobs_reused"] = counters.get("blobs_reused", 0) + 1
+    stored_size = os.path.getsize(blob_path)
+
+    def record(conn) -> None:
+        register_blob(conn, content_hash, blob_path, ext, size, stored_size)
+        source_id = get_or_create_source(conn, j.jurisdiction_id, url, title)
+        document_id = get_or_create_document(conn, source_id, dtype)
+        version_id, changed = upsert_document_version(
+            conn,
+            document_id,
+            content_hash,
+            http_status=r.status_code,
+            content_type=r.headers.get("Content-Type"),
+            etag=r.headers.get("ETag"),
+            last_modified=r.headers.get("Last-Modified"),
+            blob_path=blob_path,
+            run_id=run_id,
+        )
+        # Extraction and classification run as separate queue stages so a slow parse or LLM call never
+        # holds up the network stage.
+        if changed:
+            enqueue_work(conn, STAGE_EXTRACT, version_id)
+
+    writer.submit(record)
+    counters["docs_downloaded"] += 1
+
+
+def process_jurisdiction(settings, writer: DbWriter, run_id: int, j: JurisdictionRow, resume: bool = False) -> JurisdictionOutcome:
+    writer.submit(upsert_jurisdiction, j)
+    last_fetched = writer.call(load_sitemap_fetches, j.jurisdiction_id)
+    state = writer.call(load_checkpoint, run_id, j.jurisdiction_id) if resume else None
+
+    def checkpoint(payload: dict) -> None:
+        writer.submit(save_checkpoint, run_id, j.jurisdiction_id, payload)
+
+    counters = {"docs_downloaded": 0, "docs_not_modified": 0, "fetches_saved": 0}
+    result = None
+    try:
+        if state and state.get("phase") == "download":
+            result = CrawlResult.from_state(state["result"])
+            counters.update(state.get("counters", {}))
+            docs_done = state.get("docs_done", 0)
+            logger.info("%s: fortsetter nedlasting fra dokument %d", j.website, docs_done)
+        else:
+            crawl_started = utcnow_iso()
+            result = crawl_jurisdiction(
+                j.website,
+                settings.request_timeout,
+                settings.user_agent,
+                settings.playwright_enabled,
+                last_fetched=last_fetched,
+                resume_state=state,
+                checkpoint=lambda payload: checkpoint({"phase": "crawl", **payload}),
+                budget=CrawlBudget(settings.crawl_max_pages, settings.crawl_max_seconds, settings.crawl_max_depth),
+                page_cache=get_page_cache(),
+            )
+            writer.submit(save_sitemap_state, j.jurisdiction_id, result.sitemap_entries, result.fetched_urls, crawl_started)
+            docs_done = 0
+        limiter = SHARED_LIMITER
+
+        for idx in range(docs_done, len(result.docs_found)):
+            if idx % CHECKPOINT_EVERY == 0:
+                checkpoint({"phase": "download", "result": result.to_state(), "docs_done": idx, "counters": counters})
+            item = result.docs_found[idx]
+            try:
+                _download_document(settings, writer, run_id, j, item, limiter, counters)
+            except Exception as exc:
+                logger.warning("dokumentfeil %s: %s", item["url"], exc)
+
+        if counters.get("blobs_reused"):
+            logger.info("%s: %d dokumenter fantes allerede i blob-lageret", j.website, counters["blobs_reused"])
+        status = COVERAGE_STATUS_OK if result.http_errors == 0 and result.timeouts == 0 else COVERAGE_STATUS_WARN
+        row = _status_row(
+            run_id,
+            j,
+            status,
+            http_errors_count=result.http_errors,
+            timeouts_count=result.timeouts,
+            pages_fetched=result.pages_fetched,
+            docs_found=len(result.docs_found),
+            notes=";".join(sorted(set(result.notes))),
+            **counters,
+        )
+    except Exception as exc:
+        row = _status_row(run_id, j, COVERAGE_STATUS_FAIL, error_message=str(exc), notes="crawl_failed")
+    finally:
+        if result is not None:
+            discard_responses(result.docs_found)
+
+    def finish(conn) -> None:
+        insert_status(conn, row)
+        delete_checkpoint(conn, run_id, j.jurisdiction_id)
+
+    writer.submit(finish)
+    return JurisdictionOutcome(row)
+
+
+def run_jurisdictions(
+    settings,
+    conn,
+    run_id: int,
+    jurisdictions: list[JurisdictionRow],
+    max_concurrency: int,
+    resume: bool = False,
+    writer: DbWriter | None = None,
+) -> list[JurisdictionOutcome]:
+    own_writer = writer is None
+    writer = writer or DbWriter(conn)
+    workers = max(1, max_concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jurisdiction") as pool:
+            futures = [pool.submit(process_jurisdiction, settings, writer, run_id, j, resume) for j in jurisdictions]
+            # Results are collected in input order so reports do not depend on which worker finished first.
+            return [f.result() for f in futures]
+    finally:
+        if own_writer:
+            writer.close()
+        else:
+            writer.flush()
+
+
+def enqueue_jurisdiction_jobs(writer: DbWriter, run_id: int, jurisdictions: list[JurisdictionRow]) -> None:
+    items = [(j.jurisdiction_id, asdict(j)) for j in jurisdictions]
+    writer.call(enqueue_jobs, run_id, JOB_JURISDICTION, items)
+
+
+def run_worker(
+    settings,
+    writer: DbWriter,
+    run_id: int,
+    owner: str,
+    max_concurrency: int,
+    lease_seconds: float,
+    poll_interval: float = JOB_POLL_INTERVAL,
+) -> int:
+    # Drains the run's jurisdiction jobs together with any other worker processes on the same database. Leases are
+    # renewed in the background; a worker that dies stops renewing and its jobs are picked up again after expiry,
+    # resuming from the checkpoint the dead worker left behind.
+    stop = threading.Event()
+
+    def heartbeat() -> None:
+        # A failed renewal is retried on the next beat; letting it kill the thread would let every lease expire.
+        while not stop.wait(lease_seconds / 3):
+            try:
+                writer.call(renew_leases, owner, lease_seconds)
+            except Exception as exc:
+                logger.warning("worker %s: kunne ikke fornye lease: %s", owner, exc)
+
+    processed = [0]
+    count_lock = threading.Lock()
+
+    def work() -> None:
+        while True:
+            job = writer.call(claim_job, run_id, JOB_JURISDICTION, owner, lease_seconds, JOB_MAX_ATTEMPTS)
+            if job is None:
+                if not writer.call(job_counts, run_id, JOB_JURISDICTION).get("leased"):
+                    return
+                time.sleep(poll_interval)
+                continue
+            j = JurisdictionRow(**json.loads(job["payload_json"]))
+            try:
+                # A reclaimed job may already have been finished by a worker that outlived its lease.
+                if j.jurisdiction_id not in writer.call(completed_jurisdictions, run_id):
+                    process_jurisdiction(settings, writer, run_id, j, resume=job["attempts"] > 1)
+                if not writer.call(finish_job, job["id"], owner):
+                    # The lease ran out mid-job and another worker owns it now; its result replaces ours.
+                    logger.warning("jobb %s: leasen gikk tapt underveis, en annen worker har tatt over", j.jurisdiction_id)
+                    continue
+                with count_lock:
+                    processed[0] += 1
+            except Exception as exc:
+                logger.warning("jobb %s feilet (forsøk %d): %s", j.jurisdiction_id, job["attempts"], exc)
+                writer.call(fail_job, job["id"], owner, str(exc), JOB_MAX_ATTEMPTS)
+
+    beat = threading.Thread(target=heartbeat, name="job-heartbeat", daemon=True)
+    beat.start()
+    workers = max(1, max_concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jurisdiction") as pool:
+            for f in [pool.submit(work) for _ in range(workers)]:
+                f.result()
+    finally:
+        stop.set()
+        beat.join()
+        writer.flush()
+    return processed[0]
+
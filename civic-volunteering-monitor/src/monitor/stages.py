@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from monitor.classify.classify_doc import classify_cache_key, classify_document
+from monitor.classify.llm_client import llm_model
+from monitor.parse.content_clean import extract_main_text_from_html
+from monitor.parse.extract_pool import EXTRACT_OK, EXTRACT_TRUNCATED, extract_document
+from monitor.store.blob_store import blob_ext, read_blob
+from monitor.store.dedupe import hamming, text_fingerprint
+from monitor.store.db import (
+    claim_work,
+    enqueue_work,
+    fail_work,
+    find_near_duplicate,
+    finish_work,
+    load_extracted_text,
+    load_llm_cache,
+    previous_version,
+    record_cache_stat,
+    requeue_running,
+    renew_work_leases,
+    reuse_classification,
+    save_extracted_text,
+    save_llm_cache,
+    version_for_stage,
+)
+from monitor.store.writer import DbWriter
+
+logger = logging.getLogger(__name__)
+
+STAGE_EXTRACT = "extract"
+STAGE_CLASSIFY = "classify"
+CACHE_LLM = "llm"
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 0.2
+# Timeouts and crashes may be transient, so only successful extractions are reused.
+REUSABLE_STATUSES = {EXTRACT_OK, EXTRACT_TRUNCATED}
+
+
+class CacheCounter:
+    # Hits and misses seen by this process, whichever runs the versions belong to; cache_stats keeps them per run.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: dict[str, list[int]] = {}
+
+    def record(self, cache: str, hit: bool, saved: int = 0) -> None:
+        with self._lock:
+            counts = self._counts.setdefault(cache, [0, 0, 0])
+            counts[0 if hit else 1] += 1
+            counts[2] += saved
+
+    def get(self, cache: str) -> tuple[int, int, int]:
+        with self._lock:
+            return tuple(self._counts.get(cache, (0, 0, 0)))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+
+CACHE_STATS = CacheCounter()
+
+
+def count_cache(conn, run_id: int | None, cache: str, hit: bool, saved: int = 0) -> None:
+    CACHE_STATS.record(cache, hit, saved)
+    record_cache_stat(conn, run_id, cache, hit, saved)
+
+
+def llm_configured(settings) -> bool:
+    return bool(settings.openai_api_key or settings.azure_openai_api_key)
+
+
+def _extract_blob(path: Path, label: str) -> tuple[str, bool, str, int]:
+    ext = blob_ext(path)
+    if ext in {"pdf", "docx"}:
+        extracted = extract_document(ext, path, label=label)
+        return extracted.text, extracted.needs_ocr, extracted.status, extracted.elapsed_ms
+    started = time.monotonic()
+    text = extract_main_text_from_html(read_blob(path).decode("utf-8", errors="replace"))
+    return text, False, EXTRACT_OK, int((time.monotonic() - started) * 1000)
+
+
+def _load_for_extract(conn, version_id: int):
+    v = version_for_stage(conn, version_id)
+    return v, load_extracted_text(conn, v["content_hash"]) if v else None
+
+
+def extract_version(settings, writer: DbWriter, version_id: int, reuse: bool = True) -> None:
+    # reuse=False (`monitor extract --all`) parses again even when the memo has text; the memo row is overwritten
+    # in place, and a re-extraction that fails keeps the text already there.
+    v, cached = writer.call(_load_for_extract, version_id)
+    if v is None or not v["blob_path"]:
+        raise ValueError(f"versjon {version_id} mangler blob")
+    # Text is memoized per content hash, so a document shared by many kommuner is parsed once across all runs.
+    reusable = cached is not None and cached["extract_status"] in REUSABLE_STATUSES
+    hit = reusable and reuse
+    if not hit:
+        text, needs_ocr, status, elapsed_ms = _extract_blob(Path(v["blob_path"]), v["url"])
+        fingerprint = text_fingerprint(text)
+        if reusable and status not in REUSABLE_STATUSES:
+            logger.warning("ny uttrekking av versjon %d feilet (%s), beholder forrige tekst", version_id, status)
+            hit = True
+    if hit:
+        text, needs_ocr, status, elapsed_ms = cached["text"], bool(cached["needs_ocr"]), cached["extract_status"], 0
+        fingerprint = (cached["text_hash"], cached["simhash"]) if cached["text_hash"] else None
+
+    def record(conn) -> None:
+        if not hit:
+            save_extracted_text(conn, v["content_hash"], text, needs_ocr, status, elapsed_ms, fingerprint)
+        conn.execute(
+            "UPDATE document_versions SET extracted_text=NULL, needs_ocr=?, extract_status=?, extract_ms=? WHERE id=?",
+            (int(needs_ocr), status, elapsed_ms, version_id),
+        )
+        conn.commit()
+        count_cache(conn, v["run_id"], STAGE_EXTRACT, hit)
+        already_classified = v["llm_json"] is not None and text == (v["extracted_text"] or "")
+        if fingerprint is None or already_classified:
+            return
+        # New bytes with (nearly) the same text as the previous version, e.g. a regenerated PDF or a rotating
+        # news widget, count as unchanged: the version points at its predecessor and inherits its classification.
+        prev = previous_version(conn, version_id)
+        if prev is not None and _near(fingerprint, prev, settings.near_duplicate_max_distance):
+            if reuse_classification(conn, version_id, prev["id"]):
+                count_cache(conn, v["run_id"], STAGE_CLASSIFY, True)
+                return
+        enqueue_work(conn, STAGE_CLASSIFY, version_id)
+
+    writer.call(record)
+
+
+def _near(fingerprint: tuple[str, int], other, max_distance: int) -> bool:
+    if max_distance < 0 or other["text_hash"] is None:
+        return False
+    return fingerprint[0] == other["text_hash"] or hamming(fingerprint[1], other["simhash"]) <= max_distance
+
+
+def _save_llm_json(conn, version_id: int, llm_json: dict) -> None:
+    conn.execute("UPDATE document_versions SET llm_json=? WHERE id=?", (json.dumps(llm_json, ensure_ascii=False), version_id))
+    conn.commit()
+
+
+def classify_version(settings, writer: DbWriter, version_id: int) -> None:
+    v = writer.call(version_for_stage, version_id)
+    if v is None or not (v["extracted_text"] or "").strip():
+        return
+    if v["simhash"] is not None and settings.near_duplicate_max_distance >= 0:
+        # The same text published by another kommune (or an earlier run) has already been classified.
+        source = writer.call(find_near_duplicate, v["simhash"], settings.near_duplicate_max_distance, version_id)
+        if source is not None and writer.call(reuse_classification, version_id, source):
+            writer.submit(count_cache, v["run_id"], STAGE_CLASSIFY, True)
+            return
+    # Responses are cached by model, prompt, schema and text; temperature 0 makes a cached answer as good as a new one.
+    key = classify_cache_key(settings, v["extracted_text"])
+    cached = writer.call(load_llm_cache, key)
+    if cached is not None:
+        llm_json = json.loads(cached["response_json"])
+        writer.submit(count_cache, v["run_id"], CACHE_LLM, True, cached["tokens"] or 0)
+    else:
+        meta = {"url": v["url"], "title": v["title"], "jurisdiction": v["jurisdiction"], "doc_type": v["doc_type"]}
+        llm_json, tokens = classify_document(settings, v["extracted_text"], meta)
+        writer.submit(save_llm_cache, key, llm_model(settings), llm_json, tokens)
+        writer.submit(count_cache, v["run_id"], CACHE_LLM, False)
+    # Write-behind: concurrent classification threads end up committed together in the writer's next batch.
+    writer.submit(_save_llm_json, version_id, llm_json)
+    writer.submit(count_cache, v["run_id"], STAGE_CLASSIFY, False)
+
+
+STAGE_HANDLERS = {STAGE_EXTRACT: extract_version, STAGE_CLASSIFY: classify_version}
+
+
+def run_stage(
+    settings,
+    writer: DbWriter,
+    stage: str,
+    workers: int,
+    producers_done: threading.Event | None = None,
+    options: dict | None = None,
+) -> int:
+    # Drains one stage of the work queue. With producers_done the workers keep polling until the upstream stage
+    # has finished, so extraction and classification overlap with the crawl instead of running inside it.
+    handler = STAGE_HANDLERS[stage]
+    # Other processes (`monitor worker`) may share the queue: claimed items are leased and renewed, and only
+    # items whose lease ran out are taken back.
+    owner = f"{socket.gethostname()}:{os.getpid()}:{stage}:{uuid.uuid4().hex[:8]}"
+    lease_seconds = settings.job_lease_seconds
+    requeued = writer.call(requeue_running, stage)
+    if requeued:
+        logger.info("%s: %d avbrutte oppgaver lagt tilbake i køen", stage, requeued)
+    processed = [0]
+    count_lock = threading.Lock()
+    stop = threading.Event()
+
+    def heartbeat() -> None:
+        while not stop.wait(lease_seconds / 3):
+            try:
+                writer.call(renew_work_leases, owner, lease_seconds)
+            except Exception as exc:
+                logger.warning("%s: kunne ikke fornye lease: %s", stage, exc)
+
+    def worker() -> None:
+        while True:
+            upstream_done = producers_done is None or producers_done.is_set()
+            item = writer.call(claim_work, stage, owner, lease_seconds)
+            if item is None:
+                if upstream_done:
+                    return
+                time.sleep(POLL_INTERVAL)
+                continue
+            try:
+                handler(settings, writer, item["version_id"], **(options or {}))
+                writer.submit(finish_work, item["id"], owner)
+                with count_lock:
+                    processed[0] += 1
+            except Exception as exc:
+                logger.warning("%s feilet for versjon %d (forsøk %d): %s", stage, item["version_id"], item["attempts"] + 1, exc)
+                writer.call(fail_work, item["id"], owner, str(exc), MAX_ATTEMPTS)
+
+    beat = threading.Thread(target=heartbeat, name=f"{stage}-heartbeat", daemon=True)
+    beat.start()
+    n = max(1, workers)
+    try:
+        with ThreadPoolExecutor(max_workers=n, thread_name_prefix=stage) as pool:
+            for f in [pool.submit(worker) for _ in range(n)]:
+                f.result()
+    finally:
+        stop.set()
+        beat.join()
+    writer.flush()
+    return processed[0]
+
+
+def start_stage(settings, writer: DbWriter, stage: str, workers: int, producers_done: threading.Event) -> tuple[threading.Thread, threading.Event]:
+    done = threading.Event()
+
+    def target() -> None:
+        try:
+            n = run_stage(settings, writer, stage, workers, producers_done)
+            logger.info("%s: %d oppgaver ferdige", stage, n)
+        finally:
+            done.set()
+
+    thread = threading.Thread(target=target, name=f"stage-{stage}", daemon=True)
+    thread.start()
+    return thread, done
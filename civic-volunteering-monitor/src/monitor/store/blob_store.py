@@ -1,11 +1,65 @@
 from __future__ import annotations
 
+import gzip
+import os
+import shutil
+import tempfile
 from pathlib import Path
 
+# PDF and DOCX are already compressed internally; gzip only pays off for markup and plain text.
+COMPRESSED_EXTS = {"html", "htm", "xml", "txt", "json", "csv"}
+GZIP_SUFFIX = ".gz"
 
-def store_blob(blob_dir: str, jurisdiction_id: str, content_hash: str, ext: str, data: bytes) -> str:
-    path = Path(blob_dir) / jurisdiction_id
-    path.mkdir(parents=True, exist_ok=True)
-    file_path = path / f"{content_hash}.{ext}"
-    file_path.write_bytes(data)
-    return str(file_path)
+
+def blob_path_for(blob_dir: str, content_hash: str, ext: str) -> Path:
+    # Content-addressed and sharded (ab/cd/abcd....ext) so a document linked by hundreds of kommuner is stored once
+    # and no directory grows past a few thousand entries.
+    name = f"{content_hash}.{ext}" + (GZIP_SUFFIX if ext in COMPRESSED_EXTS else "")
+    return Path(blob_dir) / content_hash[:2] / content_hash[2:4] / name
+
+
+def blob_ext(path: str | Path) -> str:
+    name = Path(path).name
+    if name.endswith(GZIP_SUFFIX):
+        name = name[: -len(GZIP_SUFFIX)]
+    return name.rsplit(".", 1)[-1] if "." in name else ""
+
+
+def store_blob(blob_dir: str, content_hash: str, ext: str, data: bytes | str | Path) -> tuple[str, bool]:
+    file_path = blob_path_for(blob_dir, content_hash, ext)
+    if file_path.exists():
+        return str(file_path), False
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=file_path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            if file_path.name.endswith(GZIP_SUFFIX):
+                with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6, mtime=0) as gz:
+                    _copy_into(data, gz)
+            elif isinstance(data, (bytes, bytearray, memoryview)):
+                out.write(data)
+        if not isinstance(data, (bytes, bytearray, memoryview)) and not file_path.name.endswith(GZIP_SUFFIX):
+            # Spooled downloads are moved into place instead of being copied.
+            shutil.move(str(data), tmp)
+        # Atomic rename: concurrent writers of the same hash both end up with one complete file.
+        os.replace(tmp, file_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return str(file_path), True
+
+
+def _copy_into(data: bytes | str | Path, out) -> None:
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        out.write(data)
+    else:
+        with open(data, "rb") as src:
+            shutil.copyfileobj(src, out)
+
+
+def read_blob(path: str | Path) -> bytes:
+    if str(path).endswith(GZIP_SUFFIX):
+        with gzip.open(path, "rb") as f:
+            return f.read()
+    return Path(path).read_bytes()
@@ -1,9 +1,14 @@
 from __future__ import annotations
 
+import json
 import sqlite3
+import time
 from datetime import datetime, timezone
 from pathlib import Path
 
+from monitor.store.dedupe import hamming, simhash_bands
+from monitor.store.migrations import migrate
+
 
 def _sqlite_path(db_url: str) -> str:
     if not db_url.startswith("sqlite:///"):
@@ -15,74 +20,40 @@ def utcnow_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def connect(db_url: str) -> sqlite3.Connection:
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": "-65536",
+    "busy_timeout": "10000",
+}
+
+
+class MonitorConnection(sqlite3.Connection):
+    # Helpers commit after each call so they stay safe to use on their own; inside a DbWriter batch those
+    # commits are skipped and the writer commits once for the whole batch.
+    batching = False
+
+    def commit(self) -> None:
+        if not self.batching:
+            super().commit()
+
+    def commit_batch(self) -> None:
+        super().commit()
+
+
+def connect(db_url: str) -> MonitorConnection:
     path = _sqlite_path(db_url)
     Path(path).parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(path)
+    conn = sqlite3.connect(path, check_same_thread=False, factory=MonitorConnection)
     conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name}={value}")
     return conn
 
 
 def init_db(conn: sqlite3.Connection) -> None:
-    conn.executescript(
-        """
-        CREATE TABLE IF NOT EXISTS jurisdictions (
-            id INTEGER PRIMARY KEY,
-            jurisdiction_id TEXT UNIQUE,
-            name TEXT,
-            type TEXT,
-            website TEXT
-        );
-        CREATE TABLE IF NOT EXISTS crawl_runs (
-            id INTEGER PRIMARY KEY,
-            started_at TEXT,
-            finished_at TEXT
-        );
-        CREATE TABLE IF NOT EXISTS crawl_run_jurisdiction_status (
-            id INTEGER PRIMARY KEY,
-            run_id INTEGER,
-            jurisdiction_id TEXT,
-            name TEXT,
-            website TEXT,
-            status TEXT,
-            http_errors_count INTEGER,
-            timeouts_count INTEGER,
-            pages_fetched INTEGER,
-            docs_found INTEGER,
-            docs_downloaded INTEGER,
-            error_message TEXT,
-            notes TEXT
-        );
-        CREATE TABLE IF NOT EXISTS sources (
-            id INTEGER PRIMARY KEY,
-            jurisdiction_id TEXT,
-            url TEXT,
-            title TEXT,
-            UNIQUE(jurisdiction_id, url)
-        );
-        CREATE TABLE IF NOT EXISTS documents (
-            id INTEGER PRIMARY KEY,
-            source_id INTEGER,
-            doc_type TEXT
-        );
-        CREATE TABLE IF NOT EXISTS document_versions (
-            id INTEGER PRIMARY KEY,
-            document_id INTEGER,
-            content_hash TEXT,
-            first_seen TEXT,
-            last_seen TEXT,
-            http_status INTEGER,
-            content_type TEXT,
-            etag TEXT,
-            last_modified TEXT,
-            blob_path TEXT,
-            extracted_text TEXT,
-            needs_ocr INTEGER DEFAULT 0,
-            llm_json TEXT
-        );
-        """
-    )
-    conn.commit()
+    migrate(conn)
 
 
 def upsert_jurisdiction(conn, row):
@@ -102,11 +73,23 @@ def create_run(conn) -> int:
     return cur.lastrowid
 
 
+def run_exists(conn, run_id: int) -> bool:
+    return conn.execute("SELECT 1 FROM crawl_runs WHERE id=?", (run_id,)).fetchone() is not None
+
+
 def finish_run(conn, run_id: int):
     conn.execute("UPDATE crawl_runs SET finished_at=? WHERE id=?", (utcnow_iso(), run_id))
     conn.commit()
 
 
+def register_blob(conn, content_hash: str, path: str, ext: str, size: int, stored_size: int) -> None:
+    conn.execute(
+        "INSERT OR IGNORE INTO blobs(content_hash, path, ext, size, stored_size, created_at) VALUES (?,?,?,?,?,?)",
+        (content_hash, path, ext, size, stored_size, utcnow_iso()),
+    )
+    conn.commit()
+
+
 def get_or_create_source(conn, jurisdiction_id: str, url: str, title: str) -> int:
     conn.execute("INSERT OR IGNORE INTO sources(jurisdiction_id,url,title) VALUES (?,?,?)", (jurisdiction_id, url, title))
     row = conn.execute("SELECT id FROM sources WHERE jurisdiction_id=? AND url=?", (jurisdiction_id, url)).fetchone()
@@ -130,6 +113,26 @@ def latest_hash(conn, document_id: int) -> str | None:
     return row["content_hash"] if row else None
 
 
+def known_validators(conn, jurisdiction_id: str, url: str) -> dict | None:
+    row = conn.execute(
+        """SELECT dv.id, dv.etag, dv.last_modified
+        FROM sources s
+        JOIN documents d ON d.source_id=s.id
+        JOIN document_versions dv ON dv.document_id=d.id
+        WHERE s.jurisdiction_id=? AND s.url=?
+        ORDER BY dv.id DESC LIMIT 1""",
+        (jurisdiction_id, url),
+    ).fetchone()
+    if not row or not (row["etag"] or row["last_modified"]):
+        return None
+    return dict(row)
+
+
+def touch_document_version(conn, version_id: int) -> None:
+    conn.execute("UPDATE document_versions SET last_seen=? WHERE id=?", (utcnow_iso(), version_id))
+    conn.commit()
+
+
 def upsert_document_version(conn, document_id: int, content_hash: str, **kwargs) -> tuple[int, bool]:
     now = utcnow_iso()
     last = conn.execute(
@@ -142,8 +145,9 @@ def upsert_document_version(conn, document_id: int, content_hash: str, **kwargs)
 
     cur = conn.execute(
         """INSERT INTO document_versions(
-            document_id,content_hash,first_seen,last_seen,http_status,content_type,etag,last_modified,blob_path,extracted_text,needs_ocr,llm_json
-        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
+            document_id,content_hash,first_seen,last_seen,http_status,content_type,etag,last_modified,blob_path,extracted_text,needs_ocr,llm_json,
+            run_id,extract_status,extract_ms
+        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
         (
             document_id,
             content_hash,
@@ -157,21 +161,446 @@ def upsert_document_version(conn, document_id: int, content_hash: str, **kwargs)
             kwargs.get("extracted_text"),
             int(bool(kwargs.get("needs_ocr"))),
             kwargs.get("llm_json"),
+            kwargs.get("run_id"),
+            kwargs.get("extract_status"),
+            kwargs.get("extract_ms"),
         ),
     )
     conn.commit()
     return cur.lastrowid, True
 
 
+def load_sitemap_fetches(conn, jurisdiction_id: str) -> dict[str, str]:
+    rows = conn.execute(
+        "SELECT url, last_fetched_at FROM sitemap_urls WHERE jurisdiction_id=? AND last_fetched_at IS NOT NULL",
+        (jurisdiction_id,),
+    ).fetchall()
+    return {r["url"]: r["last_fetched_at"] for r in rows}
+
+
+def save_sitemap_state(conn, jurisdiction_id: str, entries, fetched_urls, fetched_at: str) -> None:
+    fetched = set(fetched_urls)
+    conn.executemany(
+        """INSERT INTO sitemap_urls(jurisdiction_id,url,lastmod,last_fetched_at) VALUES (?,?,?,?)
+        ON CONFLICT(jurisdiction_id,url) DO UPDATE SET
+          lastmod=excluded.lastmod,
+          last_fetched_at=COALESCE(excluded.last_fetched_at, sitemap_urls.last_fetched_at)""",
+        [(jurisdiction_id, e.url, e.lastmod, fetched_at if e.url in fetched else None) for e in entries],
+    )
+    conn.commit()
+
+
 def insert_status(conn, payload: dict):
     conn.execute(
         """INSERT INTO crawl_run_jurisdiction_status(
-            run_id,jurisdiction_id,name,website,status,http_errors_count,timeouts_count,pages_fetched,docs_found,docs_downloaded,error_message,notes
-        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
+            run_id,jurisdiction_id,name,website,status,http_errors_count,timeouts_count,pages_fetched,docs_found,docs_downloaded,
+            docs_not_modified,fetches_saved,error_message,notes
+        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+        ON CONFLICT(run_id, jurisdiction_id) DO UPDATE SET name=excluded.name, website=excluded.website,
+          status=excluded.status, http_errors_count=excluded.http_errors_count, timeouts_count=excluded.timeouts_count,
+          pages_fetched=excluded.pages_fetched, docs_found=excluded.docs_found, docs_downloaded=excluded.docs_downloaded,
+          docs_not_modified=excluded.docs_not_modified, fetches_saved=excluded.fetches_saved,
+          error_message=excluded.error_message, notes=excluded.notes""",
         (
             payload["run_id"], payload["jurisdiction_id"], payload["name"], payload["website"], payload["status"],
             payload["http_errors_count"], payload["timeouts_count"], payload["pages_fetched"], payload["docs_found"],
-            payload["docs_downloaded"], payload.get("error_message"), payload.get("notes"),
+            payload["docs_downloaded"], payload.get("docs_not_modified", 0), payload.get("fetches_saved", 0),
+            payload.get("error_message"), payload.get("notes"),
         ),
     )
     conn.commit()
+
+
+def run_status_rows(conn, run_id: int) -> list[dict]:
+    rows = conn.execute("SELECT * FROM crawl_run_jurisdiction_status WHERE run_id=? ORDER BY id", (run_id,)).fetchall()
+    return [{k: r[k] for k in r.keys() if k != "id"} for r in rows]
+
+
+def completed_jurisdictions(conn, run_id: int) -> set[str]:
+    rows = conn.execute("SELECT jurisdiction_id FROM crawl_run_jurisdiction_status WHERE run_id=?", (run_id,)).fetchall()
+    return {r["jurisdiction_id"] for r in rows}
+
+
+def run_findings(conn, run_id: int) -> list:
+    # A version that only repeats its predecessor's text (near_duplicate_of within the same document) is no news.
+    return conn.execute(
+        """SELECT s.jurisdiction_id, j.name as jurisdiction, j.type, s.url, s.title, d.doc_type, dv.llm_json
+        FROM document_versions dv
+        JOIN documents d ON dv.document_id=d.id
+        JOIN sources s ON d.source_id=s.id
+        LEFT JOIN jurisdictions j ON j.jurisdiction_id=s.jurisdiction_id
+        LEFT JOIN extracted_texts et ON et.content_hash=dv.content_hash
+        WHERE dv.run_id=? AND COALESCE(et.text, dv.extracted_text, '') != ''
+          AND NOT EXISTS (SELECT 1 FROM document_versions p WHERE p.id=dv.near_duplicate_of AND p.document_id=dv.document_id)
+        ORDER BY dv.id""",
+        (run_id,),
+    ).fetchall()
+
+
+def save_checkpoint(conn, run_id: int, jurisdiction_id: str, state: dict) -> None:
+    conn.execute(
+        """INSERT INTO crawl_checkpoints(run_id,jurisdiction_id,state_json,updated_at) VALUES (?,?,?,?)
+        ON CONFLICT(run_id,jurisdiction_id) DO UPDATE SET state_json=excluded.state_json, updated_at=excluded.updated_at""",
+        (run_id, jurisdiction_id, json.dumps(state, ensure_ascii=False), utcnow_iso()),
+    )
+    conn.commit()
+
+
+def load_checkpoint(conn, run_id: int, jurisdiction_id: str) -> dict | None:
+    row = conn.execute(
+        "SELECT state_json FROM crawl_checkpoints WHERE run_id=? AND jurisdiction_id=?", (run_id, jurisdiction_id)
+    ).fetchone()
+    return json.loads(row["state_json"]) if row else None
+
+
+def delete_checkpoint(conn, run_id: int, jurisdiction_id: str) -> None:
+    conn.execute("DELETE FROM crawl_checkpoints WHERE run_id=? AND jurisdiction_id=?", (run_id, jurisdiction_id))
+    conn.commit()
+
+
+def enqueue_work(conn, stage: str, version_id: int) -> None:
+    conn.execute(
+        """INSERT INTO work_queue(stage, version_id, status, attempts, last_error, updated_at) VALUES (?,?,'pending',0,NULL,?)
+        ON CONFLICT(stage, version_id) DO UPDATE SET status='pending', attempts=0, last_error=NULL, updated_at=excluded.updated_at""",
+        (stage, version_id, utcnow_iso()),
+    )
+    conn.commit()
+
+
+def claim_work(conn, stage: str, owner: str, lease_seconds: float, now: float | None = None):
+    # One statement, so two worker processes sharing the database cannot claim the same item.
+    now = time.time() if now is None else now
+    row = conn.execute(
+        """UPDATE work_queue SET status='running', owner=?, lease_expires_at=?, attempts=attempts+1, updated_at=?
+        WHERE id=(SELECT id FROM work_queue WHERE stage=? AND status='pending' ORDER BY id LIMIT 1)
+        RETURNING id, version_id, attempts - 1 AS attempts""",
+        (owner, now + lease_seconds, utcnow_iso(), stage),
+    ).fetchone()
+    conn.commit()
+    return row
+
+
+def renew_work_leases(conn, owner: str, lease_seconds: float, now: float | None = None) -> int:
+    now = time.time() if now is None else now
+    cur = conn.execute(
+        "UPDATE work_queue SET lease_expires_at=? WHERE owner=? AND status='running'", (now + lease_seconds, owner)
+    )
+    conn.commit()
+    return cur.rowcount
+
+
+def finish_work(conn, work_id: int, owner: str) -> None:
+    conn.execute(
+        "UPDATE work_queue SET status='done', last_error=NULL, updated_at=? WHERE id=? AND owner=? AND status='running'",
+        (utcnow_iso(), work_id, owner),
+    )
+    conn.commit()
+
+
+def fail_work(conn, work_id: int, owner: str, error: str, max_attempts: int) -> None:
+    conn.execute(
+        """UPDATE work_queue SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, owner=NULL, last_error=?, updated_at=?
+        WHERE id=? AND owner=? AND status='running'""",
+        (max_attempts, error, utcnow_iso(), work_id, owner),
+    )
+    conn.commit()
+
+
+def requeue_running(conn, stage: str, now: float | None = None) -> int:
+    # Only items whose lease ran out: their process crashed or hung. Live workers elsewhere keep renewing theirs.
+    now = time.time() if now is None else now
+    cur = conn.execute(
+        """UPDATE work_queue SET status='pending', owner=NULL, updated_at=?
+        WHERE stage=? AND status='running' AND COALESCE(lease_expires_at, 0) < ?""",
+        (utcnow_iso(), stage, now),
+    )
+    conn.commit()
+    return cur.rowcount
+
+
+def work_counts(conn, stage: str) -> dict[str, int]:
+    rows = conn.execute("SELECT status, COUNT(*) AS n FROM work_queue WHERE stage=? GROUP BY status", (stage,)).fetchall()
+    return {r["status"]: r["n"] for r in rows}
+
+
+def enqueue_jobs(conn, run_id: int, kind: str, items: list[tuple[str, dict]]) -> None:
+    conn.executemany(
+        "INSERT OR IGNORE INTO jobs(run_id, kind, key, payload_json, status, attempts, updated_at) VALUES (?,?,?,?,'pending',0,?)",
+        [(run_id, kind, key, json.dumps(payload, ensure_ascii=False), utcnow_iso()) for key, payload in items],
+    )
+    conn.commit()
+
+
+def claim_job(conn, run_id: int, kind: str, owner: str, lease_seconds: float, max_attempts: int, now: float | None = None):
+    # Leases that ran out belong to a worker that died or hung; its job goes to the next claimant,
+    # unless it has already taken down max_attempts workers.
+    now = time.time() if now is None else now
+    conn.execute(
+        """UPDATE jobs SET status='failed', last_error='lease utløpt', updated_at=?
+        WHERE run_id=? AND kind=? AND status='leased' AND lease_expires_at < ? AND attempts >= ?""",
+        (utcnow_iso(), run_id, kind, now, max_attempts),
+    )
+    row = conn.execute(
+        """UPDATE jobs SET status='leased', owner=?, lease_expires_at=?, attempts=attempts+1, updated_at=?
+        WHERE id=(
+          SELECT id FROM jobs WHERE run_id=? AND kind=? AND (status='pending' OR (status='leased' AND lease_expires_at < ?))
+          ORDER BY id LIMIT 1
+        )
+        RETURNING id, key, payload_json, attempts""",
+        (owner, now + lease_seconds, utcnow_iso(), run_id, kind, now),
+    ).fetchone()
+    conn.commit()
+    return row
+
+
+def renew_leases(conn, owner: str, lease_seconds: float, now: float | None = None) -> int:
+    now = time.time() if now is None else now
+    cur = conn.execute(
+        "UPDATE jobs SET lease_expires_at=?, updated_at=? WHERE owner=? AND status='leased'", (now + lease_seconds, utcnow_iso(), owner)
+    )
+    conn.commit()
+    return cur.rowcount
+
+
+def finish_job(conn, job_id: int, owner: str) -> bool:
+    cur = conn.execute(
+        "UPDATE jobs SET status='done', last_error=NULL, updated_at=? WHERE id=? AND owner=? AND status='leased'",
+        (utcnow_iso(), job_id, owner),
+    )
+    conn.commit()
+    return cur.rowcount == 1
+
+
+def fail_job(conn, job_id: int, owner: str, error: str, max_attempts: int) -> None:
+    conn.execute(
+        """UPDATE jobs SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, owner=NULL, last_error=?, updated_at=?
+        WHERE id=? AND owner=? AND status='leased'""",
+        (max_attempts, error, utcnow_iso(), job_id, owner),
+    )
+    conn.commit()
+
+
+def job_counts(conn, run_id: int, kind: str) -> dict[str, int]:
+    rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs WHERE run_id=? AND kind=? GROUP BY status", (run_id, kind)).fetchall()
+    return {r["status"]: r["n"] for r in rows}
+
+
+def version_for_stage(conn, version_id: int):
+    return conn.execute(
+        """SELECT dv.id, dv.run_id, dv.content_hash, dv.blob_path, dv.content_type, dv.llm_json,
+          COALESCE(et.text, dv.extracted_text) AS extracted_text, et.simhash, s.url, s.title, d.doc_type, j.name AS jurisdiction
+        FROM document_versions dv
+        JOIN documents d ON dv.document_id=d.id
+        JOIN sources s ON d.source_id=s.id
+        LEFT JOIN jurisdictions j ON j.jurisdiction_id=s.jurisdiction_id
+        LEFT JOIN extracted_texts et ON et.content_hash=dv.content_hash
+        WHERE dv.id=?""",
+        (version_id,),
+    ).fetchone()
+
+
+def load_extracted_text(conn, content_hash: str):
+    return conn.execute(
+        "SELECT text, needs_ocr, extract_status, extract_ms, text_hash, simhash FROM extracted_texts WHERE content_hash=?",
+        (content_hash,),
+    ).fetchone()
+
+
+def save_extracted_text(
+    conn,
+    content_hash: str,
+    text: str,
+    needs_ocr: bool,
+    extract_status: str,
+    extract_ms: int,
+    fingerprint: tuple[str, int] | None = None,
+) -> None:
+    text_hash, value = fingerprint or (None, None)
+    conn.execute(
+        """INSERT INTO extracted_texts(content_hash, text, needs_ocr, extract_status, extract_ms, created_at, text_hash, simhash)
+        VALUES (?,?,?,?,?,?,?,?)
+        ON CONFLICT(content_hash) DO UPDATE SET text=excluded.text, needs_ocr=excluded.needs_ocr,
+          extract_status=excluded.extract_status, extract_ms=excluded.extract_ms, created_at=excluded.created_at,
+          text_hash=excluded.text_hash, simhash=excluded.simhash""",
+        (content_hash, text, int(needs_ocr), extract_status, extract_ms, utcnow_iso(), text_hash, value),
+    )
+    conn.execute("DELETE FROM simhash_bands WHERE content_hash=?", (content_hash,))
+    if value is not None:
+        conn.executemany(
+            "INSERT OR IGNORE INTO simhash_bands(band, value, content_hash) VALUES (?,?,?)",
+            [(band, band_value, content_hash) for band, band_value in simhash_bands(value)],
+        )
+    conn.commit()
+
+
+def previous_version(conn, version_id: int):
+    return conn.execute(
+        """SELECT p.id, p.llm_json, et.text_hash, et.simhash
+        FROM document_versions v
+        JOIN document_versions p ON p.document_id=v.document_id AND p.id < v.id
+        LEFT JOIN extracted_texts et ON et.content_hash=p.content_hash
+        WHERE v.id=?
+        ORDER BY p.id DESC LIMIT 1""",
+        (version_id,),
+    ).fetchone()
+
+
+def find_near_duplicate(conn, value: int, max_distance: int, exclude_version: int | None = None):
+    # Band lookup narrows the candidates to texts sharing one 16-bit band; the exact distance is checked here.
+    bands = simhash_bands(value)
+    rows = conn.execute(
+        f"""SELECT dv.id, et.simhash
+        FROM simhash_bands b
+        JOIN extracted_texts et ON et.content_hash=b.content_hash
+        JOIN document_versions dv ON dv.content_hash=b.content_hash
+        WHERE dv.llm_json IS NOT NULL AND dv.id != ? AND ({" OR ".join(["(b.band=? AND b.value=?)"] * len(bands))})
+        LIMIT 500""",
+        (exclude_version or 0, *[x for band in bands for x in band]),
+    ).fetchall()
+    matches = [(hamming(value, r["simhash"]), r["id"]) for r in rows if hamming(value, r["simhash"]) <= max_distance]
+    return min(matches)[1] if matches else None
+
+
+def reuse_classification(conn, version_id: int, source_version_id: int) -> bool:
+    conn.execute(
+        """UPDATE document_versions SET near_duplicate_of=?,
+          llm_json=COALESCE(llm_json, (SELECT llm_json FROM document_versions WHERE id=?))
+        WHERE id=?""",
+        (source_version_id, source_version_id, version_id),
+    )
+    conn.commit()
+    return conn.execute("SELECT llm_json IS NOT NULL FROM document_versions WHERE id=?", (version_id,)).fetchone()[0] == 1
+
+
+def load_llm_cache(conn, key: str):
+    return conn.execute("SELECT response_json, tokens FROM llm_cache WHERE key=?", (key,)).fetchone()
+
+
+def save_llm_cache(conn, key: str, model: str, response: dict, tokens: int) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO llm_cache(key, model, response_json, tokens, created_at) VALUES (?,?,?,?,?)",
+        (key, model, json.dumps(response, ensure_ascii=False), tokens, utcnow_iso()),
+    )
+    conn.commit()
+
+
+BATCH_OPEN_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+
+
+def unclassified_versions(conn) -> list:
+    # Versions already waiting in an unfinished batch are left out so they are not sent twice.
+    return conn.execute(
+        f"""SELECT dv.id, dv.run_id, COALESCE(et.text, dv.extracted_text) AS extracted_text, s.url, s.title, d.doc_type,
+          j.name AS jurisdiction
+        FROM document_versions dv
+        JOIN documents d ON dv.document_id=d.id
+        JOIN sources s ON d.source_id=s.id
+        LEFT JOIN jurisdictions j ON j.jurisdiction_id=s.jurisdiction_id
+        LEFT JOIN extracted_texts et ON et.content_hash=dv.content_hash
+        WHERE dv.llm_json IS NULL AND COALESCE(et.text, dv.extracted_text, '') != ''
+          AND dv.id NOT IN (
+            SELECT i.version_id FROM llm_batch_items i JOIN llm_batches b ON b.id=i.batch_id
+            WHERE b.status IN ({",".join("?" * len(BATCH_OPEN_STATUSES))})
+          )
+        ORDER BY dv.id""",
+        BATCH_OPEN_STATUSES,
+    ).fetchall()
+
+
+def create_llm_batch(conn, batch_id: str, run_id: int | None, input_path: str, items: list[tuple[int, str, str]]) -> None:
+    conn.execute(
+        "INSERT INTO llm_batches(id, run_id, status, input_path, requests, submitted_at) VALUES (?,?,'validating',?,?,?)",
+        (batch_id, run_id, input_path, len({custom_id for _, custom_id, _ in items}), utcnow_iso()),
+    )
+    conn.executemany(
+        "INSERT INTO llm_batch_items(batch_id, version_id, custom_id, cache_key) VALUES (?,?,?,?)",
+        [(batch_id, version_id, custom_id, key) for version_id, custom_id, key in items],
+    )
+    conn.commit()
+
+
+def open_llm_batches(conn) -> list:
+    return conn.execute(
+        f"SELECT * FROM llm_batches WHERE status IN ({','.join('?' * len(BATCH_OPEN_STATUSES))}) ORDER BY submitted_at",
+        BATCH_OPEN_STATUSES,
+    ).fetchall()
+
+
+def llm_batch_items(conn, batch_id: str) -> list:
+    return conn.execute(
+        """SELECT i.version_id, i.custom_id, i.cache_key, dv.run_id FROM llm_batch_items i
+        JOIN document_versions dv ON dv.id=i.version_id WHERE i.batch_id=?""",
+        (batch_id,),
+    ).fetchall()
+
+
+def update_llm_batch(conn, batch_id: str, status: str, succeeded: int = 0, failed: int = 0, error: str | None = None) -> None:
+    finished = status not in BATCH_OPEN_STATUSES
+    conn.execute(
+        "UPDATE llm_batches SET status=?, succeeded=?, failed=?, error=?, finished_at=? WHERE id=?",
+        (status, succeeded, failed, error, utcnow_iso() if finished else None, batch_id),
+    )
+    conn.commit()
+
+
+def record_cache_stat(conn, run_id: int | None, cache: str, hit: bool, saved: int = 0) -> None:
+    # NULL never conflicts in the primary key, so versions without a run are counted under run 0.
+    conn.execute(
+        """INSERT INTO cache_stats(run_id, cache, hits, misses, saved) VALUES (?,?,?,?,?)
+        ON CONFLICT(run_id, cache) DO UPDATE SET hits=hits+excluded.hits, misses=misses+excluded.misses, saved=saved+excluded.saved""",
+        (run_id or 0, cache, int(hit), int(not hit), saved),
+    )
+    conn.commit()
+
+
+def run_cache_stats(conn, run_id: int) -> list:
+    return conn.execute("SELECT cache, hits, misses, saved FROM cache_stats WHERE run_id=? ORDER BY cache", (run_id,)).fetchall()
+
+
+def fts_query(text: str) -> str:
+    # Plain words are quoted so input like "KS-plattform" is not parsed as FTS5 operators; all terms must match.
+    return " ".join('"' + term.replace('"', '""') + '"' for term in text.split())
+
+
+def search_texts(
+    conn,
+    query: str,
+    jurisdiction: str | None = None,
+    jurisdiction_type: str | None = None,
+    doc_type: str | None = None,
+    run_id: int | None = None,
+    limit: int = 20,
+) -> list:
+    filters, params = [], [query]
+    if jurisdiction:
+        filters.append("(s.jurisdiction_id=? OR j.name=?)")
+        params += [jurisdiction, jurisdiction]
+    if jurisdiction_type:
+        filters.append("j.type=?")
+        params.append(jurisdiction_type)
+    if doc_type:
+        filters.append("d.doc_type=?")
+        params.append(doc_type.upper())
+    if run_id is not None:
+        filters.append("dv.run_id=?")
+        params.append(run_id)
+    where = "".join(f" AND {f}" for f in filters)
+    return conn.execute(
+        f"""WITH hits AS MATERIALIZED (
+          SELECT rowid, bm25(texts_fts) AS rank, snippet(texts_fts, 0, '[', ']', ' … ', 12) AS snippet
+          FROM texts_fts WHERE texts_fts MATCH ?
+        )
+        SELECT s.jurisdiction_id, j.name AS jurisdiction, j.type, s.url, s.title, d.doc_type, MAX(dv.run_id) AS run_id,
+          MIN(h.rank) AS rank, h.snippet
+        FROM hits h
+        JOIN extracted_texts et ON et.rowid=h.rowid
+        JOIN document_versions dv ON dv.content_hash=et.content_hash
+        JOIN documents d ON dv.document_id=d.id
+        JOIN sources s ON d.source_id=s.id
+        LEFT JOIN jurisdictions j ON j.jurisdiction_id=s.jurisdiction_id
+        WHERE 1=1{where}
+        GROUP BY s.id
+        ORDER BY rank
+        LIMIT ?""",
+        (*params, limit),
+    ).fetchall()
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import hashlib
+import re
+from collections import Counter
 
 
 def sha256_bytes(content: bytes) -> str:
@@ -12,3 +14,51 @@ def truncate_for_llm(text: str, max_chars: int) -> str:
         return text
     half = max_chars // 2
     return text[:half] + "\n...\n" + text[-half:]
+
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+SHINGLE_WORDS = 3
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    # Case, punctuation and whitespace differences are not content changes.
+    return " ".join(_WORD_RE.findall(text.casefold()))
+
+
+def simhash(normalized: str) -> int:
+    words = normalized.split()
+    shingles = {" ".join(words[i : i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    digests = [hashlib.blake2b(s.encode(), digest_size=SIMHASH_BITS // 8).digest() for s in shingles]
+    # Count byte values per position first; only the 256 distinct values per byte are then split into bits.
+    value = 0
+    for pos in range(SIMHASH_BITS // 8):
+        counts = Counter(d[pos] for d in digests)
+        for bit in range(8):
+            ones = sum(n for byte, n in counts.items() if byte >> (7 - bit) & 1)
+            value = value << 1 | (2 * ones > len(digests))
+    return value
+
+
+def text_fingerprint(text: str) -> tuple[str, int] | None:
+    normalized = normalize_text(text)
+    if not normalized:
+        return None
+    return sha256_bytes(normalized.encode()), to_signed64(simhash(normalized))
+
+
+def to_signed64(value: int) -> int:
+    # SQLite integers are signed 64-bit.
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hamming(a: int, b: int) -> int:
+    return ((a ^ b) & ((1 << 64) - 1)).bit_count()
+
+
+def simhash_bands(value: int) -> list[tuple[int, int]]:
+    # Two hashes within SIMHASH_BANDS - 1 bits of each other share at least one band exactly.
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    unsigned = value & ((1 << 64) - 1)
+    return [(band, unsigned >> (band * width) & ((1 << width) - 1)) for band in range(SIMHASH_BANDS)]
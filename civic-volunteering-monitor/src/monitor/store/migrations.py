@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import sqlite3
+from datetime import datetime, timezone
+from typing import Callable
+
+from monitor.store.dedupe import simhash_bands, text_fingerprint
+
+# Ordered, append-only. Each step must be idempotent: databases created before schema_version existed
+# replay every step and only pick up what they are missing.
+
+
+def _add_column(conn, table: str, column: str, decl: str) -> None:
+    cols = {r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+    if column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _script(sql: str) -> Callable:
+    def step(conn) -> None:
+        for statement in sql.split(";"):
+            if statement.strip():
+                conn.execute(statement)
+
+    return step
+
+
+BASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jurisdictions (
+    id INTEGER PRIMARY KEY,
+    jurisdiction_id TEXT UNIQUE,
+    name TEXT,
+    type TEXT,
+    website TEXT
+);
+CREATE TABLE IF NOT EXISTS crawl_runs (
+    id INTEGER PRIMARY KEY,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS crawl_run_jurisdiction_status (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER,
+    jurisdiction_id TEXT,
+    name TEXT,
+    website TEXT,
+    status TEXT,
+    http_errors_count INTEGER,
+    timeouts_count INTEGER,
+    pages_fetched INTEGER,
+    docs_found INTEGER,
+    docs_downloaded INTEGER,
+    error_message TEXT,
+    notes TEXT
+);
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    jurisdiction_id TEXT,
+    url TEXT,
+    title TEXT,
+    UNIQUE(jurisdiction_id, url)
+);
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    source_id INTEGER,
+    doc_type TEXT
+);
+CREATE TABLE IF NOT EXISTS document_versions (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER,
+    content_hash TEXT,
+    first_seen TEXT,
+    last_seen TEXT,
+    http_status INTEGER,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    blob_path TEXT,
+    extracted_text TEXT,
+    needs_ocr INTEGER DEFAULT 0,
+    llm_json TEXT
+)
+"""
+
+
+def _tracking_columns(conn) -> None:
+    _add_column(conn, "crawl_run_jurisdiction_status", "docs_not_modified", "INTEGER DEFAULT 0")
+    _add_column(conn, "crawl_run_jurisdiction_status", "fetches_saved", "INTEGER DEFAULT 0")
+    _add_column(conn, "document_versions", "run_id", "INTEGER")
+    _add_column(conn, "document_versions", "extract_status", "TEXT")
+    _add_column(conn, "document_versions", "extract_ms", "INTEGER")
+
+
+PIPELINE_TABLES = """
+CREATE TABLE IF NOT EXISTS crawl_checkpoints (
+    run_id INTEGER,
+    jurisdiction_id TEXT,
+    state_json TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (run_id, jurisdiction_id)
+);
+CREATE TABLE IF NOT EXISTS sitemap_urls (
+    jurisdiction_id TEXT,
+    url TEXT,
+    lastmod TEXT,
+    last_fetched_at TEXT,
+    PRIMARY KEY (jurisdiction_id, url)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    content_hash TEXT PRIMARY KEY,
+    path TEXT,
+    ext TEXT,
+    size INTEGER,
+    stored_size INTEGER,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS extracted_texts (
+    content_hash TEXT PRIMARY KEY,
+    text TEXT,
+    needs_ocr INTEGER DEFAULT 0,
+    extract_status TEXT,
+    extract_ms INTEGER,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS cache_stats (
+    run_id INTEGER,
+    cache TEXT,
+    hits INTEGER DEFAULT 0,
+    misses INTEGER DEFAULT 0,
+    saved INTEGER DEFAULT 0,
+    PRIMARY KEY (run_id, cache)
+);
+CREATE TABLE IF NOT EXISTS work_queue (
+    id INTEGER PRIMARY KEY,
+    stage TEXT,
+    version_id INTEGER,
+    status TEXT,
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    updated_at TEXT,
+    UNIQUE(stage, version_id)
+)
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_versions_document ON document_versions(document_id, id);
+CREATE INDEX IF NOT EXISTS idx_versions_run ON document_versions(run_id);
+CREATE INDEX IF NOT EXISTS idx_versions_hash ON document_versions(content_hash);
+CREATE INDEX IF NOT EXISTS idx_versions_unclassified ON document_versions(id) WHERE llm_json IS NULL;
+CREATE INDEX IF NOT EXISTS idx_documents_source ON documents(source_id);
+CREATE INDEX IF NOT EXISTS idx_status_run ON crawl_run_jurisdiction_status(run_id, jurisdiction_id);
+CREATE INDEX IF NOT EXISTS idx_work_queue_claim ON work_queue(stage, status, id)
+"""
+
+# Statements are listed separately because the trigger bodies contain semicolons.
+FULL_TEXT_SEARCH = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS texts_fts USING fts5(
+        text, content='extracted_texts', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS extracted_texts_ai AFTER INSERT ON extracted_texts BEGIN
+        INSERT INTO texts_fts(rowid, text) VALUES (new.rowid, new.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS extracted_texts_ad AFTER DELETE ON extracted_texts BEGIN
+        INSERT INTO texts_fts(texts_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS extracted_texts_au AFTER UPDATE OF text ON extracted_texts BEGIN
+        INSERT INTO texts_fts(texts_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+        INSERT INTO texts_fts(rowid, text) VALUES (new.rowid, new.text);
+    END""",
+)
+
+
+def _full_text_search(conn) -> None:
+    # Text still held in the hot versions table moves to extracted_texts, then the index is built from there.
+    conn.execute(
+        """INSERT OR IGNORE INTO extracted_texts(content_hash, text, needs_ocr, extract_status, extract_ms, created_at)
+        SELECT content_hash, extracted_text, needs_ocr, COALESCE(extract_status, 'ok'), extract_ms, first_seen
+        FROM document_versions WHERE COALESCE(extracted_text, '') != '' GROUP BY content_hash"""
+    )
+    conn.execute("UPDATE document_versions SET extracted_text=NULL WHERE extracted_text IS NOT NULL")
+    for statement in FULL_TEXT_SEARCH:
+        conn.execute(statement)
+    conn.execute("INSERT INTO texts_fts(texts_fts) VALUES ('rebuild')")
+
+
+JOBS = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER,
+    kind TEXT,
+    key TEXT,
+    payload_json TEXT,
+    status TEXT,
+    owner TEXT,
+    lease_expires_at REAL,
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    updated_at TEXT,
+    UNIQUE(run_id, kind, key)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(run_id, kind, status, id)
+"""
+
+
+LLM_CACHE = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    model TEXT,
+    response_json TEXT,
+    tokens INTEGER,
+    created_at TEXT
+)
+"""
+
+
+LLM_BATCHES = """
+CREATE TABLE IF NOT EXISTS llm_batches (
+    id TEXT PRIMARY KEY,
+    run_id INTEGER,
+    status TEXT,
+    input_path TEXT,
+    requests INTEGER,
+    succeeded INTEGER DEFAULT 0,
+    failed INTEGER DEFAULT 0,
+    error TEXT,
+    submitted_at TEXT,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS llm_batch_items (
+    batch_id TEXT,
+    version_id INTEGER,
+    custom_id TEXT,
+    cache_key TEXT,
+    PRIMARY KEY (batch_id, version_id)
+);
+CREATE INDEX IF NOT EXISTS idx_batch_items_custom ON llm_batch_items(batch_id, custom_id)
+"""
+
+
+def _near_duplicates(conn) -> None:
+    _add_column(conn, "extracted_texts", "text_hash", "TEXT")
+    _add_column(conn, "extracted_texts", "simhash", "INTEGER")
+    _add_column(conn, "document_versions", "near_duplicate_of", "INTEGER")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS simhash_bands (
+            band INTEGER,
+            value INTEGER,
+            content_hash TEXT,
+            PRIMARY KEY (band, value, content_hash)
+        ) WITHOUT ROWID"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_texts_text_hash ON extracted_texts(text_hash)")
+    # Texts extracted before fingerprinting existed are fingerprinted once here.
+    rows = conn.execute("SELECT content_hash, text FROM extracted_texts WHERE text_hash IS NULL AND COALESCE(text, '') != ''").fetchall()
+    for content_hash, text in rows:
+        fingerprint = text_fingerprint(text)
+        if fingerprint is None:
+            continue
+        conn.execute("UPDATE extracted_texts SET text_hash=?, simhash=? WHERE content_hash=?", (*fingerprint, content_hash))
+        conn.executemany(
+            "INSERT OR IGNORE INTO simhash_bands(band, value, content_hash) VALUES (?,?,?)",
+            [(band, value, content_hash) for band, value in simhash_bands(fingerprint[1])],
+        )
+
+
+def _work_leases(conn) -> None:
+    # Queue items carry a lease like jobs do, so a restart only takes back work whose process stopped renewing it.
+    _add_column(conn, "work_queue", "owner", "TEXT")
+    _add_column(conn, "work_queue", "lease_expires_at", "REAL")
+
+
+UNIQUE_RUN_STATUS = """
+DELETE FROM crawl_run_jurisdiction_status WHERE id NOT IN (
+    SELECT MAX(id) FROM crawl_run_jurisdiction_status GROUP BY run_id, jurisdiction_id
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_status_run_jurisdiction ON crawl_run_jurisdiction_status(run_id, jurisdiction_id)
+"""
+
+
+MIGRATIONS: list[tuple[int, str, Callable]] = [
+    (1, "base_schema", _script(BASE_SCHEMA)),
+    (2, "tracking_columns", _tracking_columns),
+    (3, "pipeline_tables", _script(PIPELINE_TABLES)),
+    (4, "lookup_indexes", _script(INDEXES)),
+    (5, "full_text_search", _full_text_search),
+    (6, "near_duplicates", _near_duplicates),
+    (7, "jobs", _script(JOBS)),
+    (8, "llm_cache", _script(LLM_CACHE)),
+    (9, "llm_batches", _script(LLM_BATCHES)),
+    (10, "work_leases", _work_leases),
+    # A job processed twice (lease lost mid-run) must not count its jurisdiction twice; the latest row wins.
+    (11, "unique_run_status", _script(UNIQUE_RUN_STATUS)),
+]
+
+
+def current_version(conn) -> int:
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT)"
+    )
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> list[int]:
+    applied = []
+    done = current_version(conn)
+    conn.commit()
+    for version, name, step in MIGRATIONS:
+        if version <= done:
+            continue
+        # One transaction per step, so an interrupted upgrade resumes at the step that failed.
+        conn.execute("BEGIN")
+        try:
+            step(conn)
+            conn.execute(
+                "INSERT INTO schema_version(version, name, applied_at) VALUES (?,?,?)",
+                (version, name, datetime.now(timezone.utc).isoformat()),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass
+class CachedPage:
+    url: str
+    etag: str | None
+    last_modified: str | None
+    body_hash: str
+    links: list[tuple[str, str]]
+    notes: list[str]
+
+
+class PageCache:
+    # Hub pages keyed by canonical URL: validators, body hash and the extracted links, so an unchanged page
+    # costs a 304 (or a hash compare) instead of a parse. Lives in its own SQLite file, shared by crawl threads.
+    def __init__(self, path: str, max_age_days: float = 30, max_mb: float = 200, clock=time.time):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_age_seconds = max_age_days * 86400
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT,
+                links_json TEXT,
+                notes_json TEXT,
+                size INTEGER,
+                stored_at REAL,
+                last_used REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pages_last_used ON pages(last_used);
+            """
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url: str) -> CachedPage | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, body_hash, links_json, notes_json FROM pages WHERE url=?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        links = [tuple(link) for link in json.loads(row[3])]
+        return CachedPage(url, row[0], row[1], row[2], links, json.loads(row[4] or "[]"))
+
+    def put(
+        self, url: str, etag: str | None, last_modified: str | None, body_hash: str, links: list[tuple[str, str]], notes: list[str] | None = None
+    ) -> None:
+        links_json = json.dumps(links, ensure_ascii=False)
+        notes_json = json.dumps(notes or [])
+        now = self._clock()
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO pages(url, etag, last_modified, body_hash, links_json, notes_json, size, stored_at, last_used)
+                VALUES (?,?,?,?,?,?,?,?,?)
+                ON CONFLICT(url) DO UPDATE SET etag=excluded.etag, last_modified=excluded.last_modified,
+                  body_hash=excluded.body_hash, links_json=excluded.links_json, notes_json=excluded.notes_json,
+                  size=excluded.size, stored_at=excluded.stored_at, last_used=excluded.last_used""",
+                (url, etag, last_modified, body_hash, links_json, notes_json, len(url) + len(links_json) + len(notes_json), now, now),
+            )
+            self._conn.commit()
+
+    def record(self, url: str, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self._conn.execute("UPDATE pages SET last_used=? WHERE url=?", (self._clock(), url))
+                self._conn.commit()
+            else:
+                self.misses += 1
+
+    def evict(self) -> int:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM pages WHERE last_used < ?", (self._clock() - self.max_age_seconds,))
+            removed = cur.rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+            if total > self.max_bytes:
+                drop: list[str] = []
+                for url, size in self._conn.execute("SELECT url, size FROM pages ORDER BY last_used"):
+                    if total <= self.max_bytes:
+                        break
+                    drop.append(url)
+                    total -= size
+                self._conn.executemany("DELETE FROM pages WHERE url=?", [(u,) for u in drop])
+                removed += len(drop)
+            self._conn.commit()
+        return removed
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache: PageCache | None = None
+
+
+def configure_page_cache(path: str, max_age_days: float, max_mb: float) -> PageCache | None:
+    global _cache
+    close_page_cache()
+    _cache = PageCache(path, max_age_days, max_mb) if path else None
+    return _cache
+
+
+def get_page_cache() -> PageCache | None:
+    return _cache
+
+
+def close_page_cache() -> None:
+    global _cache
+    cache, _cache = _cache, None
+    if cache is not None:
+        cache.evict()
+        cache.close()
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 500
+
+_STOP = object()
+
+
+class DbWriter:
+    # Single owner of the SQLite connection. Crawl and stage workers send store calls here; the writer runs
+    # whatever has queued up in one transaction (one savepoint per call, so a failing call does not undo the
+    # others) and commits once per batch instead of once per row.
+    def __init__(self, conn, max_batch: int = MAX_BATCH):
+        self.conn = conn
+        self.max_batch = max_batch
+        self.batches = 0
+        self.calls = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> "DbWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _enqueue(self, fn: Callable[..., Any], args, kwargs, waited: bool) -> Future:
+        fut: Future = Future()
+        self._queue.put((fn, args, kwargs, fut, waited))
+        return fut
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        # Write-behind: returns at once; errors are logged by the writer since nobody waits for them.
+        return self._enqueue(fn, args, kwargs, waited=False)
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        return self._enqueue(fn, args, kwargs, waited=True).result()
+
+    def flush(self) -> None:
+        self.call(lambda conn: None)
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop = True
+                    break
+                batch.append(nxt)
+            self._execute(batch)
+            if stop:
+                return
+
+    def _execute(self, batch: list) -> None:
+        conn = self.conn
+        outcomes = []
+        try:
+            conn.batching = True
+            if not conn.in_transaction:
+                # IMMEDIATE takes the write lock up front: with several worker processes on one database, a batch
+                # that reads before it writes would otherwise fail with "database is locked" instead of waiting.
+                conn.execute("BEGIN IMMEDIATE")
+            for fn, args, kwargs, fut, waited in batch:
+                conn.execute("SAVEPOINT store_call")
+                try:
+                    outcomes.append((fut, waited, fn(conn, *args, **kwargs), None))
+                    conn.execute("RELEASE store_call")
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO store_call")
+                    conn.execute("RELEASE store_call")
+                    outcomes.append((fut, waited, None, exc))
+            conn.commit_batch()
+        except Exception as exc:
+            logger.error("databasebatch feilet: %s", exc)
+            if conn.in_transaction:
+                conn.rollback()
+            outcomes = [(fut, waited, None, exc) for _, _, _, fut, waited in batch]
+        finally:
+            conn.batching = False
+        self.batches += 1
+        self.calls += len(batch)
+        # Futures resolve after the commit, so a caller that waited sees its write on disk.
+        for fut, waited, result, exc in outcomes:
+            if exc is None:
+                fut.set_result(result)
+                continue
+            if not waited:
+                logger.warning("skriving til databasen feilet: %s", exc)
+            fut.set_exception(exc)
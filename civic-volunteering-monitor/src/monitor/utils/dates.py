@@ -1,3 +1,19 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
 from monitor.store.db import utcnow_iso
 
-__all__ = ["utcnow_iso"]
+__all__ = ["parse_iso_datetime", "utcnow_iso"]
+
+
+def parse_iso_datetime(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
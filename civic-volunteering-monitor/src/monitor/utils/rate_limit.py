@@ -1,3 +1,3 @@
-from monitor.crawl.fetch import DomainRateLimiter
+from monitor.crawl.fetch import SHARED_LIMITER, DomainRateLimiter
 
-__all__ = ["DomainRateLimiter"]
+__all__ = ["DomainRateLimiter", "SHARED_LIMITER"]
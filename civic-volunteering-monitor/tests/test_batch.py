@@ -0,0 +1,115 @@
+import json
+
+from monitor.classify.batch import BatchStatus, get_batch_transport, poll_batches, submit_batch
+from monitor.classify.llm_client import chat_request
+from monitor.config import Settings
+from monitor.store.db import (
+    connect,
+    get_or_create_document,
+    get_or_create_source,
+    init_db,
+    run_cache_stats,
+    save_extracted_text,
+    upsert_document_version,
+)
+from monitor.store.writer import DbWriter
+
+
+class LocalBatchTransport:
+    # Stands in for the Batch API: answers every request in the uploaded file, after one "in_progress" poll.
+    def __init__(self, settings, fail_ids=()):
+        self.fail_ids = set(fail_ids)
+        self.batches = {}
+        self.polls = 0
+
+    def submit(self, path):
+        batch_id = f"batch_{len(self.batches) + 1}"
+        self.batches[batch_id] = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+        return batch_id
+
+    def poll(self, batch_id):
+        self.polls += 1
+        if self.polls == 1:
+            return BatchStatus("in_progress")
+        lines = []
+        for req in self.batches[batch_id]:
+            if req["custom_id"] in self.fail_ids:
+                lines.append({"custom_id": req["custom_id"], "response": {"status_code": 500, "body": {}}, "error": None})
+                continue
+            answer = {"category": "frivilligsentral", "summary": req["body"]["messages"][1]["content"][-40:]}
+            body = {
+                "choices": [{"message": {"role": "assistant", "content": json.dumps(answer)}}],
+                "usage": {"total_tokens": 120},
+            }
+            lines.append({"custom_id": req["custom_id"], "response": {"status_code": 200, "body": body}, "error": None})
+        return BatchStatus("completed", "\n".join(json.dumps(line) for line in lines))
+
+
+def _version(conn, i, text):
+    document_id = get_or_create_document(conn, get_or_create_source(conn, f"j{i}", f"https://k{i}.no/plan", "Plan"), "HTML")
+    version_id, _ = upsert_document_version(conn, document_id, f"h{i}", run_id=1)
+    save_extracted_text(conn, f"h{i}", text, False, "ok", 1)
+    return version_id
+
+
+def test_batch_submit_poll_and_ingest(tmp_path):
+    settings = Settings(db_url=f"sqlite:///{tmp_path}/monitor.db", openai_api_key="test", llm_batch_transport="test_batch:LocalBatchTransport")
+    conn = connect(settings.db_url)
+    init_db(conn)
+    shared = _version(conn, 1, "Frivilligsentralen får nye lokaler.")
+    same_text = _version(conn, 2, "Frivilligsentralen får nye lokaler.")
+    failing = _version(conn, 3, "Tilskudd til lag og foreninger.")
+    transport = get_batch_transport(settings)
+    transport.fail_ids = {f"version-{failing}"}
+
+    with DbWriter(conn) as writer:
+        batch_id, requests, cached = submit_batch(settings, writer, transport, str(tmp_path / "batches"), run_id=1)
+        # Identical texts share one request; the file holds the same request a live call would send.
+        assert (requests, cached) == (2, 0)
+        first = transport.batches[batch_id][0]
+        assert first["custom_id"] == f"version-{shared}"
+        assert first["url"] == "/v1/chat/completions"
+        assert first["body"] == chat_request(settings, first["body"]["messages"][1]["content"])
+        # Versions waiting in an open batch are not submitted again.
+        assert submit_batch(settings, writer, transport, str(tmp_path / "batches"))[0] is None
+
+        assert poll_batches(settings, writer, transport) == [(batch_id, "in_progress", 0, 0)]
+        assert poll_batches(settings, writer, transport) == [(batch_id, "completed", 2, 1)]
+        assert poll_batches(settings, writer, transport) == []
+
+    rows = dict(conn.execute("SELECT id, llm_json FROM document_versions").fetchall())
+    assert json.loads(rows[shared])["category"] == "frivilligsentral"
+    assert rows[same_text] == rows[shared]
+    assert rows[failing] is None
+    assert tuple(conn.execute("SELECT status, requests, succeeded, failed FROM llm_batches").fetchone()) == ("completed", 2, 2, 1)
+    assert [tuple(r) for r in run_cache_stats(conn, 1)] == [("llm", 0, 2, 0)]
+
+    # The failed version goes in the next batch; a copy of already answered text is filled from the cache instead.
+    _version(conn, 4, "Frivilligsentralen får nye lokaler.")
+    with DbWriter(conn) as writer:
+        batch_id, requests, cached = submit_batch(settings, writer, transport, str(tmp_path / "batches"))
+    assert (requests, cached) == (1, 1)
+    assert [r["custom_id"] for r in transport.batches[batch_id]] == [f"version-{failing}"]
+
+
+class TruncatedBatchTransport(LocalBatchTransport):
+    # The result file ends in a cut-off line, as when a download is interrupted.
+    def poll(self, batch_id):
+        self.polls = 1
+        status = super().poll(batch_id)
+        return BatchStatus(status.status, status.output + '\n{"custom_id": "version-', status.error)
+
+
+def test_malformed_result_line_does_not_block_ingest(tmp_path):
+    settings = Settings(db_url=f"sqlite:///{tmp_path}/monitor.db", openai_api_key="test", llm_batch_transport="test_batch:TruncatedBatchTransport")
+    conn = connect(settings.db_url)
+    init_db(conn)
+    version_id = _version(conn, 1, "Frivilligsentralen får nye lokaler.")
+    transport = get_batch_transport(settings)
+
+    with DbWriter(conn) as writer:
+        batch_id, _, _ = submit_batch(settings, writer, transport, str(tmp_path / "batches"))
+        assert poll_batches(settings, writer, transport) == [(batch_id, "completed", 1, 1)]
+        assert poll_batches(settings, writer, transport) == []
+
+    assert conn.execute("SELECT llm_json FROM document_versions WHERE id=?", (version_id,)).fetchone()[0] is not None
@@ -0,0 +1,28 @@
+import hashlib
+
+from monitor.store.blob_store import blob_ext, read_blob, store_blob
+
+
+def test_blobs_are_content_addressed_sharded_and_written_once(tmp_path):
+    data = b"%PDF-1.4 Frivillighetserklaeringen"
+    digest = hashlib.sha256(data).hexdigest()
+    spooled = tmp_path / "spool.tmp"
+    spooled.write_bytes(data)
+
+    path, written = store_blob(str(tmp_path / "blob"), digest, "pdf", spooled)
+    assert written
+    assert path == str(tmp_path / "blob" / digest[:2] / digest[2:4] / f"{digest}.pdf")
+    assert not spooled.exists()
+
+    again, written = store_blob(str(tmp_path / "blob"), digest, "pdf", data)
+    assert (again, written) == (path, False)
+    assert read_blob(path) == data
+
+
+def test_text_blobs_are_compressed_transparently(tmp_path):
+    html = ("<p>frivillighet i kommunen</p>" * 500).encode()
+    path, _ = store_blob(str(tmp_path), hashlib.sha256(html).hexdigest(), "html", html)
+    assert path.endswith(".html.gz")
+    assert blob_ext(path) == "html"
+    assert (tmp_path / path).stat().st_size < len(html) / 10
+    assert read_blob(path) == html
@@ -1,4 +1,4 @@
-from monitor.store.dedupe import sha256_bytes, truncate_for_llm
+from monitor.store.dedupe import hamming, sha256_bytes, simhash_bands, text_fingerprint, truncate_for_llm
 
 
 def test_sha256_stable():
@@ -9,3 +9,20 @@ def test_truncate_for_llm():
     txt = "x" * 200
     out = truncate_for_llm(txt, 50)
     assert len(out) <= 60
+
+
+def test_text_fingerprint_ignores_formatting_and_tolerates_small_edits():
+    text = " ".join(f"Punkt {i}: frivilligsentralen samarbeider med lag og foreninger." for i in range(300))
+    same = text_fingerprint(text.upper().replace(" ", "\n  "))
+    assert same == text_fingerprint(text)
+    edited = text_fingerprint(text + " Sist oppdatert 12.03.2024.")
+    other = text_fingerprint("Kommunestyret vedtok budsjett for vei, vann og avløp. " * 20)
+    assert edited[0] != same[0]
+    assert hamming(same[1], edited[1]) <= 3 < hamming(same[1], other[1])
+    assert text_fingerprint(" .. ") is None
+
+
+def test_close_simhashes_share_a_band():
+    a = -0x123456789ABCDEF
+    b = a ^ 0b1011 << 20
+    assert set(simhash_bands(a)) & set(simhash_bands(b))
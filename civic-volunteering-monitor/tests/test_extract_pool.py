@@ -0,0 +1,36 @@
+from io import BytesIO
+
+from pypdf import PdfWriter
+
+from monitor.parse.extract_pool import EXTRACT_FAILED, EXTRACT_TIMEOUT, EXTRACT_TRUNCATED, ExtractPool
+
+
+def _blank_pdf(pages: int) -> bytes:
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    buf = BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+
+def test_page_cap_and_broken_files_are_reported_not_raised(tmp_path):
+    pool = ExtractPool(workers=2, timeout=30, max_pages=2)
+    path = tmp_path / "plan.pdf"
+    path.write_bytes(_blank_pdf(5))
+
+    result = pool.extract("pdf", path)
+    assert result.status == EXTRACT_TRUNCATED
+    assert result.pages == 5
+    assert result.needs_ocr
+
+    broken = pool.extract("pdf", b"%PDF-1.4 dette er ikke en pdf")
+    assert broken.status == EXTRACT_FAILED
+    assert broken.error
+
+
+def test_extraction_is_killed_on_timeout():
+    pool = ExtractPool(workers=1, timeout=0.001)
+    result = pool.extract("pdf", _blank_pdf(50))
+    assert result.status == EXTRACT_TIMEOUT
+    assert result.text == ""
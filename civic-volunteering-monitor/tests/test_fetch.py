@@ -0,0 +1,178 @@
+import gzip
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from monitor.crawl import fetch
+from monitor.crawl.fetch import FETCH_STATS, DomainRateLimiter, ResponseTooLargeError, _parse_retry_after, fetch_with_retries
+
+PAGE = ("<html><body>" + "<p>frivillighet i kommunen</p>" * 500 + "</body></html>").encode("utf-8")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = PAGE
+        encoding = None
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(PAGE)
+            encoding = "gzip"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    t = threading.Thread(target=srv.serve_forever, daemon=True)
+    t.start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_keep_alive_and_compression(server):
+    FETCH_STATS.reset()
+    limiter = DomainRateLimiter(max_per_second=1000)
+    for path in ["/a", "/b", "/c"]:
+        res = fetch_with_retries(f"{server}{path}", "test", 5, limiter=limiter)
+        assert res.status_code == 200
+        assert res.content == PAGE
+        assert "frivillighet" in res.text
+
+    [row] = FETCH_STATS.rows()
+    assert row["requests"] == 3
+    assert row["handshakes"] == 1
+    assert row["bytes_decoded"] == 3 * len(PAGE)
+    assert row["bytes_wire"] < row["bytes_decoded"]
+
+
+def test_response_size_is_bounded(server, monkeypatch):
+    monkeypatch.setattr(fetch, "MAX_RESPONSE_BYTES", 1000)
+    with pytest.raises(ResponseTooLargeError):
+        fetch_with_retries(f"{server}/big", "test", 5, limiter=DomainRateLimiter(max_per_second=1000))
+
+
+class PdfHandler(Handler):
+    def do_GET(self):
+        body = b"%PDF-1.4 " + b"x" * 5000
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_documents_are_spooled_and_hashed(tmp_path, monkeypatch):
+    monkeypatch.setattr(fetch, "SPOOL_DIR", str(tmp_path))
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), PdfHandler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{srv.server_address[1]}/plan.pdf"
+        res = fetch_with_retries(url, "test", 5, limiter=DomainRateLimiter(max_per_second=1000))
+        body = b"%PDF-1.4 " + b"x" * 5000
+        assert res.content == b""
+        assert res.size == len(body)
+        assert res.content_hash == hashlib.sha256(body).hexdigest()
+        assert open(res.path, "rb").read() == body
+        res.discard()
+        assert list(tmp_path.iterdir()) == []
+
+        monkeypatch.setitem(fetch.DOCUMENT_LIMITS, "pdf", 100)
+        with pytest.raises(ResponseTooLargeError):
+            fetch_with_retries(url, "test", 5, limiter=DomainRateLimiter(max_per_second=1000))
+        assert list(tmp_path.iterdir()) == []
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_spaces_requests_and_allows_burst():
+    clock = FakeClock()
+    limiter = DomainRateLimiter(max_per_second=2.0, burst=2, clock=clock)
+    assert limiter.reserve("a.no") == 0
+    assert limiter.reserve("a.no") == 0
+    assert limiter.reserve("a.no") == pytest.approx(0.5)
+    assert limiter.reserve("b.no") == 0
+    clock.now += 10
+    assert limiter.reserve("a.no") == 0
+
+
+def test_rate_limiter_backs_off_on_429_and_recovers():
+    clock = FakeClock()
+    limiter = DomainRateLimiter(max_per_second=2.0, burst=1, clock=clock)
+    limiter.reserve("a.no")
+    limiter.on_response("a.no", 429, retry_after="7")
+    assert limiter.rate("a.no") == pytest.approx(1.0)
+    assert limiter.reserve("a.no") == pytest.approx(7.0)
+
+    clock.now += 60
+    for _ in range(20):
+        limiter.on_response("a.no", 200)
+    assert limiter.rate("a.no") == pytest.approx(2.0)
+
+
+def test_retry_after_accepts_http_date():
+    when = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < _parse_retry_after(when) <= 30
+    assert _parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert _parse_retry_after("Wed, 21 Oct 2015 07:28:00 -0000") == 0.0
+    assert 25 < _parse_retry_after(when.replace("GMT", "-0000")) <= 30
+    assert _parse_retry_after("snart") is None
+    assert _parse_retry_after(None) is None
+
+    limiter = DomainRateLimiter(max_per_second=2.0, burst=1, clock=FakeClock())
+    limiter.reserve("a.no")
+    limiter.on_response("a.no", 503, retry_after=when)
+    assert limiter.reserve("a.no") > 25
+
+
+class TruncatingHandler(Handler):
+    calls = 0
+
+    def do_GET(self):
+        type(self).calls += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(PAGE)))
+        self.end_headers()
+        if type(self).calls == 1:
+            # Connection reset mid-body: urllib3 raises ProtocolError while streaming.
+            self.wfile.write(PAGE[:100])
+            self.close_connection = True
+            return
+        self.wfile.write(PAGE)
+
+
+def test_broken_stream_is_retried():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), TruncatingHandler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{srv.server_address[1]}/side"
+        res = fetch_with_retries(url, "test", 5, limiter=DomainRateLimiter(max_per_second=1000))
+        assert res.content == PAGE
+        assert TruncatingHandler.calls == 2
+    finally:
+        srv.shutdown()
+        srv.server_close()
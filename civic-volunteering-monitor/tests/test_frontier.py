@@ -0,0 +1,39 @@
+from monitor.crawl.frontier import CrawlFrontier
+
+
+def test_frontier_skips_seen_and_too_deep_urls():
+    frontier = CrawlFrontier(max_depth=2)
+    frontier.push("https://example.no/a", 0)
+    frontier.push("https://example.no/a", 1)
+    frontier.push("https://example.no/deep", 3)
+    assert frontier.pop() == ("https://example.no/a", 0)
+    assert frontier.pop() is None
+
+
+def test_frontier_snapshot_roundtrip():
+    frontier = CrawlFrontier()
+    for path in ["a", "b", "c"]:
+        frontier.push(f"https://example.no/{path}", 0)
+    frontier.pop()
+
+    restored = CrawlFrontier.from_snapshot(frontier.snapshot())
+    restored.push("https://example.no/a", 1)
+    assert [restored.pop(), restored.pop(), restored.pop()] == [
+        ("https://example.no/b", 0),
+        ("https://example.no/c", 0),
+        None,
+    ]
+
+
+def test_frontier_pops_highest_score_first_and_keeps_scores_in_snapshot():
+    frontier = CrawlFrontier(max_depth=4)
+    frontier.push("https://example.no/nyheter", 0, 0.5)
+    frontier.push("https://example.no/frivillighet", 3, 7.5)
+    frontier.push("https://example.no/tilskudd", 1, 3.0)
+
+    restored = CrawlFrontier.from_snapshot(frontier.snapshot())
+    assert [restored.pop(), restored.pop(), restored.pop()] == [
+        ("https://example.no/frivillighet", 3),
+        ("https://example.no/tilskudd", 1),
+        ("https://example.no/nyheter", 0),
+    ]
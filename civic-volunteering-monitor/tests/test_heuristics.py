@@ -0,0 +1,35 @@
+from monitor.crawl.dispatcher import CrawlBudget, crawl_jurisdiction
+from monitor.crawl.fetch import SimpleResponse
+from monitor.crawl.heuristics import is_high_relevance, relevance_score
+
+
+def test_short_keywords_only_match_whole_tokens():
+    assert not is_high_relevance("https://example.no/kontaktskjema")
+    assert is_high_relevance("Avtale med KS om frivillighet")
+    assert relevance_score("https://example.no/ks-avtale") > 0
+
+
+def test_relevance_score_weights_path_keywords_and_penalises_low_value_pages():
+    assert relevance_score("https://example.no/frivilligsentral") > relevance_score("https://example.no/planlegging")
+    assert relevance_score("https://example.no/tilskudd", "Tilskudd til frivillighet") > relevance_score("https://example.no/tilskudd")
+    assert relevance_score("https://example.no/arkiv/kalender") < 0
+
+
+def test_crawl_stops_when_page_budget_is_used(monkeypatch):
+    fetched = []
+
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        fetched.append(url)
+        if url.endswith(("robots.txt", "sitemap.xml")):
+            return SimpleResponse(404, "", b"", {})
+        return SimpleResponse(200, '<a href="/frivillighet/mer">Frivillighet</a>', b"", {"Content-Type": "text/html"})
+
+    monkeypatch.setattr("monitor.crawl.dispatcher.fetch_with_retries", fake_fetch)
+    monkeypatch.setattr("monitor.crawl.sitemap.fetch_with_retries", fake_fetch)
+
+    result = crawl_jurisdiction("https://example.no", 3, "x", budget=CrawlBudget(max_pages=3))
+    pages = [u for u in fetched if not u.endswith(("robots.txt", "sitemap.xml"))]
+    # The relevant link found on the first page outranks the remaining generic seed paths.
+    assert pages[:2] == ["https://example.no/frivillighet", "https://example.no/frivillighet/mer"]
+    assert len(pages) == 3
+    assert "crawl_budget_exhausted" in result.notes
@@ -0,0 +1,49 @@
+from monitor.crawl.html_extract import extract_links, parse_page
+from monitor.parse.content_clean import extract_main_text_from_html
+
+PAGE = """<html><head><script>var x = 1;</script><style>p {}</style></head>
+<body>
+  <nav><a href="/politikk">Politikk</a></nav>
+  <main><h1>Frivillighet</h1><p>Kommunen samarbeider med <a href="docs/plan.pdf">frivillige lag</a>.</p></main>
+  <a href="#top">Til toppen</a>
+  <footer>Kontakt oss</footer>
+</body></html>"""
+
+
+def test_parse_page_matches_extract_links():
+    page = parse_page("https://example.no/frivillighet/", PAGE)
+    assert page.links == extract_links("https://example.no/frivillighet/", PAGE)
+    assert page.links == [
+        ("https://example.no/politikk", "Politikk"),
+        ("https://example.no/frivillighet/docs/plan.pdf", "frivillige lag"),
+    ]
+
+
+def test_parse_page_main_text_drops_boilerplate():
+    page = parse_page("https://example.no", PAGE)
+    assert page.main_text == "Frivillighet Kommunen samarbeider med frivillige lag . Til toppen"
+    assert "Kontakt" not in extract_main_text_from_html(PAGE)
+    assert not page.js_driven
+
+
+def test_parse_page_detects_js_driven_shell():
+    html = "<html><body><div id='app'></div>" + "<script src='x.js'></script>" * 6 + "</body></html>"
+    assert parse_page("https://example.no", html).js_driven
+    assert parse_page("https://example.no", "").links == []
+
+
+def test_main_text_keeps_webforms_body_and_article_header():
+    webforms = """<html><body><form id="aspnetForm" method="post">
+      <nav>Meny</nav><div id="content"><h1>Frivilligmelding</h1><p>Vedtatt i kommunestyret.</p></div>
+    </form></body></html>"""
+    assert extract_main_text_from_html(webforms) == "Frivilligmelding Vedtatt i kommunestyret."
+
+    article = """<html><body><header>Logo</header>
+      <article><header><h1>Tilskudd til lag</h1></header><p>Søknadsfrist 1. mars.</p></article>
+    </body></html>"""
+    assert extract_main_text_from_html(article) == "Tilskudd til lag Søknadsfrist 1. mars."
+
+
+def test_main_text_falls_back_to_visible_text():
+    html = "<html><body><nav><a href='/'>Hjem</a> Frivilligsentralen</nav></body></html>"
+    assert extract_main_text_from_html(html) == "Hjem Frivilligsentralen"
@@ -1,16 +1,19 @@
+import pytest
+
 from monitor.crawl.dispatcher import crawl_jurisdiction
 
 
 class DummyResp:
-    def __init__(self, status_code=200, text="", content=b"", headers=None):
+    def __init__(self, status_code=200, text="", content=b"", headers=None, url=""):
         self.status_code = status_code
+        self.url = url
         self.text = text
         self.content = content or text.encode("utf-8")
         self.headers = headers or {"Content-Type": "text/html"}
 
 
 def test_crawl_with_mocked_requests(monkeypatch):
-    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3):
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
         if url.endswith("robots.txt"):
             return DummyResp(text="Sitemap: https://example.no/sitemap.xml")
         if url.endswith("sitemap.xml"):
@@ -25,3 +28,113 @@ def test_crawl_with_mocked_requests(monkeypatch):
     monkeypatch.setattr("monitor.crawl.sitemap.fetch_with_retries", fake_fetch)
     result = crawl_jurisdiction("https://example.no", timeout=3, user_agent="x")
     assert result.docs_found
+
+
+def test_crawl_deduplicates_url_variants(monkeypatch):
+    fetched = []
+
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        fetched.append(url)
+        if url == "https://www.example.no/frivillighet":
+            return DummyResp(
+                text='<a href="/frivillighet/#innhold">Til innhold</a>'
+                '<a href="http://example.no/frivillighet/?utm_source=nyhetsbrev">Frivillighet</a>'
+                '<a href="/docs/plan.pdf">Plan</a><a href="https://example.no/docs/plan.pdf#page=2">Plan</a>'
+            )
+        return DummyResp(status_code=404)
+
+    monkeypatch.setattr("monitor.crawl.dispatcher.fetch_with_retries", fake_fetch)
+    monkeypatch.setattr("monitor.crawl.sitemap.fetch_with_retries", fake_fetch)
+    result = crawl_jurisdiction("https://www.example.no", timeout=3, user_agent="x")
+    assert fetched.count("https://www.example.no/frivillighet") == 1
+    assert [d["url"] for d in result.docs_found] == ["https://www.example.no/docs/plan.pdf"]
+
+
+def test_sitemap_documents_skip_the_page_frontier(monkeypatch):
+    fetched = []
+
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        fetched.append(url)
+        if url.endswith("robots.txt"):
+            return DummyResp(text="Sitemap: https://example.no/sitemap.xml")
+        if url.endswith("sitemap.xml"):
+            return DummyResp(
+                content=b"<urlset><url><loc>https://example.no/frivillighet</loc></url>"
+                b"<url><loc>https://example.no/docs/frivillighet-plan.pdf</loc></url></urlset>"
+            )
+        if url == "https://example.no/frivillighet":
+            return DummyResp(text='<a href="/docs/frivillighet-plan.pdf">Plan</a>')
+        return DummyResp(status_code=404)
+
+    monkeypatch.setattr("monitor.crawl.dispatcher.fetch_with_retries", fake_fetch)
+    monkeypatch.setattr("monitor.crawl.sitemap.fetch_with_retries", fake_fetch)
+    result = crawl_jurisdiction("https://example.no", timeout=3, user_agent="x")
+    assert [d["url"] for d in result.docs_found] == ["https://example.no/docs/frivillighet-plan.pdf"]
+    assert "https://example.no/docs/frivillighet-plan.pdf" not in fetched
+
+
+class SpooledResp(DummyResp):
+    def __init__(self):
+        super().__init__(headers={"Content-Type": "application/pdf"}, content=b"%PDF-1.4")
+        self.discarded = False
+
+    def discard(self):
+        self.discarded = True
+
+
+def test_spooled_documents_are_discarded_when_crawl_fails(monkeypatch):
+    spooled = SpooledResp()
+    pages = []
+
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        if url.endswith(("robots.txt", "sitemap.xml", "sitemap_index.xml")):
+            return DummyResp(status_code=404)
+        pages.append(url)
+        if len(pages) > 1:
+            raise KeyboardInterrupt
+        return spooled
+
+    monkeypatch.setattr("monitor.crawl.dispatcher.fetch_with_retries", fake_fetch)
+    monkeypatch.setattr("monitor.crawl.sitemap.fetch_with_retries", fake_fetch)
+    with pytest.raises(KeyboardInterrupt):
+        crawl_jurisdiction("https://example.no", timeout=3, user_agent="x")
+    assert spooled.discarded
+
+
+def test_relative_links_resolve_against_the_directory_url(monkeypatch):
+    fetched = []
+
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        fetched.append(url)
+        if url.endswith("robots.txt"):
+            return DummyResp(text="Sitemap: https://kommune.no/sitemap.xml")
+        if url.endswith("sitemap.xml"):
+            return DummyResp(content=b"<urlset><url><loc>https://kommune.no/politikk/frivillighet/</loc></url></urlset>")
+        if url == "https://kommune.no/politikk/frivillighet/":
+            return DummyResp(text='<a href="handlingsplan">Handlingsplan for frivillighet</a><a href="../strategi.pdf">Strategi</a>')
+        return DummyResp(status_code=404)
+
+    monkeypatch.setattr("monitor.crawl.dispatcher.fetch_with_retries", fake_fetch)
+    monkeypatch.setattr("monitor.crawl.sitemap.fetch_with_retries", fake_fetch)
+    result = crawl_jurisdiction("https://kommune.no", timeout=3, user_agent="x")
+    assert "https://kommune.no/politikk/frivillighet/handlingsplan" in fetched
+    assert [(d["url"], d["fetch_url"]) for d in result.docs_found] == [
+        ("https://kommune.no/politikk/strategi.pdf", "https://kommune.no/politikk/strategi.pdf")
+    ]
+    # The canonical spelling stays the key for dedupe and sources.url.
+    assert "https://kommune.no/politikk/frivillighet" in result.fetched_urls
+
+
+def test_links_resolve_against_the_final_url_after_redirect(monkeypatch):
+    fetched = []
+
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        fetched.append(url)
+        if url == "https://kommune.no/frivillighet":
+            return DummyResp(text='<a href="tilskudd">Tilskudd til frivillighet</a>', url="https://kommune.no/tjenester/frivillighet/")
+        return DummyResp(status_code=404)
+
+    monkeypatch.setattr("monitor.crawl.dispatcher.fetch_with_retries", fake_fetch)
+    monkeypatch.setattr("monitor.crawl.sitemap.fetch_with_retries", fake_fetch)
+    crawl_jurisdiction("https://kommune.no", timeout=3, user_agent="x")
+    assert "https://kommune.no/tjenester/frivillighet/tilskudd" in fetched
@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+from monitor.classify import llm_client
+from monitor.classify.llm_client import LLMThrottle, close_llm_clients, complete_json
+from monitor.config import Settings
+from monitor.stages import STAGE_CLASSIFY, run_stage
+from monitor.store.db import (
+    connect,
+    enqueue_work,
+    get_or_create_document,
+    get_or_create_source,
+    init_db,
+    save_extracted_text,
+    upsert_document_version,
+)
+from monitor.store.writer import DbWriter
+
+
+class FakeOpenAI(ThreadingHTTPServer):
+    # Minimal OpenAI-compatible /chat/completions: fixed latency, the first `throttled` requests get a 429 and the
+    # `failing` after them the given error status.
+    def __init__(self, latency=0.05, throttled=0, failing=0, error_status=502):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latency = latency
+        self.throttled = throttled
+        self.failing = failing
+        self.error_status = error_status
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests += 1
+            throttled = server.requests <= server.throttled
+            failing = not throttled and server.requests <= server.throttled + server.failing
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(server.latency)
+        with server.lock:
+            server.in_flight -= 1
+        if throttled:
+            body, status, headers = {"error": {"message": "rate limited", "type": "requests"}}, 429, {"Retry-After": "0.05"}
+        elif failing:
+            body, status, headers = {"error": {"message": "upstream error", "type": "server_error"}}, server.error_status, {}
+        else:
+            content = json.dumps({"category": "frivillighetspolitikk"})
+            body = {
+                "id": "chatcmpl-1",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "fake",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 10, "total_tokens": 110},
+            }
+            status, headers = 200, {}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def fake_openai():
+    servers = []
+
+    def start(**kwargs):
+        server = FakeOpenAI(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    close_llm_clients()
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _versions(conn, n):
+    ids = []
+    for i in range(n):
+        document_id = get_or_create_document(conn, get_or_create_source(conn, "j1", f"https://k.no/{i}", f"Dok {i}"), "HTML")
+        version_id, _ = upsert_document_version(conn, document_id, f"h{i}", run_id=1)
+        save_extracted_text(conn, f"h{i}", f"Sak {i} om frivillighet", False, "ok", 1)
+        enqueue_work(conn, STAGE_CLASSIFY, version_id)
+        ids.append(version_id)
+    return ids
+
+
+def test_classify_stage_runs_concurrently_on_one_client_and_retries_429(tmp_path, fake_openai):
+    server = fake_openai(latency=0.1, throttled=2)
+    settings = Settings(
+        db_url=f"sqlite:///{tmp_path}/monitor.db",
+        openai_api_key="test",
+        openai_base_url=server.base_url,
+        near_duplicate_max_distance=-1,
+    )
+    conn = connect(settings.db_url)
+    init_db(conn)
+    _versions(conn, 16)
+
+    with DbWriter(conn) as writer:
+        assert run_stage(settings, writer, STAGE_CLASSIFY, workers=8) == 16
+
+    # 16 answers plus the two 429s that were retried, several of them in flight at once and never more than the pool.
+    assert server.requests == 18
+    assert 1 < server.max_in_flight <= 8
+    assert len(llm_client._clients) == 1
+    rows = conn.execute("SELECT llm_json FROM document_versions").fetchall()
+    assert {r[0] for r in rows} == {'{"category": "frivillighetspolitikk"}'}
+
+
+def test_throttle_spaces_requests_and_tokens():
+    now = [0.0]
+    throttle = LLMThrottle(rpm=60, tpm=6000, clock=lambda: now[0])
+    assert throttle.reserve(1000) == 0
+    assert throttle.reserve(5000) == 0
+    # Token budget is spent: 1000 more tokens take 10 s at 100 tokens/s.
+    assert throttle.reserve(1000) == pytest.approx(10.0)
+    now[0] = 30.0
+    throttle.settle(estimated=1000, actual=100)
+    assert throttle.reserve(100) == 0
+    throttle.block(5)
+    assert throttle.reserve(1) == pytest.approx(5.0)
+
+
+def test_throttle_settles_only_what_was_reserved():
+    throttle = LLMThrottle(rpm=60, tpm=1000, clock=lambda: 0.0)
+    # An estimate above the per-minute budget reserves the whole budget, and only that comes back.
+    assert throttle.reserve(5000) == 0
+    throttle.settle(estimated=5000, actual=100)
+    assert throttle.reserve(900) == 0
+    assert throttle.reserve(60) == pytest.approx(3.6)
+
+
+def test_server_errors_are_retried_but_client_errors_are_not(tmp_path, fake_openai):
+    server = fake_openai(failing=1)
+    settings = Settings(db_url=f"sqlite:///{tmp_path}/monitor.db", openai_api_key="test", openai_base_url=server.base_url)
+    assert complete_json(settings, "Sak om frivillighet") == ({"category": "frivillighetspolitikk"}, 110)
+    assert server.requests == 2
+    close_llm_clients()
+
+    server = fake_openai(failing=1, error_status=400)
+    settings = Settings(db_url=f"sqlite:///{tmp_path}/monitor.db", openai_api_key="test", openai_base_url=server.base_url)
+    with pytest.raises(openai.BadRequestError):
+        complete_json(settings, "Sak om frivillighet")
+    assert server.requests == 1
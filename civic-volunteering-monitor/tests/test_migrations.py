@@ -0,0 +1,49 @@
+import sqlite3
+
+from monitor.store.db import connect, init_db
+from monitor.store.migrations import MIGRATIONS
+
+
+def _plan(conn, sql, params=()):
+    return " ".join(r[-1] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall())
+
+
+def test_fresh_database_gets_all_migrations_and_indexed_lookups(tmp_path):
+    conn = connect(f"sqlite:///{tmp_path}/monitor.db")
+    init_db(conn)
+    init_db(conn)
+
+    versions = [r[0] for r in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+    assert versions == [v for v, _, _ in MIGRATIONS]
+    assert "idx_versions_document" in _plan(
+        conn, "SELECT id, content_hash FROM document_versions WHERE document_id=? ORDER BY id DESC LIMIT 1", (1,)
+    )
+    assert "idx_documents_source" in _plan(conn, "SELECT id FROM documents WHERE source_id=?", (1,))
+    assert "idx_versions_unclassified" in _plan(conn, "SELECT id FROM document_versions WHERE llm_json IS NULL")
+
+
+def test_existing_database_is_upgraded_in_place(tmp_path):
+    path = tmp_path / "monitor.db"
+    legacy = sqlite3.connect(path)
+    legacy.executescript(
+        """
+        CREATE TABLE crawl_run_jurisdiction_status (id INTEGER PRIMARY KEY, run_id INTEGER, jurisdiction_id TEXT, name TEXT,
+            website TEXT, status TEXT, http_errors_count INTEGER, timeouts_count INTEGER, pages_fetched INTEGER,
+            docs_found INTEGER, docs_downloaded INTEGER, error_message TEXT, notes TEXT);
+        CREATE TABLE document_versions (id INTEGER PRIMARY KEY, document_id INTEGER, content_hash TEXT, first_seen TEXT,
+            last_seen TEXT, http_status INTEGER, content_type TEXT, etag TEXT, last_modified TEXT, blob_path TEXT,
+            extracted_text TEXT, needs_ocr INTEGER DEFAULT 0, llm_json TEXT);
+        INSERT INTO document_versions(document_id, content_hash, extracted_text) VALUES (1, 'abc', 'Plan for frivilligsentralen');
+        """
+    )
+    legacy.close()
+
+    conn = connect(f"sqlite:///{path}")
+    init_db(conn)
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(document_versions)")}
+    assert {"run_id", "extract_status", "extract_ms"} <= cols
+    assert tuple(conn.execute("SELECT content_hash, extracted_text FROM document_versions").fetchone()) == ("abc", None)
+    assert conn.execute("SELECT text FROM extracted_texts WHERE content_hash='abc'").fetchone()[0] == "Plan for frivilligsentralen"
+    assert conn.execute("SELECT COUNT(*) FROM texts_fts WHERE texts_fts MATCH 'frivilligsentralen'").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM simhash_bands WHERE content_hash='abc'").fetchone()[0] == 4
+    assert conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] == MIGRATIONS[-1][0]
@@ -0,0 +1,55 @@
+from monitor.crawl.dispatcher import crawl_jurisdiction
+from monitor.crawl.fetch import SimpleResponse
+from monitor.crawl.html_extract import parse_page
+from monitor.store.page_cache import PageCache
+
+HUB = '<a href="/frivillighet/plan.pdf">Plan for frivillighet</a>'
+
+
+def test_unchanged_pages_are_revalidated_and_links_reused(tmp_path, monkeypatch):
+    cache = PageCache(str(tmp_path / "pages.sqlite"))
+    requests = []
+
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        if url.endswith(("robots.txt", "sitemap.xml")):
+            return SimpleResponse(404, "", b"", {})
+        requests.append((url, headers))
+        if url.endswith("/frivillighet"):
+            if headers and headers.get("If-None-Match") == '"v1"':
+                return SimpleResponse(304, "", b"", {})
+            return SimpleResponse(200, HUB, HUB.encode(), {"Content-Type": "text/html", "ETag": '"v1"'})
+        return SimpleResponse(404, "", b"", {})
+
+    monkeypatch.setattr("monitor.crawl.dispatcher.fetch_with_retries", fake_fetch)
+    monkeypatch.setattr("monitor.crawl.sitemap.fetch_with_retries", fake_fetch)
+    parsed = []
+
+    def counting_parse(url, html):
+        parsed.append(url)
+        return parse_page(url, html)
+
+    monkeypatch.setattr("monitor.crawl.dispatcher.parse_page", counting_parse)
+
+    first = crawl_jurisdiction("https://example.no", 3, "x", page_cache=cache)
+    second = crawl_jurisdiction("https://example.no", 3, "x", page_cache=cache)
+
+    assert [d["url"] for d in first.docs_found] == [d["url"] for d in second.docs_found] == ["https://example.no/frivillighet/plan.pdf"]
+    assert parsed.count("https://example.no/frivillighet") == 1
+    assert second.pages_from_cache == 1
+    assert ("https://example.no/frivillighet", {"If-None-Match": '"v1"'}) in requests
+
+
+def test_cache_evicts_by_age_then_size(tmp_path):
+    now = [1000.0]
+    cache = PageCache(str(tmp_path / "pages.sqlite"), max_age_days=1, max_mb=1, clock=lambda: now[0])
+    cache.put("https://example.no/gammel", None, None, "h", [])
+    now[0] += 2 * 86400
+    big = [(f"https://example.no/{i}", "x" * 1000) for i in range(600)]
+    cache.put("https://example.no/a", None, None, "h", big)
+    now[0] += 1
+    cache.put("https://example.no/b", None, None, "h", big)
+
+    assert cache.evict() == 2
+    assert cache.get("https://example.no/gammel") is None
+    assert cache.get("https://example.no/a") is None
+    assert cache.get("https://example.no/b").links[0] == big[0]
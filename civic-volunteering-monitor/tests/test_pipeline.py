@@ -0,0 +1,244 @@
+import random
+import threading
+import time
+
+import pytest
+
+from monitor.config import Settings
+from monitor.crawl.dispatcher import CrawlResult
+from monitor.crawl.fetch import SimpleResponse
+from monitor.ingest.excel_loader import JurisdictionRow
+from monitor.pipeline import JOB_JURISDICTION, enqueue_jurisdiction_jobs, run_jurisdictions, run_worker
+from monitor.store.db import claim_job, connect, create_run, finish_job, init_db, insert_status, job_counts, run_status_rows
+from monitor.store.writer import DbWriter
+
+
+class DummyResp(SimpleResponse):
+    def __init__(self, status_code=200, text="", content=b"", headers=None):
+        super().__init__(status_code, text, content or text.encode("utf-8"), headers or {"Content-Type": "text/html"})
+
+
+def test_run_jurisdictions_is_ordered_and_consistent(monkeypatch, tmp_path):
+    def fake_crawl(base_url, timeout, user_agent, playwright_enabled=False, **kwargs):
+        time.sleep(random.random() / 50)
+        docs = [{"url": f"{base_url}/doc{i}.html", "title": f"Dok {i}"} for i in range(3)]
+        return CrawlResult(pages_fetched=1, docs_found=docs, http_errors=0, timeouts=0, notes=[])
+
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        time.sleep(random.random() / 100)
+        return DummyResp(text=f"<p>{url}</p>")
+
+    monkeypatch.setattr("monitor.pipeline.crawl_jurisdiction", fake_crawl)
+    monkeypatch.setattr("monitor.pipeline.fetch_with_retries", fake_fetch)
+
+    settings = Settings(db_url=f"sqlite:///{tmp_path}/monitor.db", blob_dir=str(tmp_path / "blob"))
+    conn = connect(settings.db_url)
+    init_db(conn)
+    run_id = create_run(conn)
+    rows = [JurisdictionRow(f"j{i}", f"Kommune {i}", "kommune", f"https://k{i}.example.no") for i in range(12)]
+
+    outcomes = run_jurisdictions(settings, conn, run_id, rows, max_concurrency=6)
+
+    assert [o.coverage_row["jurisdiction_id"] for o in outcomes] == [r.jurisdiction_id for r in rows]
+    assert all(o.coverage_row["docs_downloaded"] == 3 for o in outcomes)
+    assert conn.execute("SELECT COUNT(*) FROM document_versions").fetchone()[0] == 36
+    assert conn.execute("SELECT COUNT(*) FROM crawl_run_jurisdiction_status WHERE run_id=?", (run_id,)).fetchone()[0] == 12
+
+
+def test_known_documents_are_revalidated(monkeypatch, tmp_path):
+    def fake_crawl(base_url, timeout, user_agent, playwright_enabled=False, **kwargs):
+        docs = [{"url": f"{base_url}/plan.html", "title": "Plan"}]
+        return CrawlResult(pages_fetched=1, docs_found=docs, http_errors=0, timeouts=0, notes=[])
+
+    requests_seen = []
+
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        requests_seen.append(headers)
+        if headers and headers.get("If-None-Match") == '"v1"':
+            return DummyResp(status_code=304, content=b"-")
+        return DummyResp(text="<p>plan</p>", headers={"Content-Type": "text/html", "ETag": '"v1"'})
+
+    monkeypatch.setattr("monitor.pipeline.crawl_jurisdiction", fake_crawl)
+    monkeypatch.setattr("monitor.pipeline.fetch_with_retries", fake_fetch)
+
+    settings = Settings(db_url=f"sqlite:///{tmp_path}/monitor.db", blob_dir=str(tmp_path / "blob"))
+    conn = connect(settings.db_url)
+    init_db(conn)
+    rows = [JurisdictionRow("j1", "Kommune", "kommune", "https://k.example.no")]
+
+    [first] = run_jurisdictions(settings, conn, create_run(conn), rows, max_concurrency=1)
+    [second] = run_jurisdictions(settings, conn, create_run(conn), rows, max_concurrency=1)
+
+    assert requests_seen == [None, {"If-None-Match": '"v1"'}]
+    assert first.coverage_row["docs_downloaded"] == 1
+    assert second.coverage_row["docs_downloaded"] == 0
+    assert second.coverage_row["docs_not_modified"] == 1
+    assert conn.execute("SELECT COUNT(*) FROM document_versions").fetchone()[0] == 1
+
+
+def test_documents_fetched_by_crawler_are_not_fetched_again(monkeypatch, tmp_path):
+    crawled = DummyResp(text="<p>vedtak</p>")
+
+    def fake_crawl(base_url, timeout, user_agent, playwright_enabled=False, **kwargs):
+        docs = [{"url": f"{base_url}/vedtak", "title": "", "response": crawled}]
+        return CrawlResult(pages_fetched=1, docs_found=docs, http_errors=0, timeouts=0, notes=[])
+
+    def fake_fetch(*args, **kwargs):
+        raise AssertionError("document fetched twice")
+
+    monkeypatch.setattr("monitor.pipeline.crawl_jurisdiction", fake_crawl)
+    monkeypatch.setattr("monitor.pipeline.fetch_with_retries", fake_fetch)
+
+    settings = Settings(db_url=f"sqlite:///{tmp_path}/monitor.db", blob_dir=str(tmp_path / "blob"))
+    conn = connect(settings.db_url)
+    init_db(conn)
+    rows = [JurisdictionRow("j1", "Kommune", "kommune", "https://k.example.no")]
+
+    [outcome] = run_jurisdictions(settings, conn, create_run(conn), rows, max_concurrency=1)
+
+    assert outcome.coverage_row["docs_downloaded"] == 1
+    assert outcome.coverage_row["fetches_saved"] == 1
+
+
+def test_interrupted_jurisdiction_resumes_from_checkpoint(monkeypatch, tmp_path):
+    resumed_with = []
+
+    def crashing_crawl(base_url, timeout, user_agent, playwright_enabled=False, checkpoint=None, **kwargs):
+        checkpoint({"result": CrawlResult(1, [], 0, 0, []).to_state(), "frontier": {"queue": [["https://k.example.no/a", 1, 0.5]], "seen": []}})
+        raise KeyboardInterrupt
+
+    def resumed_crawl(base_url, timeout, user_agent, playwright_enabled=False, resume_state=None, **kwargs):
+        resumed_with.append(resume_state)
+        return CrawlResult(2, [], 0, 0, [])
+
+    settings = Settings(db_url=f"sqlite:///{tmp_path}/monitor.db", blob_dir=str(tmp_path / "blob"))
+    conn = connect(settings.db_url)
+    init_db(conn)
+    run_id = create_run(conn)
+    rows = [JurisdictionRow("j1", "Kommune", "kommune", "https://k.example.no")]
+
+    monkeypatch.setattr("monitor.pipeline.crawl_jurisdiction", crashing_crawl)
+    with pytest.raises(KeyboardInterrupt):
+        run_jurisdictions(settings, conn, run_id, rows, max_concurrency=1)
+    assert conn.execute("SELECT COUNT(*) FROM crawl_checkpoints").fetchone()[0] == 1
+
+    monkeypatch.setattr("monitor.pipeline.crawl_jurisdiction", resumed_crawl)
+    [outcome] = run_jurisdictions(settings, conn, run_id, rows, max_concurrency=1, resume=True)
+
+    assert resumed_with[0]["frontier"]["queue"] == [["https://k.example.no/a", 1, 0.5]]
+    assert outcome.coverage_row["pages_fetched"] == 2
+    assert conn.execute("SELECT COUNT(*) FROM crawl_checkpoints").fetchone()[0] == 0
+
+
+def _job_settings(monkeypatch, tmp_path):
+    def fake_crawl(base_url, timeout, user_agent, playwright_enabled=False, **kwargs):
+        time.sleep(0.05)
+        return CrawlResult(pages_fetched=1, docs_found=[{"url": f"{base_url}/plan.html", "title": "Plan"}], http_errors=0, timeouts=0, notes=[])
+
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        return DummyResp(text=f"<p>{url}</p>")
+
+    monkeypatch.setattr("monitor.pipeline.crawl_jurisdiction", fake_crawl)
+    monkeypatch.setattr("monitor.pipeline.fetch_with_retries", fake_fetch)
+    settings = Settings(db_url=f"sqlite:///{tmp_path}/monitor.db", blob_dir=str(tmp_path / "blob"))
+    conn = connect(settings.db_url)
+    init_db(conn)
+    return settings, conn
+
+
+def test_workers_on_separate_connections_drain_one_run(monkeypatch, tmp_path):
+    settings, conn = _job_settings(monkeypatch, tmp_path)
+    run_id = create_run(conn)
+    rows = [JurisdictionRow(f"j{i}", f"Kommune {i}", "kommune", f"https://k{i}.example.no") for i in range(12)]
+    with DbWriter(conn) as writer:
+        enqueue_jurisdiction_jobs(writer, run_id, rows)
+
+    processed = {}
+
+    def worker(owner):
+        # Each worker stands in for a separate process: its own connection and writer on the same file.
+        with DbWriter(connect(settings.db_url)) as writer:
+            processed[owner] = run_worker(settings, writer, run_id, owner, max_concurrency=2, lease_seconds=30, poll_interval=0.01)
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sum(processed.values()) == 12
+    assert all(n > 0 for n in processed.values())
+    assert job_counts(conn, run_id, JOB_JURISDICTION) == {"done": 12}
+    ids = [r[0] for r in conn.execute("SELECT jurisdiction_id FROM crawl_run_jurisdiction_status WHERE run_id=?", (run_id,))]
+    assert sorted(ids) == sorted(r.jurisdiction_id for r in rows)
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(monkeypatch, tmp_path):
+    settings, conn = _job_settings(monkeypatch, tmp_path)
+    run_id = create_run(conn)
+    rows = [JurisdictionRow("j1", "Kommune", "kommune", "https://k.example.no")]
+    with DbWriter(conn) as writer:
+        enqueue_jurisdiction_jobs(writer, run_id, rows)
+        # A worker that claimed the job a minute ago and never renewed its 10 s lease.
+        dead = writer.call(claim_job, run_id, JOB_JURISDICTION, "dead", 10, 3, time.time() - 60)
+        assert writer.call(claim_job, run_id, JOB_JURISDICTION, "other", 10, 3, time.time() - 59) is None
+
+        assert run_worker(settings, writer, run_id, "live", max_concurrency=1, lease_seconds=10, poll_interval=0.01) == 1
+        assert not writer.call(finish_job, dead["id"], "dead")
+
+    job = conn.execute("SELECT status, owner, attempts FROM jobs").fetchone()
+    assert tuple(job) == ("done", "live", 2)
+
+
+def test_jobs_run_in_parallel_across_workers(monkeypatch, tmp_path):
+    settings, conn = _job_settings(monkeypatch, tmp_path)
+    workers = 4
+    # Every crawl waits until all four are in flight at once, which only happens if each worker holds a job.
+    barrier = threading.Barrier(workers, timeout=10)
+
+    def fake_crawl(base_url, timeout, user_agent, playwright_enabled=False, **kwargs):
+        barrier.wait()
+        return CrawlResult(pages_fetched=1, docs_found=[], http_errors=0, timeouts=0, notes=[])
+
+    monkeypatch.setattr("monitor.pipeline.crawl_jurisdiction", fake_crawl)
+    run_id = create_run(conn)
+    rows = [JurisdictionRow(f"j{i}", f"Kommune {i}", "kommune", f"https://k{i}.example.no") for i in range(workers)]
+    with DbWriter(conn) as writer:
+        enqueue_jurisdiction_jobs(writer, run_id, rows)
+
+    def worker(owner):
+        with DbWriter(connect(settings.db_url)) as writer:
+            run_worker(settings, writer, run_id, owner, max_concurrency=1, lease_seconds=30, poll_interval=0.01)
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not barrier.broken
+    assert job_counts(conn, run_id, JOB_JURISDICTION) == {"done": workers}
+    assert {r["status"] for r in run_status_rows(conn, run_id)} == {"OK"}
+
+
+def test_job_processed_twice_keeps_one_status_row(tmp_path):
+    conn = connect(f"sqlite:///{tmp_path}/monitor.db")
+    init_db(conn)
+    row = {
+        "run_id": 1, "jurisdiction_id": "j1", "name": "Kommune", "website": "https://k.example.no", "status": "OK",
+        "http_errors_count": 0, "timeouts_count": 0, "pages_fetched": 1, "docs_found": 1, "docs_downloaded": 1,
+    }
+    insert_status(conn, row)
+    insert_status(conn, {**row, "pages_fetched": 3})
+    assert [(r["jurisdiction_id"], r["pages_fetched"]) for r in run_status_rows(conn, 1)] == [("j1", 3)]
+
+
+def test_job_whose_lease_was_lost_is_not_counted(monkeypatch, tmp_path):
+    settings, conn = _job_settings(monkeypatch, tmp_path)
+    run_id = create_run(conn)
+    with DbWriter(conn) as writer:
+        enqueue_jurisdiction_jobs(writer, run_id, [JurisdictionRow("j1", "Kommune", "kommune", "https://k.example.no")])
+        # Another worker took the job over while this one was still crawling.
+        monkeypatch.setattr("monitor.pipeline.finish_job", lambda conn, job_id, owner: False)
+        monkeypatch.setattr("monitor.pipeline.job_counts", lambda conn, run_id, kind: {})
+        assert run_worker(settings, writer, run_id, "slow", max_concurrency=1, lease_seconds=10, poll_interval=0.01) == 0
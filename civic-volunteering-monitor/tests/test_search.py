@@ -0,0 +1,53 @@
+import pytest
+
+from monitor.cli import build_parser
+from monitor.ingest.excel_loader import JurisdictionRow
+from monitor.store.db import (
+    connect,
+    fts_query,
+    get_or_create_document,
+    get_or_create_source,
+    init_db,
+    save_extracted_text,
+    search_texts,
+    upsert_document_version,
+    upsert_jurisdiction,
+)
+
+
+def _add(conn, jid, name, jtype, url, doc_type, content_hash, text, run_id=1):
+    upsert_jurisdiction(conn, JurisdictionRow(jid, name, jtype, f"https://{jid}.no"))
+    document_id = get_or_create_document(conn, get_or_create_source(conn, jid, url, ""), doc_type)
+    upsert_document_version(conn, document_id, content_hash, run_id=run_id)
+    save_extracted_text(conn, content_hash, text, False, "ok", 1)
+
+
+def test_search_ranks_filters_and_follows_text_updates(tmp_path):
+    conn = connect(f"sqlite:///{tmp_path}/monitor.db")
+    init_db(conn)
+    _add(conn, "k1", "Askøy", "kommune", "https://k1.no/plan.pdf", "PDF", "h1", "Frivilligsentralen og KS plattform for samarbeid. Frivilligsentralen får støtte.")
+    _add(conn, "k2", "Bømlo", "kommune", "https://k2.no/sak", "HTML", "h2", "Kommunestyret omtalte frivilligsentralen kort.")
+    _add(conn, "f1", "Vestland", "fylke", "https://f1.no/strategi.pdf", "PDF", "h3", "Regional strategi uten treff.", run_id=2)
+
+    rows = search_texts(conn, fts_query("frivilligsentralen"))
+    assert [r["jurisdiction"] for r in rows] == ["Askøy", "Bømlo"]
+    assert "[Frivilligsentralen]" in rows[0]["snippet"]
+
+    # "KS-plattform" would be a column filter in raw FTS5 syntax; quoted it is the phrase "ks plattform".
+    assert [r["jurisdiction"] for r in search_texts(conn, fts_query("KS-plattform"))] == ["Askøy"]
+    assert search_texts(conn, fts_query("KS idrettslag")) == []
+    assert [r["url"] for r in search_texts(conn, fts_query("frivilligsentralen"), doc_type="html")] == ["https://k2.no/sak"]
+    assert search_texts(conn, fts_query("strategi"), jurisdiction_type="fylke", run_id=2)[0]["jurisdiction"] == "Vestland"
+    assert search_texts(conn, fts_query("strategi"), run_id=1) == []
+
+    save_extracted_text(conn, "h2", "Ny tekst om idrettslag.", False, "ok", 1)
+    assert [r["jurisdiction"] for r in search_texts(conn, fts_query("frivilligsentralen"))] == ["Askøy"]
+    assert [r["jurisdiction"] for r in search_texts(conn, fts_query("idrettslag"))] == ["Bømlo"]
+
+
+def test_search_cli_rejects_invalid_raw_query(monkeypatch, tmp_path, capsys):
+    monkeypatch.setenv("DB_URL", f"sqlite:///{tmp_path}/monitor.db")
+    args = build_parser().parse_args(["search", "--raw", '"frivillig'])
+    with pytest.raises(SystemExit) as exc:
+        args.func(args)
+    assert "Ugyldig søkeuttrykk" in str(exc.value.code)
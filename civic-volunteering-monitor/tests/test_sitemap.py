@@ -1,4 +1,9 @@
-from monitor.crawl.sitemap import parse_sitemap_urls
+import gzip
+
+from monitor.crawl.dispatcher import crawl_jurisdiction
+from monitor.crawl.fetch import SimpleResponse
+from monitor.crawl.sitemap import SitemapEntry, collect_sitemap_entries, parse_sitemap_urls
+from monitor.store.page_cache import PageCache
 
 
 def test_parse_sitemap_urls():
@@ -10,3 +15,53 @@ def test_parse_sitemap_urls():
     """
     urls = parse_sitemap_urls(xml)
     assert urls == ["https://example.no/a", "https://example.no/b"]
+
+
+def test_sitemap_index_is_followed_and_gzip_decoded(monkeypatch):
+    index = b"""<sitemapindex xmlns='http://www.sitemaps.org/schemas/sitemap/0.9'>
+      <sitemap><loc>https://example.no/sitemap-1.xml.gz</loc></sitemap>
+    </sitemapindex>"""
+    child = gzip.compress(
+        b"""<urlset xmlns='http://www.sitemaps.org/schemas/sitemap/0.9'>
+      <url><loc>https://example.no/frivillighet</loc><lastmod>2024-01-05</lastmod></url>
+    </urlset>"""
+    )
+
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        return SimpleResponse(200, "", index if url.endswith("sitemap.xml") else child, {})
+
+    monkeypatch.setattr("monitor.crawl.sitemap.fetch_with_retries", fake_fetch)
+    entries = collect_sitemap_entries(["https://example.no/sitemap.xml"], "x", 3)
+    assert entries == [SitemapEntry("https://example.no/frivillighet", "2024-01-05")]
+
+
+def test_crawl_skips_sitemap_pages_unchanged_since_last_fetch(monkeypatch, tmp_path):
+    fetched = []
+
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        fetched.append(url)
+        if url.endswith("sitemap.xml"):
+            return SimpleResponse(
+                200,
+                "",
+                b"<urlset><url><loc>https://example.no/frivillighet-plan</loc><lastmod>2024-01-05</lastmod></url></urlset>",
+                {},
+            )
+        return SimpleResponse(404, "", b"", {})
+
+    monkeypatch.setattr("monitor.crawl.dispatcher.fetch_with_retries", fake_fetch)
+    monkeypatch.setattr("monitor.crawl.sitemap.fetch_with_retries", fake_fetch)
+
+    last_fetched = {"https://example.no/frivillighet-plan": "2024-02-01T00:00:00+00:00"}
+    page_cache = PageCache(str(tmp_path / "pages.sqlite"))
+    page_cache.put("https://example.no/frivillighet-plan", None, None, "h", [("https://example.no/docs/plan.pdf", "Plan")])
+
+    result = crawl_jurisdiction("https://example.no", 3, "x", last_fetched=last_fetched, page_cache=page_cache)
+    assert result.sitemap_unchanged == 1
+    assert "https://example.no/frivillighet-plan" not in fetched
+    # The documents it links to are still checked for changes.
+    assert [d["url"] for d in result.docs_found] == ["https://example.no/docs/plan.pdf"]
+
+    # Without cached links the page is fetched again rather than dropped.
+    result = crawl_jurisdiction("https://example.no", 3, "x", last_fetched=last_fetched)
+    assert "https://example.no/frivillighet-plan" in fetched
@@ -0,0 +1,217 @@
+import pytest
+
+from monitor.config import Settings
+from monitor.crawl.dispatcher import CrawlResult
+from monitor.crawl.fetch import SimpleResponse
+from monitor.ingest.excel_loader import JurisdictionRow
+from monitor.pipeline import run_jurisdictions
+from monitor.stages import CACHE_LLM, CACHE_STATS, STAGE_CLASSIFY, STAGE_EXTRACT, STAGE_HANDLERS, run_stage
+from monitor.store.db import (
+    claim_work,
+    connect,
+    create_run,
+    enqueue_work,
+    finish_work,
+    init_db,
+    record_cache_stat,
+    requeue_running,
+    run_cache_stats,
+    run_findings,
+    work_counts,
+)
+from monitor.store.writer import DbWriter
+
+
+@pytest.fixture
+def writers():
+    opened = []
+    yield opened
+    for w in opened:
+        w.close()
+
+
+BODY = "<main><h1>Frivillighetsplan</h1><p>Kommunen samarbeider med frivilligheten.</p></main>"
+
+
+def _serve(monkeypatch, body):
+    def fake_fetch(url, user_agent, timeout, limiter=None, retries=3, headers=None):
+        return SimpleResponse(200, body, body.encode(), {"Content-Type": "text/html"})
+
+    monkeypatch.setattr("monitor.pipeline.fetch_with_retries", fake_fetch)
+
+
+def _rows(n):
+    return [JurisdictionRow(f"j{i}", "Kommune", "kommune", f"https://k{i}.example.no") for i in range(1, n + 1)]
+
+
+def _setup(monkeypatch, tmp_path, writers, jurisdictions=1, body=BODY):
+    def fake_crawl(base_url, timeout, user_agent, playwright_enabled=False, **kwargs):
+        return CrawlResult(1, [{"url": f"{base_url}/plan", "title": "Plan"}], 0, 0, [])
+
+    monkeypatch.setattr("monitor.pipeline.crawl_jurisdiction", fake_crawl)
+    _serve(monkeypatch, body)
+    settings = Settings(db_url=f"sqlite:///{tmp_path}/monitor.db", blob_dir=str(tmp_path / "blob"), openai_api_key="test")
+    conn = connect(settings.db_url)
+    init_db(conn)
+    run_jurisdictions(settings, conn, create_run(conn), _rows(jurisdictions), 1)
+    writers.append(DbWriter(conn))
+    return settings, conn, writers[-1]
+
+
+def test_download_extract_and_classify_run_as_separate_stages(monkeypatch, tmp_path, writers):
+    settings, conn, writer = _setup(monkeypatch, tmp_path, writers)
+    assert conn.execute("SELECT extracted_text FROM document_versions").fetchone()[0] is None
+    assert work_counts(conn, STAGE_EXTRACT) == {"pending": 1}
+
+    assert run_stage(settings, writer, STAGE_EXTRACT, workers=2) == 1
+    row = conn.execute(
+        "SELECT dv.id, dv.extracted_text, dv.extract_status, et.text FROM document_versions dv JOIN extracted_texts et USING (content_hash)"
+    ).fetchone()
+    assert "samarbeider med frivilligheten" in row["text"]
+    assert row["extracted_text"] is None
+    assert row["extract_status"] == "ok"
+
+    seen = []
+    monkeypatch.setattr("monitor.stages.classify_document", lambda s, text, meta: seen.append(meta) or ({"category": "plan"}, 100))
+    assert run_stage(settings, writer, STAGE_CLASSIFY, workers=1) == 1
+    assert seen == [{"url": "https://k1.example.no/plan", "title": "Plan", "jurisdiction": "Kommune", "doc_type": "HTML"}]
+    assert conn.execute("SELECT llm_json FROM document_versions").fetchone()[0] == '{"category": "plan"}'
+
+    # Re-extracting unchanged text does not queue the document for classification again.
+    enqueue_work(conn, STAGE_EXTRACT, row["id"])
+    run_stage(settings, writer, STAGE_EXTRACT, workers=1)
+    assert work_counts(conn, STAGE_CLASSIFY) == {"done": 1}
+
+
+def test_failing_items_are_retried_then_marked_failed(monkeypatch, tmp_path, writers):
+    settings, conn, writer = _setup(monkeypatch, tmp_path, writers)
+    calls = []
+
+    def broken(*args):
+        calls.append(args[-1])
+        raise RuntimeError("LLM nede")
+
+    run_stage(settings, writer, STAGE_EXTRACT, workers=1)
+    monkeypatch.setitem(STAGE_HANDLERS, STAGE_CLASSIFY, broken)
+    assert run_stage(settings, writer, STAGE_CLASSIFY, workers=1) == 0
+    assert len(calls) == 3
+    assert work_counts(conn, STAGE_CLASSIFY) == {"failed": 1}
+
+
+def test_identical_documents_are_extracted_once(monkeypatch, tmp_path, writers):
+    settings, conn, writer = _setup(monkeypatch, tmp_path, writers, jurisdictions=3)
+    parsed = []
+    monkeypatch.setattr("monitor.stages._extract_blob", lambda path, label: parsed.append(label) or ("tekst", False, "ok", 5))
+
+    assert run_stage(settings, writer, STAGE_EXTRACT, workers=1) == 3
+    assert len(parsed) == 1
+    assert conn.execute("SELECT COUNT(*) FROM extracted_texts").fetchone()[0] == 1
+    assert [tuple(r) for r in run_cache_stats(conn, 1)] == [("extract", 2, 1, 0)]
+    assert work_counts(conn, STAGE_CLASSIFY) == {"pending": 3}
+
+
+def test_near_duplicate_versions_reuse_classification(monkeypatch, tmp_path, writers):
+    plan = " ".join(f"Tiltak {i}: kommunen støtter lag og foreninger i nærmiljøet." for i in range(300))
+    settings, conn, writer = _setup(monkeypatch, tmp_path, writers, jurisdictions=2, body=f"<main><p>{plan}</p><p>Oppdatert 01.02.2024</p></main>")
+    calls = []
+    monkeypatch.setattr("monitor.stages.classify_document", lambda s, text, meta: calls.append(meta["url"]) or ({"category": "plan"}, 100))
+    run_stage(settings, writer, STAGE_EXTRACT, workers=1)
+    run_stage(settings, writer, STAGE_CLASSIFY, workers=1)
+    # Both kommuner publish the same text, so only the first is sent to the LLM.
+    assert calls == ["https://k1.example.no/plan"]
+    assert [tuple(r) for r in run_cache_stats(conn, 1)] == [("classify", 1, 1, 0), ("extract", 1, 1, 0), ("llm", 0, 1, 0)]
+
+    # A regenerated page with a new timestamp is a new version by bytes but not by text.
+    # Copies published by other kommuner are still findings for them.
+    assert len(run_findings(conn, 1)) == 2
+    _serve(monkeypatch, f"<main><p>{plan}</p><p>Oppdatert 03.04.2024</p></main>")
+    regenerated_run = create_run(conn)
+    run_jurisdictions(settings, conn, regenerated_run, _rows(1), 1, writer=writer)
+    run_stage(settings, writer, STAGE_EXTRACT, workers=1)
+    latest = conn.execute("SELECT id, near_duplicate_of, llm_json FROM document_versions ORDER BY id DESC LIMIT 1").fetchone()
+    assert latest["near_duplicate_of"] == 1
+    assert latest["llm_json"] == '{"category": "plan"}'
+    assert work_counts(conn, STAGE_CLASSIFY) == {"done": 2}
+    assert run_findings(conn, regenerated_run) == []
+
+    _serve(monkeypatch, "<main><p>Ny sak om helt andre ting: vei, vann og avløp.</p></main>")
+    changed_run = create_run(conn)
+    run_jurisdictions(settings, conn, changed_run, _rows(1), 1, writer=writer)
+    run_stage(settings, writer, STAGE_EXTRACT, workers=1)
+    assert work_counts(conn, STAGE_CLASSIFY) == {"done": 2, "pending": 1}
+    assert len(run_findings(conn, changed_run)) == 1
+
+
+def test_llm_responses_are_cached_by_prompt_and_text(monkeypatch, tmp_path, writers):
+    settings, conn, writer = _setup(monkeypatch, tmp_path, writers)
+    calls = []
+    monkeypatch.setattr("monitor.stages.classify_document", lambda s, text, meta: calls.append(text) or ({"category": "plan"}, 250))
+    run_stage(settings, writer, STAGE_EXTRACT, workers=1)
+    run_stage(settings, writer, STAGE_CLASSIFY, workers=1)
+
+    def reclassify():
+        conn.execute("UPDATE document_versions SET llm_json=NULL")
+        conn.commit()
+        enqueue_work(conn, STAGE_CLASSIFY, 1)
+        run_stage(settings, writer, STAGE_CLASSIFY, workers=1)
+
+    # The process counts this invocation's hits even though the version belongs to run 1.
+    CACHE_STATS.reset()
+    reclassify()
+    assert len(calls) == 1
+    assert conn.execute("SELECT llm_json FROM document_versions").fetchone()[0] == '{"category": "plan"}'
+    assert tuple(run_cache_stats(conn, 1)[-1]) == ("llm", 1, 1, 250)
+    assert CACHE_STATS.get(CACHE_LLM) == (1, 0, 250)
+
+    # A new system prompt is a different request.
+    monkeypatch.setattr("monitor.classify.classify_doc.SYSTEM_PROMPT", "Ny instruks.")
+    reclassify()
+    assert len(calls) == 2
+
+
+def test_cache_stats_without_run_share_one_row(tmp_path):
+    conn = connect(f"sqlite:///{tmp_path}/monitor.db")
+    init_db(conn)
+    record_cache_stat(conn, None, CACHE_LLM, True, 10)
+    record_cache_stat(conn, None, CACHE_LLM, False)
+    assert [tuple(r) for r in conn.execute("SELECT run_id, cache, hits, misses, saved FROM cache_stats")] == [(0, "llm", 1, 1, 10)]
+
+
+def test_requeue_takes_back_only_expired_work(tmp_path):
+    conn = connect(f"sqlite:///{tmp_path}/monitor.db")
+    init_db(conn)
+    for version_id in (1, 2):
+        enqueue_work(conn, STAGE_EXTRACT, version_id)
+    live = claim_work(conn, STAGE_EXTRACT, "other-process", 300, now=1000.0)
+    stale = claim_work(conn, STAGE_EXTRACT, "crashed-process", 300, now=500.0)
+
+    # Another process still renewing its lease keeps its item; the crashed one's goes back in the queue.
+    assert requeue_running(conn, STAGE_EXTRACT, now=1100.0) == 1
+    assert work_counts(conn, STAGE_EXTRACT) == {"pending": 1, "running": 1}
+    finish_work(conn, stale["id"], "crashed-process")
+    assert work_counts(conn, STAGE_EXTRACT) == {"pending": 1, "running": 1}
+    finish_work(conn, live["id"], "other-process")
+    assert work_counts(conn, STAGE_EXTRACT) == {"done": 1, "pending": 1}
+
+
+def test_reextracting_everything_keeps_classification_and_text(monkeypatch, tmp_path, writers):
+    settings, conn, writer = _setup(monkeypatch, tmp_path, writers)
+    monkeypatch.setattr("monitor.stages.classify_document", lambda s, text, meta: ({"category": "plan"}, 100))
+    run_stage(settings, writer, STAGE_EXTRACT, workers=1)
+    run_stage(settings, writer, STAGE_CLASSIFY, workers=1)
+    text = conn.execute("SELECT text FROM extracted_texts").fetchone()[0]
+
+    # `monitor extract --all`: parsed again, but unchanged text does not send the corpus back to the LLM.
+    parsed = []
+    monkeypatch.setattr("monitor.stages._extract_blob", lambda path, label: parsed.append(label) or (text, False, "ok", 5))
+    enqueue_work(conn, STAGE_EXTRACT, 1)
+    run_stage(settings, writer, STAGE_EXTRACT, workers=1, options={"reuse": False})
+    assert len(parsed) == 1
+    assert work_counts(conn, STAGE_CLASSIFY) == {"done": 1}
+
+    # A re-extraction that fails keeps the text already there.
+    monkeypatch.setattr("monitor.stages._extract_blob", lambda path, label: ("", False, "timeout", 5))
+    enqueue_work(conn, STAGE_EXTRACT, 1)
+    run_stage(settings, writer, STAGE_EXTRACT, workers=1, options={"reuse": False})
+    assert tuple(conn.execute("SELECT text, extract_status FROM extracted_texts").fetchone()) == (text, "ok")
+    assert work_counts(conn, STAGE_CLASSIFY) == {"done": 1}
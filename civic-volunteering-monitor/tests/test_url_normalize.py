@@ -1,4 +1,4 @@
-from monitor.ingest.url_normalize import normalize_website_url
+from monitor.ingest.url_normalize import canonical_url, normalize_website_url, same_site
 
 
 def test_normalize_add_https_and_strip():
@@ -7,3 +7,16 @@ def test_normalize_add_https_and_strip():
 
 def test_normalize_keeps_domain_only():
     assert normalize_website_url("http://www.kommune.no/politikk") == "https://www.kommune.no"
+
+
+def test_canonical_url_drops_noise():
+    assert canonical_url("http://Example.no:80/planer/?utm_source=x&b=2&a=1#topp") == "https://example.no/planer?a=1&b=2"
+    assert canonical_url("https://example.no/side;jsessionid=ABC?sid=1") == "https://example.no/side"
+    assert canonical_url("https://example.no") == "https://example.no/"
+
+
+def test_canonical_url_unifies_www_variants_with_site_host():
+    assert canonical_url("https://example.no/frivillighet", "www.example.no") == "https://www.example.no/frivillighet"
+    assert canonical_url("https://other.no/a", "www.example.no") == "https://other.no/a"
+    assert same_site("https://www.kommune.no/a", "https://kommune.no")
+    assert not same_site("https://nabokommune.no/a", "https://kommune.no")
@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from monitor.store.db import connect, get_or_create_source, init_db
+from monitor.store.writer import DbWriter
+
+
+@pytest.fixture
+def conn(tmp_path):
+    c = connect(f"sqlite:///{tmp_path}/monitor.db")
+    init_db(c)
+    return c
+
+
+def test_connection_uses_wal(conn):
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_concurrent_writers_are_batched_through_one_connection(conn):
+    with DbWriter(conn) as writer:
+        def work(t):
+            for i in range(100):
+                writer.call(get_or_create_source, f"j{t}", f"https://k{t}.example.no/{i}", "")
+
+        threads = [threading.Thread(target=work, args=(t,)) for t in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0] == 800
+    assert writer.calls == 800
+    assert writer.batches < writer.calls
+
+
+def test_failing_call_does_not_undo_the_rest_of_its_batch(conn):
+    def broken(c):
+        c.execute("INSERT INTO sources(jurisdiction_id, url, title) VALUES ('j', 'https://x.no/broken', '')")
+        raise RuntimeError("feil")
+
+    with DbWriter(conn) as writer:
+        writer.submit(get_or_create_source, "j", "https://x.no/a", "")
+        failed = writer.submit(broken)
+        writer.submit(get_or_create_source, "j", "https://x.no/b", "")
+        writer.flush()
+        with pytest.raises(RuntimeError):
+            failed.result()
+    assert [r[0] for r in conn.execute("SELECT url FROM sources ORDER BY url")] == ["https://x.no/a", "https://x.no/b"]